@@ -0,0 +1,46 @@
+"""Add machine state duration rollup table
+
+Revision ID: 0008_add_state_duration_rollup
+Revises: 0007_add_email_recipients
+Create Date: 2026-10-17
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = "0008_add_state_duration_rollup"
+down_revision: Union[str, None] = "0007_add_email_recipients"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Hourly time-in-state totals, upserted on every state transition.
+    # The unique (machine_id, state, bucket_hour) index serves both the upsert and range reads.
+    op.create_table(
+        "machine_state_duration_rollup",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("machine_id", sa.String(length=100), nullable=False),
+        sa.Column("state", sa.String(length=20), nullable=False),
+        sa.Column("bucket_hour", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("seconds", sa.Float(), nullable=False, server_default=sa.text("0")),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column(
+            "updated_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("NOW()"),
+            nullable=False,
+        ),
+        sa.UniqueConstraint(
+            "machine_id", "state", "bucket_hour",
+            name="uq_machine_state_duration_rollup_bucket",
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("machine_state_duration_rollup")
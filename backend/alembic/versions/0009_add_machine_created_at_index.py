@@ -0,0 +1,42 @@
+"""Add covering index for machine listing by created_at
+
+Revision ID: 0009_add_machine_created_at_index
+Revises: 0008_add_state_duration_rollup
+Create Date: 2026-10-17
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0009_add_machine_created_at_index"
+down_revision: Union[str, None] = "0008_add_state_duration_rollup"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Serves list_machines' ORDER BY created_at DESC NULLS LAST, id DESC keyset scan
+    # ((created_at, id) is unique, created_at alone is not); the INCLUDE columns let the
+    # summary listing be answered from the index alone.
+    # CONCURRENTLY cannot run inside a transaction block.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_machine_created_at_desc",
+            "machine",
+            [sa.text("created_at DESC NULLS LAST"), sa.text("id DESC")],
+            unique=False,
+            postgresql_include=["name", "status", "criticality"],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_machine_created_at_desc",
+            table_name="machine",
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,40 @@
+"""Add composite index for per-machine sensor_data time-range reads
+
+Revision ID: 0010_add_sensor_data_machine_ts_index
+Revises: 0009_add_machine_created_at_index
+Create Date: 2026-10-17
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0010_add_sensor_data_machine_ts_index"
+down_revision: Union[str, None] = "0009_add_machine_created_at_index"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Serves report_service._fetch_rows (machine filter, newest rows first, LIMIT) as a
+    # single index range scan instead of intersecting the single-column indexes and sorting.
+    # CONCURRENTLY cannot run inside a transaction block.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_sensor_data_machine_ts",
+            "sensor_data",
+            ["machine_id", sa.text("timestamp DESC")],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_sensor_data_machine_ts",
+            table_name="sensor_data",
+            postgresql_concurrently=True,
+        )
@@ -1,6 +1,7 @@
 from datetime import datetime, timedelta
 from typing import Dict, Any, List, Tuple, Optional
 from functools import lru_cache
+from itertools import islice
 import time
 import os
 import re
@@ -2542,14 +2543,12 @@ async def get_current_dashboard_data(
     # Calculate stability severities for decision hierarchy (if in PRODUCTION)
     stability_severity_dict = {}
     if is_in_production and len(rows) >= 2:
-        # Calculate stability for each metric (simplified - use last 10 minutes if available)
-        from datetime import datetime, timedelta
-        now = datetime.utcnow()
-        ten_min_ago = now - timedelta(minutes=10)
-        recent_rows = [r for r in rows if r.get("TrendDate") and (isinstance(r.get("TrendDate"), datetime) and r.get("TrendDate") >= ten_min_ago or True)]  # Fallback to all if no timestamps
+        # Calculate stability for each metric over the last 20 timestamped rows
+        # (walk back from the end instead of copying every row first)
+        recent_rows = list(islice((r for r in reversed(rows) if r.get("TrendDate")), 20))
         
         for key in all_metric_keys:
-            recent_values = [as_float(r.get(key)) for r in recent_rows[-20:] if as_float(r.get(key)) is not None]  # Last 20 points
+            recent_values = [v for v in (as_float(r.get(key)) for r in recent_rows) if v is not None]  # Last 20 points
             if len(recent_values) >= 3:
                 current_std = statistics.stdev(recent_values) if len(recent_values) > 1 else 0.0
                 baseline_std = base.get("std", 0.0) if (base := baseline.get(key, {})) else 0.0
@@ -2863,6 +2862,8 @@ async def log_material_change(
             logger.info(
                 f"Updated machine {machine.id} metadata: current_material = {old_material} → {material_id}"
             )
+            from app.services.mssql_extruder_poller import mssql_extruder_poller
+            mssql_extruder_poller.invalidate_machine_metadata()
         else:
             logger.warning(f"Machine not found for material change (machine_id={machine_id})")
         
@@ -19,7 +19,7 @@ from app.schemas.machine_state import (
     MachineStateBulkResponse, ProcessEvaluationRequest, ProcessEvaluationResponse,
     TrafficLightStatus, MachineStateConfigRequest, MachineStateConfigResponse
 )
-from app.services.machine_state_manager import MachineStateService
+from app.services.machine_state_manager import MachineStateService, invalidate_thresholds_cache
 from app.services.machine_state_service import get_machine_detector, get_all_machine_states
 
 router = APIRouter(prefix="/machine-state", tags=["machine-state"])
@@ -398,6 +398,7 @@ async def update_machine_thresholds(
         await db.refresh(existing)
         
         # Reinitialize detector with new thresholds
+        invalidate_thresholds_cache(machine_id)
         await state_service.initialize_machine_detector(machine_id)
         
         return MachineStateThresholds.from_orm(existing)
@@ -440,6 +441,8 @@ async def delete_machine_thresholds(
             await db.commit()
         
         # Cleanup detector
+        invalidate_thresholds_cache(machine_id)
+        state_service = MachineStateService(db)
         await state_service.cleanup_detector(machine_id)
         
         return {"message": f"Thresholds deleted for machine {machine_id}"}
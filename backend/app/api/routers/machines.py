@@ -20,12 +20,20 @@ router = APIRouter(prefix="/machines", tags=["machines"])
 
 @router.get("", response_model=List[MachineRead])
 async def list_machines(
+    summary: bool = Query(False, description="Only return id, name, status, criticality and timestamps"),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Page size; all machines when omitted"),
+    cursor: Optional[datetime] = Query(None, description="created_at of the last machine of the previous page"),
+    cursor_id: Optional[UUID] = Query(None, description="id of the last machine of the previous page"),
     session: AsyncSession = Depends(get_session),
     current_user: User = Depends(get_current_user),
 ):
-    machines = await machine_service.list_machines(session)
-    # Convert dict results to Pydantic models
-    return [MachineRead.model_validate(m) for m in machines]
+    if cursor is not None and cursor_id is None:
+        raise HTTPException(status_code=400, detail="cursor requires cursor_id")
+    machines = await machine_service.list_machines(
+        session, summary=summary, limit=limit, cursor=cursor, cursor_id=cursor_id
+    )
+    # Convert row dataclasses to Pydantic models
+    return [MachineRead.model_validate(m, from_attributes=True) for m in machines]
 
 
 @router.post("", response_model=MachineRead, status_code=status.HTTP_201_CREATED)
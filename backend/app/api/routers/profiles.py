@@ -78,6 +78,8 @@ async def create_profile(
         # Explicitly start baseline learning to ensure proper initialization
         await baseline_learning_service.start_baseline_learning(session, new_profile.id)
         await session.commit()
+        from app.services.mssql_extruder_poller import mssql_extruder_poller
+        mssql_extruder_poller.invalidate_profiles()
         
         logger.info(
             f"Created profile {new_profile.id} for "
@@ -226,6 +228,8 @@ async def rollback_profile(
     session.add(target_profile)
     
     await session.commit()
+    from app.services.mssql_extruder_poller import mssql_extruder_poller
+    mssql_extruder_poller.invalidate_profiles()
     
     logger.info(f"Profile {profile_id} rolled back to version {target_profile.version} by user {current_user.email}")
     
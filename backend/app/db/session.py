@@ -1,3 +1,4 @@
+import orjson
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 
 from app.core.config import get_settings
@@ -9,7 +10,15 @@ DATABASE_URL = (
     f"@{settings.postgres_host}:{settings.postgres_port}/{settings.postgres_db}"
 )
 
-engine = create_async_engine(DATABASE_URL, echo=settings.debug, future=True)
+
+def _json_serializer(obj) -> str:
+    # JSON columns (prediction metadata with snapshot/features/ai_raw, etc.) are float-heavy;
+    # orjson encodes them several times faster than the stdlib encoder. NaN/Infinity become
+    # null, which Postgres accepts where the stdlib's bare NaN tokens are rejected.
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY).decode()
+
+
+engine = create_async_engine(DATABASE_URL, echo=settings.debug, future=True, json_serializer=_json_serializer)
 
 AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
@@ -44,7 +44,8 @@ from app.api.routers import (
 from app.core.config import get_settings
 from app.db.session import AsyncSessionLocal
 from app.services.mssql_extruder_poller import mssql_extruder_poller
-from app.services import notification_service
+from app.services.machine_state_service import start_state_writer, stop_state_writer
+from app.services import notification_service, prediction_service
 from app.services.incident_manager import incident_manager
 
 settings = get_settings()
@@ -232,6 +233,8 @@ async def startup_event():
     
     # Optional: MSSQL read-only extruder poller (no OPC UA). Opt-in via env vars.
     mssql_extruder_poller.start(loop)
+    # Batched writer for detected machine state transitions
+    start_state_writer(loop)
     await asyncio.sleep(1)
     logger.info("Startup complete - real sensor data processing ready")
 
@@ -260,5 +263,11 @@ async def startup_event():
 async def shutdown_event():
     # MSSQL poller shutdown
     await mssql_extruder_poller.stop()
+    await stop_state_writer()
+    # Alarm notifications feed the email queue, so drain them first
+    await notification_service.stop_notification_worker()
+    await notification_service.stop_email_worker()
+    await notification_service.close_slack_client()
+    await prediction_service.close_ai_client()
     logger.info("Backend shutdown complete - MSSQL-based real sensor data processing stopped")
 
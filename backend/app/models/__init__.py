@@ -8,6 +8,7 @@ from app.models.machine_state import (
     MachineState,
     MachineStateThresholds,
     MachineStateTransition,
+    MachineStateDurationRollup,
     MachineStateAlert,
     MachineProcessEvaluation,
     MachineStateEnum,
@@ -6,7 +6,7 @@ from datetime import datetime
 from typing import Optional, Dict, Any
 from enum import Enum
 
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, JSON, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, JSON, ForeignKey, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
@@ -185,6 +185,30 @@ class MachineStateTransition(Base):
         return f"<MachineStateTransition {self.machine_id}: {self.from_state} → {self.to_state}>"
 
 
+class MachineStateDurationRollup(Base):
+    """Hourly time-in-state totals, maintained incrementally on each state transition"""
+    __tablename__ = "machine_state_duration_rollup"
+    __table_args__ = (
+        UniqueConstraint('machine_id', 'state', 'bucket_hour', name='uq_machine_state_duration_rollup_bucket'),
+    )
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    machine_id = Column(String(100), nullable=False)  # Leading column of the unique bucket index
+    
+    # State and hour bucket (UTC, truncated to the hour)
+    state = Column(String(20), nullable=False)
+    bucket_hour = Column(DateTime(timezone=True), nullable=False)
+    
+    # Seconds spent in the state within the bucket
+    seconds = Column(Float, nullable=False, default=0.0)
+    
+    # Timestamps
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<MachineStateDurationRollup {self.machine_id}: {self.state} @ {self.bucket_hour} = {self.seconds:.0f}s>"
+
+
 class MachineStateAlert(Base):
     """Alerts generated from machine state changes"""
     __tablename__ = "machine_state_alert"
@@ -350,6 +350,8 @@ class BaselineLearningService:
             )
             
             await session.commit()
+            from app.services.mssql_extruder_poller import mssql_extruder_poller
+            mssql_extruder_poller.invalidate_profiles()
             logger.info(f"Finalized baseline for profile {profile_id}")
             return True
             
@@ -2,76 +2,215 @@
 Machine Service - Using Raw SQL to avoid ORM relationship issues
 All operations use direct SQL queries instead of SQLAlchemy ORM
 """
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple, Union
 from uuid import UUID
-from datetime import datetime
+from dataclasses import dataclass
+from datetime import date, datetime
+from functools import lru_cache
 import json
 
-from sqlalchemy import text
+from sqlalchemy import text, TextClause
 from sqlalchemy.ext.asyncio import AsyncSession
 from loguru import logger
 
 from app.schemas.machine import MachineCreate, MachineUpdate
 
+# Plain columns that update_machine may SET directly (metadata needs a jsonb cast)
+_UPDATABLE_FIELDS = ("name", "location", "description", "status", "criticality", "last_service_date")
 
-async def list_machines(session: AsyncSession) -> List[Dict[str, Any]]:
-    """List all machines using raw SQL"""
-    result = await session.execute(
-        text("""
-            SELECT 
-                id, name, location, description, status, criticality,
-                metadata, last_service_date, created_at, updated_at
-            FROM machine
-            ORDER BY created_at DESC
+# Statements are built once so SQLAlchemy's compiled-statement cache can reuse them
+_MACHINE_COLUMNS = """
+    id, name, location, description, status, criticality,
+    metadata, last_service_date, created_at, updated_at
+"""
+
+
+# Listing order; (created_at, id) is unique, so it is also the keyset cursor.
+# Matches ix_machine_created_at_desc, machines without created_at come last.
+_LIST_ORDER = "ORDER BY created_at DESC NULLS LAST, id DESC"
+
+
+def _list_sql(columns: str, cursor: Optional[str]) -> TextClause:
+    """Build a keyset-paginated machine listing served by ix_machine_created_at_desc
+    
+    cursor: None for the first page (LIMIT NULL returns every machine), "ts" to continue
+    after a machine with created_at, "null_ts" to continue among machines without one.
+    """
+    if cursor == "ts":
+        # Each branch is an index range scan; the NULL created_at tail follows the timed rows
+        return text(f"""
+            SELECT {columns} FROM (
+                SELECT * FROM (
+                    SELECT {columns} FROM machine
+                    WHERE (created_at, id) < (:cursor, CAST(:cursor_id AS UUID))
+                    {_LIST_ORDER} LIMIT :limit
+                ) AS timed
+                UNION ALL
+                SELECT * FROM (
+                    SELECT {columns} FROM machine
+                    WHERE created_at IS NULL
+                    {_LIST_ORDER} LIMIT :limit
+                ) AS untimed
+            ) AS page
+            {_LIST_ORDER}
+            LIMIT :limit
         """)
+    where = "WHERE created_at IS NULL AND id < CAST(:cursor_id AS UUID)" if cursor == "null_ts" else ""
+    return text(f"""
+        SELECT {columns}
+        FROM machine
+        {where}
+        {_LIST_ORDER}
+        LIMIT :limit
+    """)
+
+
+# Summary projection: skips description/metadata text and JSONB payloads
+_SUMMARY_COLUMNS = ("id", "name", "status", "criticality", "created_at", "updated_at")
+
+# {(summary, cursor kind): statement}
+_SQL_LISTS = {
+    (summary, cursor): _list_sql(", ".join(_SUMMARY_COLUMNS) if summary else _MACHINE_COLUMNS, cursor)
+    for summary in (False, True)
+    for cursor in (None, "ts", "null_ts")
+}
+
+_SQL_GET = text(f"""
+    SELECT {_MACHINE_COLUMNS}
+    FROM machine
+    WHERE id = CAST(:machine_id AS UUID)
+""")
+
+_SQL_INSERT = text("""
+    INSERT INTO machine (
+        id, name, location, description, status, criticality,
+        metadata, last_service_date, created_at, updated_at
+    ) VALUES (
+        CAST(:id AS UUID), :name, :location, :description, :status, :criticality,
+        CAST(:metadata AS jsonb), :last_service_date, NOW(), NOW()
+    )
+""")
+
+# Machine state tables are keyed by both machine_uuid and the legacy string machine_id.
+# Use separate parameters for UUID and VARCHAR comparisons to avoid type inference issues
+_SQL_DELETE_STATE_TABLES = tuple(
+    text(
+        f"DELETE FROM {table} WHERE machine_uuid = CAST(:machine_id_uuid AS UUID) "
+        f"OR machine_id = CAST(:machine_id_str AS VARCHAR)"
+    )
+    for table in (
+        "machine_state",
+        "machine_state_thresholds",
+        "machine_state_transition",
+        "machine_state_alert",
+        "machine_process_evaluation",
     )
-    rows = result.fetchall()
-    machines = []
-    for row in rows:
-        machines.append({
-            "id": row[0],
-            "name": row[1],
-            "location": row[2] or "",
-            "description": row[3] or "",
-            "status": row[4],
-            "criticality": row[5],
-            "metadata": row[6] if row[6] else {},
-            "last_service_date": row[7],
-            "created_at": row[8],
-            "updated_at": row[9],
-        })
-    return machines
+)
+
+# Child tables keyed by machine_id UUID, in deletion order (sensor_data before sensor)
+_SQL_DELETE_CHILD_TABLES = tuple(
+    text(f"DELETE FROM {table} WHERE machine_id = CAST(:machine_id AS UUID)")
+    for table in ("sensor_data", "prediction", "alarm", "ticket", "sensor")
+)
+
+# State duration rollup only carries the string machine_id
+_SQL_DELETE_STATE_ROLLUP = text(
+    "DELETE FROM machine_state_duration_rollup WHERE machine_id = CAST(:machine_id_str AS VARCHAR)"
+)
+
+_SQL_DELETE_MACHINE = text("DELETE FROM machine WHERE id = CAST(:machine_id AS UUID)")
+
+
+@dataclass(slots=True)
+class MachineRow:
+    """Machine listing row (field order matches _MACHINE_COLUMNS)"""
+    id: UUID
+    name: str
+    location: Optional[str]
+    description: Optional[str]
+    status: str
+    criticality: str
+    metadata: Optional[dict]
+    last_service_date: Optional[date]
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+
+    def __post_init__(self):
+        self.location = self.location or ""
+        self.description = self.description or ""
+        self.metadata = self.metadata or {}
+
+
+@dataclass(slots=True)
+class MachineSummaryRow:
+    """Machine summary listing row (field order matches _SUMMARY_COLUMNS)"""
+    id: UUID
+    name: str
+    status: str
+    criticality: str
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+
+
+def _row_to_machine(row) -> Dict[str, Any]:
+    """Convert a _MACHINE_COLUMNS row to a machine dict (asyncpg already returns uuid.UUID ids)"""
+    (
+        machine_id, name, location, description, status, criticality,
+        metadata, last_service_date, created_at, updated_at,
+    ) = row
+    return {
+        "id": machine_id,
+        "name": name,
+        "location": location or "",
+        "description": description or "",
+        "status": status,
+        "criticality": criticality,
+        "metadata": metadata or {},
+        "last_service_date": last_service_date,
+        "created_at": created_at,
+        "updated_at": updated_at,
+    }
+
+
+async def list_machines(
+    session: AsyncSession,
+    summary: bool = False,
+    limit: Optional[int] = None,
+    cursor: Optional[datetime] = None,
+    cursor_id: Optional[UUID] = None,
+) -> Union[List[MachineRow], List[MachineSummaryRow]]:
+    """List machines (newest first) using raw SQL
+    
+    Without limit every machine is returned. Keyset pagination: pass the created_at and
+    id of the last machine of a page as cursor / cursor_id to get the next page (cursor
+    stays None when that machine has no created_at). With summary=True only id, name,
+    status, criticality and timestamps are selected.
+    """
+    params: Dict[str, Any] = {"limit": limit}
+    if cursor_id is None:
+        if cursor is not None:
+            raise ValueError("cursor requires cursor_id")
+        kind = None
+    else:
+        params["cursor_id"] = str(cursor_id)
+        if cursor is not None:
+            params["cursor"] = cursor
+        kind = "ts" if cursor is not None else "null_ts"
+    
+    result = await session.execute(_SQL_LISTS[summary, kind], params)
+    row_type = MachineSummaryRow if summary else MachineRow
+    return [row_type(*row) for row in result.fetchall()]
 
 
 async def get_machine(session: AsyncSession, machine_id: UUID | str) -> Optional[Dict[str, Any]]:
     """Get machine by ID using raw SQL"""
     machine_id_str = str(machine_id)
-    result = await session.execute(
-        text("""
-            SELECT 
-                id, name, location, description, status, criticality,
-                metadata, last_service_date, created_at, updated_at
-            FROM machine
-            WHERE id = CAST(:machine_id AS UUID)
-        """),
-        {"machine_id": machine_id_str}
-    )
+    result = await session.execute(_SQL_GET, {"machine_id": machine_id_str})
     row = result.fetchone()
     if not row:
         return None
     
-    return {
-        "id": UUID(row[0]) if isinstance(row[0], str) else row[0],
-        "name": row[1],
-        "location": row[2] or "",
-        "description": row[3] or "",
-        "status": row[4],
-        "criticality": row[5],
-        "metadata": row[6] if row[6] else {},
-        "last_service_date": row[7],
-        "created_at": row[8],
-        "updated_at": row[9],
-    }
+    return _row_to_machine(row)
 
 
 async def create_machine(session: AsyncSession, payload: MachineCreate) -> Dict[str, Any]:
@@ -80,18 +219,9 @@ async def create_machine(session: AsyncSession, payload: MachineCreate) -> Dict[
     machine_id = str(uuid4())
     metadata_json = json.dumps(payload.metadata) if payload.metadata else None
     
-    # Build the INSERT statement with proper parameter binding
     # Use jsonb type casting in the SQL
     await session.execute(
-        text("""
-            INSERT INTO machine (
-                id, name, location, description, status, criticality,
-                metadata, last_service_date, created_at, updated_at
-            ) VALUES (
-                CAST(:id AS UUID), :name, :location, :description, :status, :criticality,
-                CAST(:metadata AS jsonb), :last_service_date, NOW(), NOW()
-            )
-        """),
+        _SQL_INSERT,
         {
             "id": machine_id,
             "name": payload.name,
@@ -109,6 +239,20 @@ async def create_machine(session: AsyncSession, payload: MachineCreate) -> Dict[
     return await get_machine(session, machine_id)
 
 
+@lru_cache(maxsize=128)
+def _build_update_sql(fields: Tuple[str, ...], has_metadata: bool) -> TextClause:
+    """Build (and memoize per update shape) the UPDATE statement for update_machine"""
+    set_clauses = [f"{f} = :{f}" for f in fields]
+    if has_metadata:
+        set_clauses.append("metadata = CAST(:metadata AS jsonb)")
+    set_clauses.append("updated_at = NOW()")
+    return text(f"""
+        UPDATE machine
+        SET {', '.join(set_clauses)}
+        WHERE id = CAST(:machine_id AS UUID)
+    """)
+
+
 async def update_machine(
     session: AsyncSession,
     machine_id: UUID | str,
@@ -118,45 +262,20 @@ async def update_machine(
     machine_id_str = str(machine_id)
     update_data = payload.model_dump(exclude_unset=True)
     
-    # Build dynamic UPDATE query
-    set_clauses = []
-    params = {"machine_id": machine_id_str}
+    # Build dynamic UPDATE query from the whitelisted fields present in the payload
+    fields = tuple(f for f in _UPDATABLE_FIELDS if f in update_data)
+    has_metadata = "metadata" in update_data
     
-    if "name" in update_data:
-        set_clauses.append("name = :name")
-        params["name"] = update_data["name"]
-    if "location" in update_data:
-        set_clauses.append("location = :location")
-        params["location"] = update_data["location"]
-    if "description" in update_data:
-        set_clauses.append("description = :description")
-        params["description"] = update_data["description"]
-    if "status" in update_data:
-        set_clauses.append("status = :status")
-        params["status"] = update_data["status"]
-    if "criticality" in update_data:
-        set_clauses.append("criticality = :criticality")
-        params["criticality"] = update_data["criticality"]
-    if "metadata" in update_data:
-        set_clauses.append("metadata = CAST(:metadata AS jsonb)")
-        params["metadata"] = json.dumps(update_data["metadata"]) if update_data["metadata"] else "{}"
-    if "last_service_date" in update_data:
-        set_clauses.append("last_service_date = :last_service_date")
-        params["last_service_date"] = update_data["last_service_date"]
-    
-    if not set_clauses:
+    if not fields and not has_metadata:
         # No updates, just return the machine
         return await get_machine(session, machine_id)
     
-    set_clauses.append("updated_at = NOW()")
-    
-    query = f"""
-        UPDATE machine
-        SET {', '.join(set_clauses)}
-        WHERE id = CAST(:machine_id AS UUID)
-    """
+    params = {"machine_id": machine_id_str}
+    params.update({f: update_data[f] for f in fields})
+    if has_metadata:
+        params["metadata"] = json.dumps(update_data["metadata"]) if update_data["metadata"] else "{}"
     
-    await session.execute(text(query), params)
+    await session.execute(_build_update_sql(fields, has_metadata), params)
     await session.commit()
     
     return await get_machine(session, machine_id)
@@ -168,66 +287,24 @@ async def delete_machine(session: AsyncSession, machine_id: UUID | str) -> None:
     
     try:
         # Delete all related data in the correct order (child tables first)
-        # Using raw SQL to completely avoid ORM relationship issues
+        # Using raw SQL to completely avoid ORM relationship issues.
+        # All statements go through the session's single checked-out connection so the
+        # driver prepares each DELETE once per connection and skips the ORM execute path.
+        conn = await session.connection()
         
         # 1. Delete machine state related data
-        # Use separate parameters for UUID and VARCHAR comparisons to avoid type inference issues
-        await session.execute(
-            text("DELETE FROM machine_state WHERE machine_uuid = CAST(:machine_id_uuid AS UUID) OR machine_id = CAST(:machine_id_str AS VARCHAR)"),
-            {"machine_id_uuid": machine_id_str, "machine_id_str": machine_id_str}
-        )
-        await session.execute(
-            text("DELETE FROM machine_state_thresholds WHERE machine_uuid = CAST(:machine_id_uuid AS UUID) OR machine_id = CAST(:machine_id_str AS VARCHAR)"),
-            {"machine_id_uuid": machine_id_str, "machine_id_str": machine_id_str}
-        )
-        await session.execute(
-            text("DELETE FROM machine_state_transition WHERE machine_uuid = CAST(:machine_id_uuid AS UUID) OR machine_id = CAST(:machine_id_str AS VARCHAR)"),
-            {"machine_id_uuid": machine_id_str, "machine_id_str": machine_id_str}
-        )
-        await session.execute(
-            text("DELETE FROM machine_state_alert WHERE machine_uuid = CAST(:machine_id_uuid AS UUID) OR machine_id = CAST(:machine_id_str AS VARCHAR)"),
-            {"machine_id_uuid": machine_id_str, "machine_id_str": machine_id_str}
-        )
-        await session.execute(
-            text("DELETE FROM machine_process_evaluation WHERE machine_uuid = CAST(:machine_id_uuid AS UUID) OR machine_id = CAST(:machine_id_str AS VARCHAR)"),
-            {"machine_id_uuid": machine_id_str, "machine_id_str": machine_id_str}
-        )
-        
-        # 2. Delete sensor data
-        await session.execute(
-            text("DELETE FROM sensor_data WHERE machine_id = CAST(:machine_id AS UUID)"),
-            {"machine_id": machine_id_str}
-        )
-        
-        # 3. Delete predictions
-        await session.execute(
-            text("DELETE FROM prediction WHERE machine_id = CAST(:machine_id AS UUID)"),
-            {"machine_id": machine_id_str}
-        )
-        
-        # 4. Delete alarms
-        await session.execute(
-            text("DELETE FROM alarm WHERE machine_id = CAST(:machine_id AS UUID)"),
-            {"machine_id": machine_id_str}
-        )
-        
-        # 5. Delete tickets
-        await session.execute(
-            text("DELETE FROM ticket WHERE machine_id = CAST(:machine_id AS UUID)"),
-            {"machine_id": machine_id_str}
-        )
+        state_params = {"machine_id_uuid": machine_id_str, "machine_id_str": machine_id_str}
+        for statement in _SQL_DELETE_STATE_TABLES:
+            await conn.execute(statement, state_params)
+        await conn.execute(_SQL_DELETE_STATE_ROLLUP, {"machine_id_str": machine_id_str})
         
-        # 6. Delete sensors (must be after sensor_data)
-        await session.execute(
-            text("DELETE FROM sensor WHERE machine_id = CAST(:machine_id AS UUID)"),
-            {"machine_id": machine_id_str}
-        )
+        # 2. Delete sensor data, predictions, alarms, tickets and sensors (sensors after sensor_data)
+        params = {"machine_id": machine_id_str}
+        for statement in _SQL_DELETE_CHILD_TABLES:
+            await conn.execute(statement, params)
         
-        # 7. Finally, delete the machine itself
-        result = await session.execute(
-            text("DELETE FROM machine WHERE id = CAST(:machine_id AS UUID)"),
-            {"machine_id": machine_id_str}
-        )
+        # 3. Finally, delete the machine itself
+        result = await conn.execute(_SQL_DELETE_MACHINE, params)
         
         await session.commit()
         
@@ -4,15 +4,22 @@ Service layer for machine state management
 
 import asyncio
 import logging
+import time
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple, Any
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple, Any
+
+import numpy as np
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, desc, func
+from sqlalchemy import select, and_, desc, func, cast, String
 from sqlalchemy.orm import selectinload
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 from app.models.machine_state import (
     MachineState, MachineStateThresholds, MachineStateTransition, 
-    MachineStateAlert, MachineProcessEvaluation, MachineStateEnum
+    MachineStateAlert, MachineProcessEvaluation, MachineStateEnum,
+    MachineStateDurationRollup
 )
 from app.models.machine import Machine
 from app.schemas.machine_state import (
@@ -27,6 +34,95 @@ from app.services.machine_state_service import (
 
 logger = logging.getLogger(__name__)
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional - fall back to NumPy
+    njit = None
+
+# Integer codes for state-duration aggregation (index into the totals array),
+# in MachineStateEnum declaration order
+_STATE_CODES: Dict[str, int] = {state.value: code for code, state in enumerate(MachineStateEnum)}
+_STATE_NAMES: Tuple[str, ...] = tuple(_STATE_CODES)
+_NUM_STATES = len(_STATE_NAMES)
+
+
+def _accumulate_state_durations_numpy(codes: np.ndarray, durations: np.ndarray) -> np.ndarray:
+    """Sum durations per state code (NumPy fallback)"""
+    return np.bincount(codes, weights=durations, minlength=_NUM_STATES)
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _accumulate_state_durations(codes, durations):
+        """Sum durations per state code (native loop, no Python objects)"""
+        out = np.zeros(_NUM_STATES)
+        for i in range(codes.size):
+            out[codes[i]] += durations[i]
+        return out
+else:
+    logger.warning("numba not installed - state statistics aggregation uses NumPy fallback")
+    _accumulate_state_durations = _accumulate_state_durations_numpy
+
+
+# Human-readable reasons for known state transitions (read-only)
+_TRANSITION_REASONS: Mapping[Tuple[MachineStateEnum, MachineStateEnum], str] = MappingProxyType({
+    (MachineStateEnum.OFF, MachineStateEnum.HEATING): "Temperature started rising",
+    (MachineStateEnum.HEATING, MachineStateEnum.PRODUCTION): "Production criteria met",
+    (MachineStateEnum.IDLE, MachineStateEnum.PRODUCTION): "Production started",
+    (MachineStateEnum.PRODUCTION, MachineStateEnum.IDLE): "Production stopped",
+    (MachineStateEnum.PRODUCTION, MachineStateEnum.COOLING): "Production stopped, cooling down",
+    (MachineStateEnum.COOLING, MachineStateEnum.OFF): "Machine cooled down",
+    (MachineStateEnum.HEATING, MachineStateEnum.IDLE): "Temperature stabilized",
+    (MachineStateEnum.IDLE, MachineStateEnum.COOLING): "Temperature started falling"
+})
+
+
+def _truncate_to_hour(ts: datetime) -> datetime:
+    """Truncate a timestamp to its hour bucket"""
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def _hour_buckets(start: datetime, end: datetime):
+    """Split [start, end) into (hour bucket, seconds) pieces"""
+    bucket = _truncate_to_hour(start)
+    while bucket < end:
+        next_bucket = bucket + timedelta(hours=1)
+        yield bucket, (min(next_bucket, end) - max(bucket, start)).total_seconds()
+        bucket = next_bucket
+
+
+# Per-process cache of detector thresholds: machine_id -> (thresholds or None for defaults, cached_at)
+# Invalidated on local threshold writes; the TTL bounds staleness across workers and is
+# measured on the monotonic clock so a wall-clock step back cannot extend it.
+_THRESHOLDS_CACHE: Dict[str, Tuple[Optional[StateThresholds], float]] = {}
+THRESHOLDS_CACHE_TTL = 60  # seconds
+
+
+def invalidate_thresholds_cache(machine_id: str):
+    """Drop cached thresholds for a machine after they were changed"""
+    _THRESHOLDS_CACHE.pop(machine_id, None)
+
+
+def _to_state_thresholds(thresholds: MachineStateThresholds) -> StateThresholds:
+    """Convert database thresholds to detector thresholds"""
+    return StateThresholds(
+        RPM_ON=thresholds.rpm_on,
+        RPM_PROD=thresholds.rpm_prod,
+        P_ON=thresholds.p_on,
+        P_PROD=thresholds.p_prod,
+        T_MIN_ACTIVE=thresholds.t_min_active,
+        HEATING_RATE=thresholds.heating_rate,
+        COOLING_RATE=thresholds.cooling_rate,
+        TEMP_FLAT_RATE=thresholds.temp_flat_rate,
+        RPM_STABLE_MAX=thresholds.rpm_stable_max,
+        PRESSURE_STABLE_MAX=thresholds.pressure_stable_max,
+        PRODUCTION_ENTER_TIME=thresholds.production_enter_time,
+        PRODUCTION_EXIT_TIME=thresholds.production_exit_time,
+        STATE_CHANGE_DEBOUNCE=thresholds.state_change_debounce,
+        MOTOR_LOAD_MIN=thresholds.motor_load_min,
+        THROUGHPUT_MIN=thresholds.throughput_min
+    )
+
 
 class MachineStateService:
     """Service for managing machine state detection and storage"""
@@ -37,29 +133,17 @@ class MachineStateService:
     
     async def initialize_machine_detector(self, machine_id: str) -> MachineStateDetector:
         """Initialize or get machine state detector with custom thresholds"""
-        # Get custom thresholds from database
-        thresholds = await self.get_machine_thresholds(machine_id)
-        
-        if thresholds:
-            # Convert database thresholds to service thresholds
-            service_thresholds = StateThresholds(
-                rpm_on=thresholds.rpm_on,
-                rpm_prod=thresholds.rpm_prod,
-                p_on=thresholds.p_on,
-                p_prod=thresholds.p_prod,
-                t_min_active=thresholds.t_min_active,
-                heating_rate=thresholds.heating_rate,
-                cooling_rate=thresholds.cooling_rate,
-                temp_flat_rate=thresholds.temp_flat_rate,
-                rpm_stable_max=thresholds.rpm_stable_max,
-                pressure_stable_max=thresholds.pressure_stable_max,
-                production_enter_time=thresholds.production_enter_time,
-                production_exit_time=thresholds.production_exit_time,
-                state_change_debounce=thresholds.state_change_debounce,
-                motor_load_min=thresholds.motor_load_min,
-                throughput_min=thresholds.throughput_min
-            )
+        # Get custom thresholds from cache, falling back to the database
+        cached = _THRESHOLDS_CACHE.get(machine_id)
+        if cached is not None and time.monotonic() - cached[1] < THRESHOLDS_CACHE_TTL:
+            service_thresholds = cached[0]
         else:
+            thresholds = await self.get_machine_thresholds(machine_id)
+            # None means "use default thresholds"
+            service_thresholds = _to_state_thresholds(thresholds) if thresholds else None
+            _THRESHOLDS_CACHE[machine_id] = (service_thresholds, time.monotonic())
+        
+        if service_thresholds is None:
             # Use default thresholds
             service_thresholds = StateThresholds()
         
@@ -72,14 +156,13 @@ class MachineStateService:
             # Get detector from global registry
             detector = get_machine_detector(machine_id)
             
-            # Get previous state
-            previous_state = detector.get_current_state()
-            
-            # Process reading
-            current_state = detector.add_reading(reading)
+            # Process reading; the previous state is only snapshotted when it changes
+            transition = detector.add_reading_transition(reading)
+            current_state = detector.current_state
             
             # Log state transition if changed
-            if previous_state.state != current_state.state:
+            if transition is not None:
+                previous_state = transition[0]
                 # Convert machine_id to string if it's a UUID
                 machine_id_str = str(machine_id)
                 
@@ -97,10 +180,14 @@ class MachineStateService:
                 
                 # Handle state-based actions (including email notifications)
                 await self._handle_state_actions(machine_id_str, from_state_enum, to_state_enum)
+                
+                # Single commit for transition, state, rollup and alerts
+                await self.db.commit()
             
             return current_state
             
         except Exception as e:
+            await self.db.rollback()
             logger.error(f"Error processing sensor reading for {machine_id}: {e}")
             raise
     
@@ -120,13 +207,25 @@ class MachineStateService:
     async def _initialize_all_machine_detectors(self):
         """Initialize detectors for all machines in the database"""
         try:
-            # Get all machines from database
-            result = await self.db.execute(select(Machine))
-            machines = result.scalars().all()
+            # Load all machines with their active thresholds in a single query
+            result = await self.db.execute(
+                select(Machine.id, MachineStateThresholds)
+                .outerjoin(
+                    MachineStateThresholds,
+                    and_(
+                        MachineStateThresholds.machine_id == cast(Machine.id, String),
+                        MachineStateThresholds.is_active == True
+                    )
+                )
+            )
             
-            for machine in machines:
+            now = time.monotonic()
+            for machine_id, thresholds in result.all():
+                machine_id_str = str(machine_id)
+                service_thresholds = _to_state_thresholds(thresholds) if thresholds else None
+                _THRESHOLDS_CACHE[machine_id_str] = (service_thresholds, now)
                 # Initialize detector using global registry
-                get_machine_detector(machine.id)
+                get_machine_detector(machine_id_str, service_thresholds)
                     
         except Exception as e:
             logger.error(f"Error initializing machine detectors: {e}")
@@ -163,6 +262,7 @@ class MachineStateService:
             await self.db.refresh(existing)
             
             # Reinitialize detector with new thresholds
+            invalidate_thresholds_cache(machine_id)
             remove_machine_detector(machine_id)
             await self.initialize_machine_detector(machine_id)
             
@@ -179,6 +279,7 @@ class MachineStateService:
             await self.db.refresh(db_thresholds)
             
             # Reinitialize detector with new thresholds
+            invalidate_thresholds_cache(machine_id)
             remove_machine_detector(machine_id)
             await self.initialize_machine_detector(machine_id)
             
@@ -214,43 +315,24 @@ class MachineStateService:
         start_time: datetime,
         end_time: datetime
     ) -> MachineStateStatistics:
-        """Calculate state statistics for a time period"""
-        # Get state transitions in the period
-        result = await self.db.execute(
-            select(MachineStateTransition).where(
-                and_(
-                    MachineStateTransition.machine_id == machine_id,
-                    MachineStateTransition.transition_time >= start_time,
-                    MachineStateTransition.transition_time <= end_time
-                )
-            ).order_by(MachineStateTransition.transition_time)
-        )
-        transitions = result.scalars().all()
+        """Calculate state statistics for a time period
         
-        # Calculate time spent in each state
+        Time in state comes from the hourly duration rollup, with the partial hours at
+        the window edges measured from transitions; periods the rollup does not cover
+        fall back to scanning transitions.
+        """
         total_seconds = (end_time - start_time).total_seconds()
-        state_times = {
-            'OFF': 0.0,
-            'HEATING': 0.0,
-            'IDLE': 0.0,
-            'PRODUCTION': 0.0,
-            'COOLING': 0.0
-        }
         
-        # Process transitions to calculate state durations
-        for i, transition in enumerate(transitions):
-            state = transition.to_state
-            start = max(transition.transition_time, start_time)
-            
-            # Find next transition or end of period
-            if i + 1 < len(transitions):
-                end = min(transitions[i + 1].transition_time, end_time)
-            else:
-                end = end_time
-            
-            duration = (end - start).total_seconds()
-            if state in state_times:
-                state_times[state] += duration
+        rollup = await self._get_rollup_statistics(machine_id, start_time, end_time)
+        if rollup is not None:
+            state_times, total_transitions, production_cycles = rollup
+            total_production_time = state_times['PRODUCTION']
+            avg_production_duration = total_production_time / production_cycles if production_cycles else 0
+        else:
+            (
+                state_times, total_transitions, production_cycles,
+                avg_production_duration, total_production_time
+            ) = await self._get_transition_statistics(machine_id, start_time, end_time)
         
         # Calculate percentages
         state_percentages = {
@@ -258,26 +340,6 @@ class MachineStateService:
             for state, time in state_times.items()
         }
         
-        # Calculate production-specific metrics
-        production_transitions = [t for t in transitions if t.to_state == 'PRODUCTION']
-        production_cycles = len(production_transitions)
-        
-        production_durations = []
-        for i, transition in enumerate(transitions):
-            if transition.to_state == 'PRODUCTION':
-                start = transition.transition_time
-                # Find when production ended
-                end_time_found = end_time
-                for j in range(i + 1, len(transitions)):
-                    if transitions[j].to_state != 'PRODUCTION':
-                        end_time_found = transitions[j].transition_time
-                        break
-                duration = (end_time_found - start).total_seconds()
-                production_durations.append(duration)
-        
-        avg_production_duration = sum(production_durations) / len(production_durations) if production_durations else 0
-        total_production_time = sum(production_durations)
-        
         return MachineStateStatistics(
             machine_id=machine_id,
             start_time=start_time,
@@ -294,13 +356,205 @@ class MachineStateService:
             production_hours=state_times['PRODUCTION'] / 3600,
             cooling_hours=state_times['COOLING'] / 3600,
             unknown_hours=0.0,  # Removed UNKNOWN state
-            total_transitions=len(transitions),
+            total_transitions=total_transitions,
             state_changes=[],
             production_cycles=production_cycles,
             avg_production_duration=avg_production_duration,
             total_production_time=total_production_time
         )
     
+    async def _get_rollup_statistics(
+        self,
+        machine_id: str,
+        start_time: datetime,
+        end_time: datetime
+    ) -> Optional[Tuple[Dict[str, float], int, int]]:
+        """Sum time in state from the hourly rollup; None if the rollup does not cover the period
+        
+        Whole hours come from the rollup; the partial hours at either edge of the window
+        are measured from transitions so that nothing outside [start_time, end_time) counts.
+        """
+        inner_start = _truncate_to_hour(start_time)
+        if inner_start < start_time:
+            inner_start += timedelta(hours=1)
+        inner_end = _truncate_to_hour(end_time)
+        if inner_start >= inner_end:
+            return None
+        
+        # The rollup starts empty and only fills as segments close, so it cannot answer
+        # for windows that begin before its first bucket
+        first_bucket = (await self.db.execute(
+            select(func.min(MachineStateDurationRollup.bucket_hour))
+            .where(MachineStateDurationRollup.machine_id == machine_id)
+        )).scalar()
+        if first_bucket is None or first_bucket > inner_start:
+            return None
+        
+        result = await self.db.execute(
+            select(MachineStateDurationRollup.state, func.sum(MachineStateDurationRollup.seconds))
+            .where(
+                and_(
+                    MachineStateDurationRollup.machine_id == machine_id,
+                    MachineStateDurationRollup.bucket_hour >= inner_start,
+                    MachineStateDurationRollup.bucket_hour < inner_end
+                )
+            )
+            .group_by(MachineStateDurationRollup.state)
+        )
+        
+        # Accumulate into a fixed array indexed by state code; legacy states are skipped
+        times = [0.0] * _NUM_STATES
+        for state, seconds in result.all():
+            code = _STATE_CODES.get(state)
+            if code is not None:
+                times[code] += seconds or 0.0
+        
+        # The rollup only holds closed segments - add the still-open current state
+        latest = (await self.db.execute(
+            select(MachineStateTransition.to_state, MachineStateTransition.transition_time)
+            .where(MachineStateTransition.machine_id == machine_id)
+            .order_by(desc(MachineStateTransition.transition_time))
+            .limit(1)
+        )).first()
+        if latest and latest.transition_time < inner_end:
+            code = _STATE_CODES.get(latest.to_state)
+            if code is not None:
+                open_start = max(latest.transition_time, inner_start)
+                times[code] += (inner_end - open_start).total_seconds()
+        
+        # Partial hours at the window edges
+        for edge_start, edge_end in ((start_time, inner_start), (inner_end, end_time)):
+            if edge_start < edge_end:
+                edge_times = await self._get_transition_durations(machine_id, edge_start, edge_end)
+                for code, seconds in enumerate(edge_times):
+                    times[code] += seconds
+        
+        # Build the string-keyed dict once for the response schema
+        state_times = dict(zip(_STATE_NAMES, times))
+        
+        # Transition counts for the period
+        counts = (await self.db.execute(
+            select(
+                func.count(MachineStateTransition.id),
+                func.count(MachineStateTransition.id).filter(MachineStateTransition.to_state == 'PRODUCTION')
+            ).where(
+                and_(
+                    MachineStateTransition.machine_id == machine_id,
+                    MachineStateTransition.transition_time >= start_time,
+                    MachineStateTransition.transition_time <= end_time
+                )
+            )
+        )).one()
+        
+        return state_times, counts[0], counts[1]
+    
+    async def _get_transition_durations(
+        self,
+        machine_id: str,
+        start_time: datetime,
+        end_time: datetime
+    ) -> List[float]:
+        """Seconds per state code spent in [start_time, end_time), including the state entered before it"""
+        entered = (await self.db.execute(
+            select(MachineStateTransition.to_state)
+            .where(
+                and_(
+                    MachineStateTransition.machine_id == machine_id,
+                    MachineStateTransition.transition_time <= start_time
+                )
+            )
+            .order_by(desc(MachineStateTransition.transition_time))
+            .limit(1)
+        )).scalar()
+        result = await self.db.execute(
+            select(MachineStateTransition.to_state, MachineStateTransition.transition_time)
+            .where(
+                and_(
+                    MachineStateTransition.machine_id == machine_id,
+                    MachineStateTransition.transition_time > start_time,
+                    MachineStateTransition.transition_time < end_time
+                )
+            )
+            .order_by(MachineStateTransition.transition_time)
+        )
+        
+        times = [0.0] * _NUM_STATES
+        state, since = entered, start_time
+        for to_state, at in result.all():
+            code = _STATE_CODES.get(state) if state else None
+            if code is not None:
+                times[code] += (at - since).total_seconds()
+            state, since = to_state, at
+        code = _STATE_CODES.get(state) if state else None
+        if code is not None:
+            times[code] += (end_time - since).total_seconds()
+        return times
+    
+    async def _get_transition_statistics(
+        self,
+        machine_id: str,
+        start_time: datetime,
+        end_time: datetime
+    ) -> Tuple[Dict[str, float], int, int, float, float]:
+        """Compute time in state and production metrics by scanning transitions"""
+        # Get state transitions in the period
+        result = await self.db.execute(
+            select(MachineStateTransition).where(
+                and_(
+                    MachineStateTransition.machine_id == machine_id,
+                    MachineStateTransition.transition_time >= start_time,
+                    MachineStateTransition.transition_time <= end_time
+                )
+            ).order_by(MachineStateTransition.transition_time)
+        )
+        transitions = result.scalars().all()
+        
+        # Single pass: encode (state code, duration) for the aggregation kernel and
+        # track production runs (PRODUCTION until the next non-PRODUCTION transition)
+        codes = []
+        durations = []
+        production_cycles = 0
+        production_durations = []
+        production_start = None
+        count = len(transitions)
+        for i, transition in enumerate(transitions):
+            state = transition.to_state
+            start = max(transition.transition_time, start_time)
+            
+            # Find next transition or end of period
+            if i + 1 < count:
+                end = min(transitions[i + 1].transition_time, end_time)
+            else:
+                end = end_time
+            
+            code = _STATE_CODES.get(state)
+            if code is not None:
+                codes.append(code)
+                durations.append((end - start).total_seconds())
+            
+            if state == 'PRODUCTION':
+                production_cycles += 1
+                if production_start is None:
+                    production_start = transition.transition_time
+            elif production_start is not None:
+                production_durations.append((transition.transition_time - production_start).total_seconds())
+                production_start = None
+        
+        # Production still running at the end of the period
+        if production_start is not None:
+            production_durations.append((end_time - production_start).total_seconds())
+        
+        totals = _accumulate_state_durations(
+            np.asarray(codes, dtype=np.int8),
+            np.asarray(durations, dtype=np.float64)
+        )
+        state_times = dict(zip(_STATE_NAMES, totals.tolist()))
+        
+        avg_production_duration = sum(production_durations) / len(production_durations) if production_durations else 0
+        total_production_time = sum(production_durations)
+        
+        return state_times, len(transitions), production_cycles, avg_production_duration, total_production_time
+    
     async def _store_machine_state(
         self, 
         machine_id: str, 
@@ -337,10 +591,8 @@ class MachineStateService:
                 }
             )
             self.db.add(db_state)
-            await self.db.commit()
         except Exception as e:
             logger.error(f"Error storing machine state for {machine_id}: {e}")
-            await self.db.rollback()
     
     async def _log_state_transition(
         self,
@@ -375,13 +627,44 @@ class MachineStateService:
                 }
             )
             self.db.add(transition)
-            await self.db.commit()
+            
+            # Roll the closed segment of the previous state into the hourly totals
+            if from_state and previous_info.state_since:
+                await self._add_state_duration(
+                    machine_id, from_state.value, previous_info.state_since, transition.transition_time
+                )
             
             logger.info(f"Logged state transition for {machine_id}: {from_state} → {to_state}")
             
         except Exception as e:
             logger.error(f"Error logging state transition for {machine_id}: {e}")
-            await self.db.rollback()
+    
+    async def _add_state_duration(
+        self,
+        machine_id: str,
+        state: str,
+        segment_start: datetime,
+        segment_end: datetime
+    ):
+        """Upsert a state segment into the hourly duration rollup"""
+        rows = [
+            {"machine_id": machine_id, "state": state, "bucket_hour": bucket, "seconds": seconds}
+            for bucket, seconds in _hour_buckets(segment_start, segment_end)
+            if seconds > 0
+        ]
+        if not rows:
+            return
+        
+        insert = sqlite_insert if self.db.get_bind().dialect.name == "sqlite" else pg_insert
+        stmt = insert(MachineStateDurationRollup).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["machine_id", "state", "bucket_hour"],
+            set_={
+                "seconds": MachineStateDurationRollup.seconds + stmt.excluded.seconds,
+                "updated_at": func.now(),
+            }
+        )
+        await self.db.execute(stmt)
     
     def _get_transition_reason(
         self, 
@@ -390,18 +673,7 @@ class MachineStateService:
         state_info: MachineStateInfo
     ) -> str:
         """Generate human-readable transition reason"""
-        reasons = {
-            (MachineStateEnum.OFF, MachineStateEnum.HEATING): "Temperature started rising",
-            (MachineStateEnum.HEATING, MachineStateEnum.PRODUCTION): "Production criteria met",
-            (MachineStateEnum.IDLE, MachineStateEnum.PRODUCTION): "Production started",
-            (MachineStateEnum.PRODUCTION, MachineStateEnum.IDLE): "Production stopped",
-            (MachineStateEnum.PRODUCTION, MachineStateEnum.COOLING): "Production stopped, cooling down",
-            (MachineStateEnum.COOLING, MachineStateEnum.OFF): "Machine cooled down",
-            (MachineStateEnum.HEATING, MachineStateEnum.IDLE): "Temperature stabilized",
-            (MachineStateEnum.IDLE, MachineStateEnum.COOLING): "Temperature started falling"
-        }
-        
-        return reasons.get((from_state, to_state), f"State changed to {to_state.value}")
+        return _TRANSITION_REASONS.get((from_state, to_state), f"State changed to {to_state.value}")
     
     async def _handle_state_actions(
         self, 
@@ -472,13 +744,11 @@ class MachineStateService:
                 alert_time=datetime.utcnow()
             )
             self.db.add(alert)
-            await self.db.commit()
             
             logger.info(f"Created alert for {machine_id}: {title}")
             
         except Exception as e:
             logger.error(f"Error creating alert for {machine_id}: {e}")
-            await self.db.rollback()
     
     async def _send_state_change_email(
         self,
@@ -631,6 +901,4 @@ Diese Benachrichtigung wurde automatisch von der Predictive-Maintenance-Plattfor
     
     async def cleanup_detector(self, machine_id: str):
         """Clean up detector for machine"""
-        if machine_id in self._detectors:
-            remove_machine_detector(machine_id)
-            del self._detectors[machine_id]
+        remove_machine_detector(machine_id)
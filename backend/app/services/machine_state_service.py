@@ -13,13 +13,42 @@ Process evaluation (traffic-light, baseline, anomalies) only runs in PRODUCTION.
 
 import asyncio
 import logging
+import math
+import sys
+import time
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
 from enum import Enum
+from functools import lru_cache
 from typing import Dict, List, Optional, Tuple, Any
-from dataclasses import dataclass
-from collections import deque
-import statistics
+from dataclasses import dataclass, fields, replace
+import numpy as np
 from loguru import logger
+from sqlalchemy.exc import SQLAlchemyError
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional - fall back to the Python decision tree
+    njit = None
+
+# Numeric reading fields stored in the detector ring buffer, in column order
+READING_FIELDS: Tuple[str, ...] = (
+    "screw_rpm", "pressure_bar",
+    "temp_zone_1", "temp_zone_2", "temp_zone_3", "temp_zone_4",
+    "motor_load", "throughput_kg_h",
+)
+_COLUMN: Dict[str, int] = {field: col for col, field in enumerate(READING_FIELDS)}
+
+# Reading fields tracked for stability (std dev) metrics
+STABILITY_FIELDS: Tuple[str, ...] = ("screw_rpm", "pressure_bar")
+
+# Outside IDLE/HEATING/COOLING, stability metrics are recomputed every N readings
+STABILITY_REFRESH_READINGS = 10
+
+# Ring buffer capacities (1-second intervals)
+READING_BUFFER_SIZE = 600  # 10 minutes for stability metrics
+TEMP_HISTORY_SIZE = 300    # 5 minutes for temperature slope
+EVENT_LOG_SIZE = 4096      # per-reading state determinations buffered before flush_events() runs
 
 class MachineState(Enum):
     """Machine operating states"""
@@ -29,7 +58,7 @@ class MachineState(Enum):
     PRODUCTION = "PRODUCTION"
     COOLING = "COOLING"
 
-@dataclass
+@dataclass(slots=True)
 class StateThresholds:
     """Configurable thresholds for state detection"""
     # Core thresholds
@@ -57,7 +86,7 @@ class StateThresholds:
     MOTOR_LOAD_MIN: float = 0.15   # 15% for production fallback
     THROUGHPUT_MIN: float = 0.1    # kg/h for production fallback
 
-@dataclass
+@dataclass(slots=True)
 class SensorReading:
     """Single sensor reading with timestamp"""
     timestamp: datetime
@@ -73,7 +102,7 @@ class SensorReading:
     heater_on: Optional[bool] = None
     heater_power: Optional[float] = None
 
-@dataclass
+@dataclass(slots=True)
 class DerivedMetrics:
     """Derived metrics from sensor readings"""
     temp_avg: Optional[float] = None
@@ -84,7 +113,7 @@ class DerivedMetrics:
     any_temp_above_min: bool = False
     all_temps_below: bool = True
 
-@dataclass
+@dataclass(slots=True)
 class MachineStateInfo:
     """Current machine state with metadata"""
     state: MachineState
@@ -95,169 +124,594 @@ class MachineStateInfo:
     flags: Dict[str, Any] = None
     state_duration_seconds: Optional[float] = None
 
+# DerivedMetrics field names (flat scalars, so persisting them needs no recursive asdict copy)
+_METRIC_FIELDS: Tuple[str, ...] = tuple(f.name for f in fields(DerivedMetrics))
+
+# Integer state ids used by the native decision tree (index into _STATE_BY_ID)
+_OFF, _HEATING, _IDLE, _PRODUCTION, _COOLING = range(5)
+_STATE_BY_ID: Tuple[MachineState, ...] = (
+    MachineState.OFF, MachineState.HEATING, MachineState.IDLE, MachineState.PRODUCTION, MachineState.COOLING
+)
+
+# States near the IDLE/PRODUCTION boundary, where stability is refreshed on every reading
+_STABILITY_STATES = frozenset((_IDLE, _HEATING, _COOLING))
+
+
+def _nan_if_none(value: Optional[float]) -> float:
+    """Map a missing reading value to NaN for the decision tree"""
+    return math.nan if value is None else float(value)
+
+
+def _classify_state_py(
+    rpm, pressure, temp_avg, d_temp, motor_load, throughput,
+    RPM_ON, RPM_PROD, P_ON, P_PROD, T_MIN_ACTIVE, HEATING_RATE, COOLING_RATE,
+    TEMP_FLAT_RATE, MOTOR_LOAD_MIN, THROUGHPUT_MIN,
+):
+    """State decision tree on plain floats (NaN = no data; NaN comparisons are False).
+    
+    Returns (state_id, confidence).
+    """
+    # PRODUCTION: primary criteria - CHECK FIRST before other states
+    # This ensures high RPM + high pressure = PRODUCTION, regardless of other conditions
+    if rpm >= RPM_PROD and pressure >= P_PROD:
+        return _PRODUCTION, 0.9
+    
+    # PRODUCTION: fallback criteria (pressure, motor load, throughput) - also check before OFF/IDLE
+    if rpm >= RPM_PROD:
+        conditions = 0
+        if pressure >= P_ON:
+            conditions += 1
+        if motor_load >= MOTOR_LOAD_MIN:
+            conditions += 1
+        if throughput >= THROUGHPUT_MIN:
+            conditions += 1
+        if conditions > 0:
+            return _PRODUCTION, 0.7 if conditions > 1 else 0.6
+    
+    pressure_val = 0.0 if math.isnan(pressure) else pressure
+    warm = temp_avg >= T_MIN_ACTIVE
+    
+    if rpm < RPM_ON:
+        # OFF: not running and cold, or no temperature data and low/no pressure
+        # IMPORTANT: Only return OFF if machine is COLD. If warm, check for IDLE instead.
+        if temp_avg < T_MIN_ACTIVE:
+            return _OFF, 0.9
+        if math.isnan(temp_avg) and pressure_val < P_ON:
+            return _OFF, 0.7
+        
+        # COOLING: RPM off, warm, temperature falling
+        if warm and d_temp <= COOLING_RATE:
+            return _COOLING, 0.8
+    
+    # HEATING: temperature rising, no production
+    if rpm < RPM_PROD and warm and d_temp >= HEATING_RATE:
+        return _HEATING, 0.8
+    
+    # IDLE: warm, not running, allowing residual pressure (up to 1.5x P_ON) after shutdown
+    if rpm < RPM_ON and warm and pressure_val < P_ON * 1.5:
+        if math.isnan(d_temp):
+            return _IDLE, 0.6  # No slope data yet - still most likely warm and ready
+        if abs(d_temp) < TEMP_FLAT_RATE:
+            return _IDLE, 0.8  # Stable temperature - confirmed IDLE
+        return _IDLE, 0.5      # Slight temperature change that didn't qualify as HEATING/COOLING
+    
+    # Default to OFF if we can't determine otherwise
+    # This is safer than defaulting to IDLE
+    return _OFF, 0.4
+
+
+if njit is not None:
+    # NaN handling matters here, so no fastmath
+    _classify_state = njit(cache=True)(_classify_state_py)
+else:
+    logger.warning("numba not installed - machine state decision tree runs in Python")
+    _classify_state = _classify_state_py
+
+
+# Zone temperature fault bits
+_TEMP_IMPLAUSIBLE = 1  # <= 0 °C
+_TEMP_TOO_HIGH = 2     # > 400 °C, unlikely for an extruder
+
+# (valid_count, temp_avg, temp_spread, any_temp_above_min, all_temps_below, fault_bits)
+_ZoneTemps = Tuple[int, Optional[float], Optional[float], bool, bool, int]
+
+
+def _scan_zone_temps(reading: SensorReading, t_min: float) -> _ZoneTemps:
+    """Single pass over the 4 temperature zones for metrics, flags and fault bits"""
+    n = 0
+    total = 0.0
+    t_max = -math.inf
+    t_low = math.inf
+    any_temp_above_min = False
+    all_temps_below = True
+    fault_bits = 0
+    for t in (reading.temp_zone_1, reading.temp_zone_2, reading.temp_zone_3, reading.temp_zone_4):
+        if t is None:
+            continue
+        n += 1
+        total += t
+        if t > t_max:
+            t_max = t
+        if t < t_low:
+            t_low = t
+        if t > t_min:
+            any_temp_above_min = True
+        if t >= t_min:
+            all_temps_below = False
+        if t <= 0:
+            fault_bits |= _TEMP_IMPLAUSIBLE
+        elif t > 400:
+            fault_bits |= _TEMP_TOO_HIGH
+    
+    temp_avg = total / n if n else None
+    temp_spread = t_max - t_low if n >= 2 else None
+    return n, temp_avg, temp_spread, any_temp_above_min, all_temps_below, fault_bits
+
+
+def _none_if_nan(value: float) -> Optional[float]:
+    """Map NaN back to None for DerivedMetrics"""
+    return None if math.isnan(value) else float(value)
+
+
+def _classify_states(rpm, pressure, temp_avg, d_temp, motor_load, throughput, th: StateThresholds):
+    """Vectorized _classify_state_py over arrays (NaN = no data); returns (state_ids, confidences)"""
+    with np.errstate(invalid="ignore"):
+        running = rpm >= th.RPM_PROD
+        fallback_conditions = (
+            (pressure >= th.P_ON).astype(np.int8)
+            + (motor_load >= th.MOTOR_LOAD_MIN)
+            + (throughput >= th.THROUGHPUT_MIN)
+        )
+        pressure_val = np.where(np.isnan(pressure), 0.0, pressure)
+        stopped = rpm < th.RPM_ON
+        warm = temp_avg >= th.T_MIN_ACTIVE
+        idle = stopped & warm & (pressure_val < th.P_ON * 1.5)
+        no_slope = np.isnan(d_temp)
+        
+        # Same order as the scalar decision tree; the first matching condition wins
+        rules = [
+            (running & (pressure >= th.P_PROD), _PRODUCTION, 0.9),
+            (running & (fallback_conditions > 1), _PRODUCTION, 0.7),
+            (running & (fallback_conditions == 1), _PRODUCTION, 0.6),
+            (stopped & (temp_avg < th.T_MIN_ACTIVE), _OFF, 0.9),
+            (stopped & np.isnan(temp_avg) & (pressure_val < th.P_ON), _OFF, 0.7),
+            (stopped & warm & (d_temp <= th.COOLING_RATE), _COOLING, 0.8),
+            ((rpm < th.RPM_PROD) & warm & (d_temp >= th.HEATING_RATE), _HEATING, 0.8),
+            (idle & no_slope, _IDLE, 0.6),
+            (idle & (np.abs(d_temp) < th.TEMP_FLAT_RATE), _IDLE, 0.8),
+            (idle, _IDLE, 0.5),
+        ]
+    conditions = [condition for condition, _, _ in rules]
+    state_ids = np.select(conditions, [state_id for _, state_id, _ in rules], default=_OFF)
+    confidences = np.select(conditions, [confidence for _, _, confidence in rules], default=0.4)
+    return state_ids, confidences
+
+
+def _bulk_temperature_slope(temp_avg: np.ndarray, seconds: np.ndarray) -> np.ndarray:
+    """Per-row temperature slope (°C/min) against the mean 5-6 minutes earlier, by reading time
+    
+    Mirrors the live calculation: only rows with a temperature count, at most the last
+    TEMP_HISTORY_SIZE of them are visible, and at least 120 are needed.
+    """
+    slope = np.full(len(temp_avg), np.nan)
+    has_temp = np.flatnonzero(~np.isnan(temp_avg))
+    values, times = temp_avg[has_temp], seconds[has_temp]
+    if len(values) == 0:
+        return slope
+    
+    cumulative = np.concatenate(([0.0], np.cumsum(values)))
+    k = np.arange(len(values))
+    lo = np.maximum(np.searchsorted(times, times - 360.0, side="left"), k - TEMP_HISTORY_SIZE + 1)
+    hi = np.searchsorted(times, times - 300.0, side="right")
+    count = hi - lo
+    ok = (k >= 119) & (count > 0)
+    window_mean = (cumulative[hi[ok]] - cumulative[lo[ok]]) / count[ok]
+    slope[has_temp[ok]] = (values[ok] - window_mean) / 5.0
+    return slope
+
+
+def _bulk_rolling_std(values: np.ndarray) -> np.ndarray:
+    """Sample std dev over the trailing READING_BUFFER_SIZE rows (NaN-aware, >= 10 samples)"""
+    present = ~np.isnan(values)
+    x = np.where(present, values, 0.0)
+    zero = np.zeros(1)
+    sums = np.concatenate((zero, np.cumsum(x)))
+    sumsqs = np.concatenate((zero, np.cumsum(x * x)))
+    counts = np.concatenate((zero, np.cumsum(present)))
+    end = np.arange(1, len(values) + 1)
+    start = np.maximum(end - READING_BUFFER_SIZE, 0)
+    n = counts[end] - counts[start]
+    total = sums[end] - sums[start]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        variance = (sumsqs[end] - sumsqs[start] - total * total / n) / (n - 1)
+    return np.where(n >= 10, np.sqrt(np.maximum(variance, 0.0)), np.nan)
+
+
+# Reference point for float timestamps of naive UTC datetimes
+_EPOCH = datetime(1970, 1, 1)
+
+
 class StateTimer:
-    """Manages hysteresis timers for state transitions"""
+    """Manages hysteresis timers for state transitions (time.monotonic() seconds)"""
+    __slots__ = ("timers", "state_start_times")
+    
     def __init__(self):
-        self.timers: Dict[str, datetime] = {}
-        self.state_start_times: Dict[MachineState, datetime] = {}
+        self.timers: Dict[str, float] = {}
+        self.state_start_times: Dict[int, float] = {}  # state id -> start
     
-    def start_timer(self, timer_name: str, duration_seconds: int) -> datetime:
+    def start_timer(self, timer_name: str, duration_seconds: int, now: Optional[float] = None) -> float:
         """Start a timer and return expiry time"""
-        expiry = datetime.utcnow() + timedelta(seconds=duration_seconds)
+        expiry = (time.monotonic() if now is None else now) + duration_seconds
         self.timers[timer_name] = expiry
         return expiry
     
-    def is_timer_expired(self, timer_name: str) -> bool:
-        """Check if timer has expired"""
-        if timer_name not in self.timers:
-            return True
-        return datetime.utcnow() >= self.timers[timer_name]
+    def is_timer_expired(self, timer_name: str, now: Optional[float] = None) -> bool:
+        """Check if timer has expired (a timer that was never started counts as expired)"""
+        return (time.monotonic() if now is None else now) >= self.timers.get(timer_name, 0.0)
     
     def clear_timer(self, timer_name: str):
         """Clear a timer"""
         self.timers.pop(timer_name, None)
     
-    def set_state_start(self, state: MachineState):
+    def set_state_start(self, state: int, now: Optional[float] = None):
         """Record when a state started"""
-        self.state_start_times[state] = datetime.utcnow()
+        self.state_start_times[state] = time.monotonic() if now is None else now
     
-    def get_state_duration(self, state: MachineState) -> timedelta:
-        """Get how long current state has been active"""
+    def get_state_duration(self, state: int, now: Optional[float] = None) -> float:
+        """Get how long current state has been active, in seconds"""
         if state not in self.state_start_times:
-            return timedelta(0)
-        return datetime.utcnow() - self.state_start_times[state]
+            return 0.0
+        return (time.monotonic() if now is None else now) - self.state_start_times[state]
 
 class MachineStateDetector:
     """Main machine state detection service"""
     
+    # Fixed attribute layout: one detector per machine and attribute reads on every reading
+    __slots__ = (
+        "machine_id", "_thresholds", "_th", "timer",
+        "_enter_production_timer", "_exit_production_timer", "_state_change_timer",
+        "_buf", "_head", "_filled", "_last_reading_at", "_consec_prod",
+        "_temp_ts", "_temp_vals", "_temp_seq", "_temp_filled",
+        "_window_lo", "_window_hi", "_window_sum", "_window_n",
+        "_sum", "_sumsq", "_count", "_stability", "_stability_tick", "_event_log",
+        "_state_id", "_transition_from", "current_state",
+    )
+    
     def __init__(self, machine_id: str, thresholds: Optional[StateThresholds] = None):
         self.machine_id = machine_id
-        self.thresholds = thresholds or StateThresholds()
+        self.thresholds = thresholds or StateThresholds()  # also sets self._th
         self.timer = StateTimer()
+        # Hysteresis timer names, built once (machine_id is fixed per detector)
+        self._enter_production_timer = f"enter_production_{machine_id}"
+        self._exit_production_timer = f"exit_production_{machine_id}"
+        self._state_change_timer = f"state_change_{machine_id}"
+        
+        # Data buffers for calculations, pre-allocated ring buffers (NaN = no value)
+        # _buf: one row per reading in READING_FIELDS column order, written at _head
+        self._buf = np.full((READING_BUFFER_SIZE, len(READING_FIELDS)), np.nan)
+        self._head = 0
+        self._filled = 0
+        self._last_reading_at: Optional[datetime] = None
+        # Consecutive readings (up to and including the latest) meeting PRODUCTION primary criteria
+        self._consec_prod = 0
+        # Temperature history: (epoch seconds, temp_avg) pairs for the slope calculation,
+        # addressed by absolute sequence number (slot = seq % TEMP_HISTORY_SIZE)
+        self._temp_ts = np.zeros(TEMP_HISTORY_SIZE)
+        self._temp_vals = np.zeros(TEMP_HISTORY_SIZE)
+        self._temp_seq = 0
+        self._temp_filled = 0
+        # Samples [_window_lo, _window_hi) are those 5-6 minutes old; their sum/count
+        # is maintained incrementally as samples age into and out of the window
+        self._window_lo = 0
+        self._window_hi = 0
+        self._window_sum = 0.0
+        self._window_n = 0
+        
+        # Running sum / sum of squares / count per stability field over the reading buffer,
+        # updated on push and evict so the std dev never rescans the buffer
+        self._sum: Dict[str, float] = {field: 0.0 for field in STABILITY_FIELDS}
+        self._sumsq: Dict[str, float] = {field: 0.0 for field in STABILITY_FIELDS}
+        self._count: Dict[str, int] = {field: 0 for field in STABILITY_FIELDS}
+        # Last computed (rpm_stable, pressure_stable) and readings since it was computed
+        self._stability: Tuple[Optional[float], Optional[float]] = (None, None)
+        self._stability_tick = STABILITY_REFRESH_READINGS  # compute on the first reading
         
-        # Data buffers for calculations
-        # reading_buffer: 10 minutes for stability metrics (assuming 1-second intervals = 600 samples)
-        self.reading_buffer: deque = deque(maxlen=600)  # 10 minutes for stability metrics
-        self.temp_history: deque = deque(maxlen=300)   # 5 minutes for temperature slope
+        # Per-reading state determinations as (timestamp, state_id, rpm, pressure) tuples;
+        # formatted and logged in batches by flush_events() on state changes and whenever
+        # the buffer fills, instead of on every reading
+        self._event_log: deque = deque(maxlen=EVENT_LOG_SIZE)
         
         # Current state - default to OFF when no data available
+        now = datetime.utcnow()
+        # Current state as an integer id for hot-path comparisons; current_state.state mirrors it
+        self._state_id = _OFF
+        # Copy of current_state taken just before the most recent state change
+        self._transition_from: Optional[MachineStateInfo] = None
         self.current_state: MachineStateInfo = MachineStateInfo(
             state=MachineState.OFF,  # Default to OFF (machine is turned off)
             confidence=0.5,  # Medium confidence for default state
-            state_since=datetime.utcnow(),
-            last_updated=datetime.utcnow(),
+            state_since=now,
+            last_updated=now,
             metrics=DerivedMetrics(),
             state_duration_seconds=0.0
         )
         
         logger.info(f"Machine state detector initialized for {machine_id}")
     
+    @property
+    def thresholds(self) -> StateThresholds:
+        return self._thresholds
+    
+    @thresholds.setter
+    def thresholds(self, thresholds: StateThresholds):
+        # Replace (don't mutate) thresholds so the cached tuple stays in sync
+        self._thresholds = thresholds
+        # Decision-tree thresholds as a flat tuple, in _classify_state argument order
+        self._th: Tuple[float, ...] = (
+            thresholds.RPM_ON, thresholds.RPM_PROD, thresholds.P_ON, thresholds.P_PROD,
+            thresholds.T_MIN_ACTIVE, thresholds.HEATING_RATE, thresholds.COOLING_RATE,
+            thresholds.TEMP_FLAT_RATE, thresholds.MOTOR_LOAD_MIN, thresholds.THROUGHPUT_MIN,
+        )
+    
     def add_reading(self, reading: SensorReading) -> MachineStateInfo:
         """Add new sensor reading and update state"""
+        # Single clock read shared by every step of this reading
+        now = datetime.utcnow()
         try:
             # Add to buffers
-            self.reading_buffer.append(reading)
+            self._push_reading(reading)
             
-            # Calculate derived metrics
-            metrics = self._calculate_derived_metrics(reading)
+            # Cheap checks first: no RPM or a bogus timestamp means OFF without computing metrics
+            if self._is_unusable_reading(reading, now):
+                return self._update_state(_OFF, 0.3, DerivedMetrics(), now)
             
-            # Check for sensor faults - if detected, default to OFF state
-            if self._detect_sensor_fault(reading, metrics):
-                # Sensor fault detected - return OFF state with low confidence
-                logger.warning(f"Sensor fault detected for {self.machine_id}, defaulting to OFF state")
-                new_state = MachineState.OFF
-                confidence = 0.3
-            else:
-                # Determine new state
-                new_state, confidence = self._determine_state(reading, metrics)
+            _, metrics, new_state, confidence = self._process_reading(reading, now)
+            return self._update_state(new_state, confidence, metrics, now)
             
-            # Apply hysteresis/debounce
-            final_state, final_confidence = self._apply_hysteresis(new_state, confidence)
+        except Exception as e:
+            logger.error(f"Error processing reading for {self.machine_id}: {e}")
+            # Return OFF state on error with low confidence
+            if self._state_id != _OFF:
+                self._transition_from = replace(self.current_state)
+            self._state_id = _OFF
+            self.current_state.state = MachineState.OFF
+            self.current_state.confidence = 0.2
+            self.current_state.last_updated = now
+            return self.current_state
+    
+    def add_reading_transition(self, reading: SensorReading) -> Optional[Tuple[MachineStateInfo, MachineStateInfo]]:
+        """Add a reading; returns (previous, current) state info if the reported state changed, else None
+        
+        The previous info is only copied when a transition actually happens, instead of
+        snapshotting the current state before every reading.
+        """
+        previous = self.get_current_state()
+        # A no-data/stale OFF info is already a fresh object; the live one is copied on change
+        live = previous is self.current_state
+        self._transition_from = None
+        current = self.add_reading(reading)
+        if live:
+            previous = self._transition_from
+        if previous is None or previous.state == current.state:
+            return None
+        return previous, current
+    
+    def add_readings_bulk(self, readings: np.ndarray, timestamps: np.ndarray) -> MachineStateInfo:
+        """Add a batch of historical readings (backfill/replay) and update state from the last row
+        
+        readings: (N, len(READING_FIELDS)) array in READING_FIELDS column order, NaN for missing values
+        timestamps: (N,) ascending naive-UTC datetime64 array
+        
+        Metrics and per-row states are computed with array operations over the whole batch; the
+        temperature slope uses the reading timestamps. Hysteresis is applied once, to the last row.
+        """
+        now = datetime.utcnow()
+        arr = np.asarray(readings, dtype=np.float64)
+        ts = np.asarray(timestamps, dtype="datetime64[ns]")
+        if len(arr) == 0:
+            return self.current_state
+        
+        try:
+            th = self.thresholds
+            rpm = arr[:, _COLUMN["screw_rpm"]]
+            pressure = arr[:, _COLUMN["pressure_bar"]]
+            temps = arr[:, _COLUMN["temp_zone_1"]:_COLUMN["temp_zone_4"] + 1]
             
-            # Update current state if changed
-            if final_state != self.current_state.state:
-                self.current_state.state = final_state
-                self.current_state.confidence = final_confidence
-                self.current_state.state_since = datetime.utcnow()
-                self.current_state.state_duration_seconds = 0.0
-                self.timer.set_state_start(final_state)
-                
-                logger.info(f"Machine {self.machine_id} state changed: {final_state.value}")
+            # Zone temperature aggregates (NaN where no zone reported)
+            valid = ~np.isnan(temps)
+            valid_count = valid.sum(axis=1)
+            has_temp = valid_count > 0
+            temp_avg = np.where(has_temp, np.where(valid, temps, 0.0).sum(axis=1) / np.maximum(valid_count, 1), np.nan)
+            temp_spread = np.where(
+                valid_count >= 2,
+                np.where(valid, temps, -np.inf).max(axis=1) - np.where(valid, temps, np.inf).min(axis=1),
+                np.nan,
+            )
             
-            self.current_state.last_updated = datetime.utcnow()
-            self.current_state.metrics = metrics
+            seconds = (ts - ts[0]) / np.timedelta64(1, "s")
+            d_temp = _bulk_temperature_slope(temp_avg, seconds)
+            rpm_stable = _bulk_rolling_std(rpm)
+            pressure_stable = _bulk_rolling_std(pressure)
             
-            # Update state duration
-            duration = self.timer.get_state_duration(self.current_state.state)
-            self.current_state.state_duration_seconds = duration.total_seconds()
+            # Sensor faults (same rules as _is_unusable_reading and _process_reading)
+            with np.errstate(invalid="ignore"):
+                fault = (
+                    (valid & ((temps <= 0) | (temps > 400))).any(axis=1)
+                    | ((pressure == 0) & (rpm > th.RPM_PROD))
+                    | np.isnan(rpm)
+                    | (valid_count < 2)
+                    | (ts > np.datetime64(now + timedelta(hours=24), "ns"))
+                )
             
-            return self.current_state
+            state_ids, confidences = _classify_states(
+                rpm, pressure, temp_avg, d_temp,
+                arr[:, _COLUMN["motor_load"]], arr[:, _COLUMN["throughput_kg_h"]], th,
+            )
+            state_ids = np.where(fault, _OFF, state_ids)
+            confidences = np.where(fault, 0.3, confidences)
+            
+            self._push_rows(arr, ts)
+            
+            last_temp_avg = temp_avg[-1]
+            metrics = DerivedMetrics(
+                temp_avg=_none_if_nan(last_temp_avg),
+                temp_spread=_none_if_nan(temp_spread[-1]),
+                d_temp_avg=_none_if_nan(d_temp[-1]),
+                rpm_stable=_none_if_nan(rpm_stable[-1]),
+                pressure_stable=_none_if_nan(pressure_stable[-1]),
+                any_temp_above_min=bool((valid[-1] & (temps[-1] > th.T_MIN_ACTIVE)).any()),
+                all_temps_below=bool(not (valid[-1] & (temps[-1] >= th.T_MIN_ACTIVE)).any()),
+            )
+            self._stability = (metrics.rpm_stable, metrics.pressure_stable)
+            self._stability_tick = 0
+            return self._update_state(int(state_ids[-1]), float(confidences[-1]), metrics, now)
             
         except Exception as e:
-            logger.error(f"Error processing reading for {self.machine_id}: {e}")
-            # Return OFF state on error with low confidence
+            logger.error(f"Error processing reading batch for {self.machine_id}: {e}")
+            self._state_id = _OFF
             self.current_state.state = MachineState.OFF
             self.current_state.confidence = 0.2
-            self.current_state.last_updated = datetime.utcnow()
+            self.current_state.last_updated = now
             return self.current_state
     
-    def _calculate_derived_metrics(self, reading: SensorReading) -> DerivedMetrics:
-        """Calculate derived metrics from sensor reading"""
-        # Temperature metrics
-        temps = [reading.temp_zone_1, reading.temp_zone_2, reading.temp_zone_3, reading.temp_zone_4]
-        valid_temps = [t for t in temps if t is not None]
+    def _update_state(self, new_state: int, confidence: float,
+                      metrics: DerivedMetrics, now: datetime) -> MachineStateInfo:
+        """Apply hysteresis to a detected state and update the current state info"""
+        # Timers run on the monotonic clock, immune to wall-clock adjustments
+        tick = time.monotonic()
         
-        temp_avg = statistics.mean(valid_temps) if valid_temps else None
-        temp_spread = max(valid_temps) - min(valid_temps) if len(valid_temps) >= 2 else None
+        # Apply hysteresis/debounce
+        final_state, final_confidence = self._apply_hysteresis(new_state, confidence, tick)
         
-        # Temperature slope (°C/min) - need historical data
-        d_temp_avg = self._calculate_temperature_slope(temp_avg)
+        # Update current state if changed
+        if final_state != self._state_id:
+            self._transition_from = replace(self.current_state)
+            self._state_id = final_state
+            self.current_state.state = _STATE_BY_ID[final_state]
+            self.current_state.confidence = final_confidence
+            self.current_state.state_since = now
+            self.current_state.state_duration_seconds = 0.0
+            self.timer.set_state_start(final_state, tick)
+            
+            self.flush_events()
+            logger.info(f"Machine {self.machine_id} state changed: {self.current_state.state.value}")
         
-        # Stability metrics (std dev over last 10 minutes)
-        rpm_stable = self._calculate_stability_metric('screw_rpm')
-        pressure_stable = self._calculate_stability_metric('pressure_bar')
+        self.current_state.last_updated = now
+        self.current_state.metrics = metrics
         
-        # Convenience flags
-        any_temp_above_min = any(t > self.thresholds.T_MIN_ACTIVE for t in valid_temps) if valid_temps else False
-        all_temps_below = all(t < self.thresholds.T_MIN_ACTIVE for t in valid_temps) if valid_temps else True
+        # Update state duration
+        self.current_state.state_duration_seconds = self.timer.get_state_duration(self._state_id, tick)
         
-        return DerivedMetrics(
+        return self.current_state
+    
+    def _process_reading(self, reading: SensorReading, now: datetime) -> Tuple[bool, DerivedMetrics, int, float]:
+        """Derived metrics, sensor fault detection and state determination in one pass
+        
+        Returns (sensor_fault, metrics, state_id, confidence); a sensor fault yields OFF with low confidence.
+        """
+        # Scan the temperature zones once for both metrics and fault detection
+        valid_count, temp_avg, temp_spread, any_temp_above_min, all_temps_below, fault_bits = \
+            _scan_zone_temps(reading, self._th[4])
+        
+        # Stability only feeds the IDLE/HEATING/COOLING boundary: refresh it every reading there,
+        # otherwise every STABILITY_REFRESH_READINGS readings
+        self._stability_tick += 1
+        if self._stability_tick >= STABILITY_REFRESH_READINGS or self._state_id in _STABILITY_STATES:
+            self._stability_tick = 0
+            self._stability = (self._calculate_stability_metric('screw_rpm'),
+                               self._calculate_stability_metric('pressure_bar'))
+        rpm_stable, pressure_stable = self._stability
+        
+        metrics = DerivedMetrics(
             temp_avg=temp_avg,
             temp_spread=temp_spread,
-            d_temp_avg=d_temp_avg,
+            # Temperature slope (°C/min) - need historical data
+            d_temp_avg=self._calculate_temperature_slope(temp_avg, now),
+            # Stability metrics (std dev over last 10 minutes)
             rpm_stable=rpm_stable,
             pressure_stable=pressure_stable,
             any_temp_above_min=any_temp_above_min,
             all_temps_below=all_temps_below
         )
+        
+        # Sensor faults - if detected, default to OFF state
+        # Temperature faults - implausible values were flagged during the zone scan
+        rpm, pressure = reading.screw_rpm, reading.pressure_bar
+        if fault_bits:
+            valid_temps = [t for t in (reading.temp_zone_1, reading.temp_zone_2, reading.temp_zone_3, reading.temp_zone_4)
+                           if t is not None]
+            if fault_bits & _TEMP_IMPLAUSIBLE:
+                logger.warning(f"Implausible temperature detected for {self.machine_id}: {valid_temps}")
+            else:
+                logger.warning(f"Temperature too high for {self.machine_id}: {valid_temps}")
+            fault = True
+        # Pressure fault (exactly 0 while RPM is high) - indicates sensor issue
+        elif pressure is not None and pressure == 0 and rpm is not None and rpm > self._th[1]:
+            logger.warning(f"Pressure fault: RPM={rpm} but pressure=0 for {self.machine_id}")
+            fault = True
+        # Too many missing temperature zones - need at least 2 for reliable state detection
+        elif valid_count < 2:
+            logger.debug("Insufficient temperature zones ({}/4) for {} - sensor fault", valid_count, self.machine_id)
+            fault = True
+        else:
+            fault = False
+            # Future timestamp within 24 hours (beyond that was rejected by _is_unusable_reading):
+            # likely a timezone issue - sensor values are still valid, so continue
+            if reading.timestamp > now + timedelta(minutes=1):
+                logger.debug("Future timestamp detected for {}: {} (current: {}) - likely timezone issue, continuing with state determination",
+                             self.machine_id, reading.timestamp, now)
+        
+        if fault:
+            logger.warning(f"Sensor fault detected for {self.machine_id}, defaulting to OFF state")
+            return True, metrics, _OFF, 0.3
+        
+        state_id, confidence = self._determine_state(reading, metrics)
+        return False, metrics, state_id, confidence
     
-    def _calculate_temperature_slope(self, current_temp: Optional[float]) -> Optional[float]:
+    def _calculate_temperature_slope(self, current_temp: Optional[float], now: datetime) -> Optional[float]:
         """Calculate temperature slope in °C/min"""
         if current_temp is None:
             return None
         
-        # Add current temperature to history
-        self.temp_history.append((datetime.utcnow(), current_temp))
+        # Add current temperature to history, dropping the overwritten sample from the window
+        now_s = (now - _EPOCH).total_seconds()
+        seq = self._temp_seq
+        if seq >= TEMP_HISTORY_SIZE:
+            evicted = seq - TEMP_HISTORY_SIZE
+            if self._window_lo <= evicted < self._window_hi:
+                self._window_sum -= self._temp_vals[evicted % TEMP_HISTORY_SIZE]
+                self._window_n -= 1
+            self._window_lo = max(self._window_lo, evicted + 1)
+            self._window_hi = max(self._window_hi, evicted + 1)
+        slot = seq % TEMP_HISTORY_SIZE
+        self._temp_ts[slot] = now_s
+        self._temp_vals[slot] = current_temp
+        self._temp_seq = seq = seq + 1
+        self._temp_filled = min(seq, TEMP_HISTORY_SIZE)
+        
+        # Slide the 5-6 minute window: admit samples now 5+ minutes old, expire those 6+ minutes old
+        five_min_ago = now_s - 300.0
+        six_min_ago = now_s - 360.0
+        while self._window_hi < seq and self._temp_ts[self._window_hi % TEMP_HISTORY_SIZE] <= five_min_ago:
+            self._window_sum += self._temp_vals[self._window_hi % TEMP_HISTORY_SIZE]
+            self._window_n += 1
+            self._window_hi += 1
+        while self._window_lo < self._window_hi and self._temp_ts[self._window_lo % TEMP_HISTORY_SIZE] < six_min_ago:
+            self._window_sum -= self._temp_vals[self._window_lo % TEMP_HISTORY_SIZE]
+            self._window_n -= 1
+            self._window_lo += 1
+        if self._window_n == 0:
+            self._window_sum = 0.0  # Reset accumulated float error whenever the window empties
         
         # Need at least 2 minutes of data for meaningful slope
-        if len(self.temp_history) < 120:
+        if self._temp_filled < 120:
             return None
         
-        # Calculate slope between current and 5-6 minutes ago
-        now = datetime.utcnow()
-        five_min_ago = now - timedelta(minutes=5)
-        six_min_ago = now - timedelta(minutes=6)
-        
-        # Find average temperature in 5-6 minute window
-        historical_temps = [
-            temp for timestamp, temp in self.temp_history
-            if six_min_ago <= timestamp <= five_min_ago
-        ]
-        
-        if not historical_temps:
+        # Average temperature in 5-6 minute window
+        if self._window_n == 0:
             return None
         
-        historical_avg = statistics.mean(historical_temps)
+        historical_avg = float(self._window_sum / self._window_n)
         
         # Calculate slope (°C/min)
         time_diff_min = 5.0  # 5 minutes difference
@@ -265,274 +719,196 @@ class MachineStateDetector:
         
         return slope
     
-    def _calculate_stability_metric(self, field_name: str) -> Optional[float]:
-        """Calculate standard deviation over last 10 minutes"""
-        if len(self.reading_buffer) < 10:  # Need minimum samples
-            return None
-        
-        # Get last 10 minutes of data
-        now = datetime.utcnow()
-        ten_min_ago = now - timedelta(minutes=10)
+    def _push_reading(self, reading: SensorReading):
+        """Write a reading into the ring buffer, evicting the oldest row when full"""
+        row = self._buf[self._head]
+        if self._filled == READING_BUFFER_SIZE:
+            self._update_running_stats(row, -1)
+        else:
+            self._filled += 1
+        row[:] = [getattr(reading, field) for field in READING_FIELDS]  # None -> NaN
+        self._head = (self._head + 1) % READING_BUFFER_SIZE
+        if self._head == 0:
+            # Once per wrap, recompute exactly to drop float error accumulated by add/subtract
+            self._rebuild_running_stats()
+        else:
+            self._update_running_stats(row, 1)
+        self._last_reading_at = reading.timestamp
         
-        values = []
-        for reading in self.reading_buffer:
-            if reading.timestamp >= ten_min_ago:
-                value = getattr(reading, field_name, None)
-                if value is not None:
-                    values.append(value)
+        rpm_prod, p_prod = self._th[1], self._th[3]
+        rpm, pressure = reading.screw_rpm, reading.pressure_bar
+        if (rpm is not None and rpm >= rpm_prod and
+                pressure is not None and pressure >= p_prod):
+            self._consec_prod += 1
+        else:
+            self._consec_prod = 0
+    
+    def _push_rows(self, arr: np.ndarray, ts: np.ndarray):
+        """Write a batch of rows into the ring buffer and rebuild the running statistics"""
+        rows = arr[-READING_BUFFER_SIZE:]
+        n = len(rows)
+        self._buf[(self._head + np.arange(n)) % READING_BUFFER_SIZE] = rows
+        self._head = (self._head + n) % READING_BUFFER_SIZE
+        self._filled = min(self._filled + n, READING_BUFFER_SIZE)
+        self._last_reading_at = ts[-1].astype("datetime64[us]").item()
+        self._rebuild_running_stats()
         
-        if len(values) < 10:  # Need minimum samples for stability (at least 10 samples over 10 minutes)
+        # Extend or restart the run of consecutive PRODUCTION-criteria readings
+        with np.errstate(invalid="ignore"):
+            qualifies = (arr[:, _COLUMN["screw_rpm"]] >= self.thresholds.RPM_PROD) & \
+                        (arr[:, _COLUMN["pressure_bar"]] >= self.thresholds.P_PROD)
+        misses = np.flatnonzero(~qualifies)
+        if len(misses) == 0:
+            self._consec_prod += len(arr)
+        else:
+            self._consec_prod = len(arr) - 1 - int(misses[-1])
+    
+    def _rebuild_running_stats(self):
+        """Recompute the stability accumulators from the buffer (one NumPy reduction per field)"""
+        for field in STABILITY_FIELDS:
+            column = self._buf[:self._filled, _COLUMN[field]]
+            self._sum[field] = float(np.nansum(column))
+            self._sumsq[field] = float(np.nansum(column * column))
+            self._count[field] = int(np.count_nonzero(~np.isnan(column)))
+    
+    def _update_running_stats(self, row: np.ndarray, sign: int):
+        """Add (sign=1) or remove (sign=-1) a buffer row from the stability accumulators"""
+        for field in STABILITY_FIELDS:
+            value = float(row[_COLUMN[field]])
+            if math.isnan(value):
+                continue
+            self._sum[field] += sign * value
+            self._sumsq[field] += sign * value * value
+            self._count[field] += sign
+    
+    def _calculate_stability_metric(self, field_name: str) -> Optional[float]:
+        """Calculate standard deviation over the reading buffer (last 10 minutes)"""
+        n = self._count[field_name]
+        if n < 10:  # Need minimum samples for stability (at least 10 samples over 10 minutes)
             return None
         
-        return statistics.stdev(values) if len(values) > 1 else 0.0
+        # Sample variance from the running sums; clamp float cancellation below zero
+        total = self._sum[field_name]
+        variance = (self._sumsq[field_name] - total * total / n) / (n - 1)
+        return math.sqrt(variance) if variance > 0.0 else 0.0
     
-    def _detect_sensor_fault(self, reading: SensorReading, metrics: DerivedMetrics) -> bool:
-        """Detect sensor faults and invalid data"""
-        # Check for implausible temperatures
-        temps = [reading.temp_zone_1, reading.temp_zone_2, reading.temp_zone_3, reading.temp_zone_4]
-        valid_temps = [t for t in temps if t is not None]
-        
-        # Temperature faults - check for implausible values
-        if valid_temps:
-            if any(t <= 0 or t < -20 for t in valid_temps):
-                logger.warning(f"Implausible temperature detected for {self.machine_id}: {valid_temps}")
-                return True
-            if any(t > 400 for t in valid_temps):  # Unlikely for extruder
-                logger.warning(f"Temperature too high for {self.machine_id}: {valid_temps}")
-                return True
-        
-        # Pressure fault (exactly 0 while RPM is high) - indicates sensor issue
-        if (reading.pressure_bar is not None and reading.pressure_bar == 0 and 
-            reading.screw_rpm is not None and reading.screw_rpm > self.thresholds.RPM_PROD):
-            logger.warning(f"Pressure fault: RPM={reading.screw_rpm} but pressure=0 for {self.machine_id}")
-            return True
-        
+    def _is_unusable_reading(self, reading: SensorReading, now: datetime) -> bool:
+        """Sensor faults detectable without derived metrics (missing RPM, far-future timestamp)"""
         # Missing critical data - RPM is essential
         if reading.screw_rpm is None:
-            logger.debug(f"Missing RPM data for {self.machine_id} - sensor fault")
-            return True
-        
-        # Too many missing temperature zones - need at least 2 for reliable state detection
-        if len(valid_temps) < 2:  # At least 2 zones needed
-            logger.debug(f"Insufficient temperature zones ({len(valid_temps)}/4) for {self.machine_id} - sensor fault")
+            logger.debug("Missing RPM data for {} - sensor fault", self.machine_id)
             return True
         
-        # Invalid timestamp - check for future timestamps (timezone issues)
-        # Allow up to 24 hours in the future (to handle timezone differences)
-        # Just log a warning but don't treat as fault if sensor values are valid
-        if reading.timestamp > datetime.utcnow() + timedelta(hours=24):
-            logger.warning(f"Timestamp too far in future for {self.machine_id}: {reading.timestamp} (current: {datetime.utcnow()})")
+        # Invalid timestamp - allow up to 24 hours in the future (to handle timezone differences)
+        if reading.timestamp > now + timedelta(hours=24):
+            logger.warning(f"Timestamp too far in future for {self.machine_id}: {reading.timestamp} (current: {now})")
             return True
-        elif reading.timestamp > datetime.utcnow() + timedelta(minutes=1):
-            # Future timestamp but within reasonable range (likely timezone issue)
-            # Log warning but don't treat as fault - sensor values are still valid
-            logger.debug(f"Future timestamp detected for {self.machine_id}: {reading.timestamp} (current: {datetime.utcnow()}) - likely timezone issue, continuing with state determination")
-            # Don't return True - allow state determination to proceed
         
         return False
     
-    def _determine_state(self, reading: SensorReading, metrics: DerivedMetrics) -> Tuple[MachineState, float]:
-        """Determine machine state based on current readings"""
+    def _determine_state(self, reading: SensorReading, metrics: DerivedMetrics) -> Tuple[int, float]:
+        """Determine machine state id (index into _STATE_BY_ID) based on current readings"""
         # Check for missing critical data - don't convert None to 0.0
         # This allows us to distinguish "machine off" (0.0) from "no data" (None)
         rpm = reading.screw_rpm
-        pressure = reading.pressure_bar
-        temp_avg = metrics.temp_avg
-        d_temp = metrics.d_temp_avg
         
         # If critical data is missing, we can't determine state accurately
-        # This should have been caught by _detect_sensor_fault, but handle it here too
+        # This should have been caught by _is_unusable_reading, but handle it here too
         if rpm is None:
             logger.warning(f"Missing RPM data for {self.machine_id}, defaulting to OFF state")
-            return MachineState.OFF, 0.3
-        
-        # Use 0.0 for comparisons only when we have valid None handling
-        rpm_val = rpm if rpm is not None else 0.0
-        pressure_val = pressure if pressure is not None else 0.0
-        temp_avg_val = temp_avg if temp_avg is not None else 0.0
-        
-        logger.info("State determination: machine_id={}, rpm={}, pressure={}, temp_avg={}, d_temp={}, thresholds: RPM_PROD={}, P_PROD={}", 
-                    self.machine_id, rpm_val, pressure_val, temp_avg_val, d_temp, 
-                    self.thresholds.RPM_PROD, self.thresholds.P_PROD)
-        
-        # PRODUCTION: primary criteria - CHECK FIRST before other states
-        # This ensures high RPM + high pressure = PRODUCTION, regardless of other conditions
-        if (rpm_val >= self.thresholds.RPM_PROD and 
-            pressure is not None and pressure >= self.thresholds.P_PROD):
-            logger.info("✅ PRODUCTION state detected (primary): machine_id={}, rpm={} (>= {}), pressure={} (>= {}), temp_avg={}", 
-                       self.machine_id, rpm_val, self.thresholds.RPM_PROD, pressure, self.thresholds.P_PROD, temp_avg)
-            return MachineState.PRODUCTION, 0.9
-        else:
-            # Log why PRODUCTION wasn't detected
-            if rpm_val < self.thresholds.RPM_PROD:
-                logger.debug("PRODUCTION not detected: rpm={} < RPM_PROD={}", rpm_val, self.thresholds.RPM_PROD)
-            if pressure is None:
-                logger.debug("PRODUCTION not detected: pressure is None")
-            elif pressure < self.thresholds.P_PROD:
-                logger.debug("PRODUCTION not detected: pressure={} < P_PROD={}", pressure, self.thresholds.P_PROD)
-        
-        # PRODUCTION: fallback criteria - also check before OFF/IDLE
-        if rpm_val >= self.thresholds.RPM_PROD:
-            fallback_conditions = []
-            
-            # Check pressure
-            if pressure is not None and pressure >= self.thresholds.P_ON:
-                fallback_conditions.append("pressure")
-            
-            # Check motor load
-            if reading.motor_load is not None and reading.motor_load >= self.thresholds.MOTOR_LOAD_MIN:
-                fallback_conditions.append("motor_load")
-            
-            # Check throughput
-            if reading.throughput_kg_h is not None and reading.throughput_kg_h >= self.thresholds.THROUGHPUT_MIN:
-                fallback_conditions.append("throughput")
-            
-            if fallback_conditions:
-                confidence = 0.7 if len(fallback_conditions) > 1 else 0.6
-                logger.info("PRODUCTION state detected (fallback): machine_id={}, rpm={}, conditions={}", 
-                           self.machine_id, rpm_val, fallback_conditions)
-                return MachineState.PRODUCTION, confidence
+            return _OFF, 0.3
         
-        # OFF: cold, no RPM, low/no pressure
-        # IMPORTANT: Only return OFF if machine is COLD. If warm, check for IDLE instead.
-        if rpm_val < self.thresholds.RPM_ON:
-            # Machine is not running - check if it's cold (OFF) or warm (IDLE)
-            if temp_avg is not None and temp_avg < self.thresholds.T_MIN_ACTIVE:
-                # Machine is cold and not running - definitely OFF
-                logger.debug("OFF state detected: machine_id={}, temp={}, rpm={}, pressure={}", 
-                           self.machine_id, temp_avg, rpm_val, pressure_val)
-                return MachineState.OFF, 0.9
-            elif temp_avg is None and pressure_val < self.thresholds.P_ON:
-                # No temperature data but low pressure and no RPM - likely OFF
-                logger.debug("OFF state detected (no temp data): machine_id={}, rpm={}, pressure={}", 
-                           self.machine_id, rpm_val, pressure_val)
-                return MachineState.OFF, 0.7
-            elif rpm_val == 0.0 and temp_avg is not None and temp_avg < self.thresholds.T_MIN_ACTIVE:
-                # RPM is exactly 0 and cold - OFF even if pressure is slightly above threshold (residual pressure)
-                logger.debug("OFF state detected (RPM=0, cold): machine_id={}, temp={}, pressure={}", 
-                           self.machine_id, temp_avg, pressure_val)
-                return MachineState.OFF, 0.85
-            # If we reach here, machine is warm (temp_avg >= T_MIN_ACTIVE) but not running
-            # Don't return OFF here - let IDLE detection handle it below
-        
-        # COOLING: RPM off, temperature falling
-        # Require valid d_temp for COOLING detection
-        if (rpm_val < self.thresholds.RPM_ON and 
-            temp_avg is not None and temp_avg >= self.thresholds.T_MIN_ACTIVE and
-            d_temp is not None and d_temp <= self.thresholds.COOLING_RATE):
-            return MachineState.COOLING, 0.8
-        
-        # HEATING: temperature rising, no production
-        # Require valid d_temp for HEATING detection
-        if (rpm_val < self.thresholds.RPM_PROD and 
-            temp_avg is not None and temp_avg >= self.thresholds.T_MIN_ACTIVE and
-            d_temp is not None and d_temp >= self.thresholds.HEATING_RATE):
-            return MachineState.HEATING, 0.8
-        
-        
-        # IDLE: warm, stable, no production
-        # PRIORITIZE IDLE when machine is warm (temp_avg >= T_MIN_ACTIVE) and not running
-        # This should be checked BEFORE defaulting to OFF
-        if (rpm_val < self.thresholds.RPM_ON and 
-            temp_avg is not None and temp_avg >= self.thresholds.T_MIN_ACTIVE):
-            # Machine is warm and not running - check if it's IDLE
-            # Allow residual pressure (up to 1.5x P_ON) when RPM is 0, as pressure can linger after shutdown
-            if pressure_val < (self.thresholds.P_ON * 1.5):  # Allow residual pressure (up to 3.0 bar when P_ON=2.0)
-                # Check if we have d_temp for stability confirmation
-                if d_temp is not None and abs(d_temp) < self.thresholds.TEMP_FLAT_RATE:
-                    # Stable temperature - confirmed IDLE
-                    logger.debug("IDLE state (warm, stable): machine_id={}, temp={}, rpm={}, pressure={}, d_temp={}", 
-                               self.machine_id, temp_avg, rpm_val, pressure_val, d_temp)
-                    return MachineState.IDLE, 0.8
-                elif d_temp is None:
-                    # No temperature slope data - but machine is warm, not running, low pressure
-                    # This is most likely IDLE (warm and ready)
-                    if len(self.temp_history) < 120:
-                        # Not enough history yet - but still likely IDLE
-                        logger.debug("IDLE state (warm, no history): machine_id={}, temp={}, rpm={}, pressure={}", 
-                                   self.machine_id, temp_avg, rpm_val, pressure_val)
-                        return MachineState.IDLE, 0.6
-                    else:
-                        # Have history but d_temp calculation failed - still likely IDLE
-                        logger.debug("IDLE state (warm, d_temp unavailable): machine_id={}, temp={}, rpm={}, pressure={}", 
-                                   self.machine_id, temp_avg, rpm_val, pressure_val)
-                        return MachineState.IDLE, 0.6
-                else:
-                    # d_temp exists but indicates heating/cooling - check if it's significant
-                    if abs(d_temp) >= self.thresholds.TEMP_FLAT_RATE:
-                        # Temperature is changing - could be HEATING or COOLING (already checked above)
-                        # But if those didn't match, it might be a small change - still likely IDLE
-                        logger.debug("IDLE state (warm, slight temp change): machine_id={}, temp={}, d_temp={}", 
-                                   self.machine_id, temp_avg, d_temp)
-                        return MachineState.IDLE, 0.5
-                # If we reach here, machine is warm, not running, low pressure - IDLE
-                logger.debug("IDLE state (warm, fallback): machine_id={}, temp={}, rpm={}, pressure={}", 
-                           self.machine_id, temp_avg, rpm_val, pressure_val)
-                return MachineState.IDLE, 0.6
-        
-        # Default to OFF if we can't determine otherwise
-        # This is safer than defaulting to IDLE
-        logger.debug("Defaulting to OFF state: machine_id={}, rpm={}, pressure={}, temp_avg={}", 
-                    self.machine_id, rpm_val, pressure_val, temp_avg)
-        return MachineState.OFF, 0.4
-    
-    def _apply_hysteresis(self, new_state: MachineState, confidence: float) -> Tuple[MachineState, float]:
-        """Apply hysteresis and debounce logic"""
-        current = self.current_state.state
+        th = self._th
+
+        # Steady-state hot path: still in PRODUCTION and the primary criteria hold, so the
+        # decision tree would return (PRODUCTION, 0.9) - skip the NaN packing and kernel call
+        pressure = reading.pressure_bar
+        if (self._state_id == _PRODUCTION and pressure is not None
+                and rpm >= th[1] and pressure >= th[3]):
+            self._record_event(reading.timestamp, _PRODUCTION, rpm, pressure)
+            return _PRODUCTION, 0.9
+        
+        state_id, confidence = _classify_state(
+            float(rpm), _nan_if_none(pressure), _nan_if_none(metrics.temp_avg),
+            _nan_if_none(metrics.d_temp_avg), _nan_if_none(reading.motor_load),
+            _nan_if_none(reading.throughput_kg_h), *th,
+        )
+        # Recorded for flush_events() rather than logged per reading
+        self._record_event(reading.timestamp, state_id, rpm, pressure)
+        return state_id, float(confidence)
+    
+    def _record_event(self, ts: datetime, state_id: int, rpm: float, pressure: Optional[float]):
+        """Buffer one state determination, flushing when the buffer is full so none are dropped"""
+        event_log = self._event_log
+        event_log.append((ts, state_id, rpm, pressure))
+        if len(event_log) >= EVENT_LOG_SIZE:
+            self.flush_events()
+    
+    def flush_events(self) -> int:
+        """Log and clear the buffered state determinations in one batch; returns the count"""
+        count = len(self._event_log)
+        if count:
+            events = "\n".join(
+                f"  {ts.isoformat()} {_STATE_BY_ID[state_id].value} rpm={rpm} pressure={pressure}"
+                for ts, state_id, rpm, pressure in self._event_log
+            )
+            self._event_log.clear()
+            logger.debug("State determinations for {} ({} readings):\n{}", self.machine_id, count, events)
+        return count
+    
+    def _apply_hysteresis(self, new_state: int, confidence: float, now: float) -> Tuple[int, float]:
+        """Apply hysteresis and debounce logic (on integer state ids)"""
+        current = self._state_id
         
         # No change - return current state
         if new_state == current:
             return current, confidence
         
         # Special handling for PRODUCTION (requires 90s)
-        if new_state == MachineState.PRODUCTION:
-            timer_name = f"enter_production_{self.machine_id}"
+        if new_state == _PRODUCTION:
+            timer_name = self._enter_production_timer
             
             # If already in PRODUCTION, no change needed
-            if current == MachineState.PRODUCTION:
+            if current == _PRODUCTION:
                 return new_state, confidence
             
             # Check if timer has expired (or doesn't exist)
-            if self.timer.is_timer_expired(timer_name):
+            if self.timer.is_timer_expired(timer_name, now):
                 # Timer expired or doesn't exist - check if we've been meeting PRODUCTION criteria
                 # For first-time detection or after timer expiry, allow immediate transition
                 # but only if we have enough readings to be confident
-                if len(self.reading_buffer) >= 10:  # Need at least 10 readings for confidence
-                    logger.info(f"PRODUCTION transition allowed: timer expired, {len(self.reading_buffer)} readings available")
+                if self._filled >= 10:  # Need at least 10 readings for confidence
+                    logger.info("PRODUCTION transition allowed: timer expired, {} readings available", self._filled)
                     self.timer.clear_timer(timer_name)
-                    self.timer.set_state_start(new_state)
+                    self.timer.set_state_start(new_state, now)
                     return new_state, confidence
                 else:
                     # Not enough readings yet - start timer
-                    logger.debug(f"PRODUCTION transition delayed: only {len(self.reading_buffer)} readings, need 10+")
+                    logger.debug("PRODUCTION transition delayed: only {} readings, need 10+", self._filled)
                     if timer_name not in self.timer.timers:
-                        self.timer.start_timer(timer_name, self.thresholds.PRODUCTION_ENTER_TIME)
+                        self.timer.start_timer(timer_name, self.thresholds.PRODUCTION_ENTER_TIME, now)
                     return current, confidence
             else:
                 # Timer still running - check how long we've been meeting PRODUCTION criteria
-                # Count consecutive readings that meet PRODUCTION criteria
-                production_readings = 0
-                for r in list(self.reading_buffer)[-30:]:  # Check last 30 readings
-                    if (r.screw_rpm is not None and r.screw_rpm >= self.thresholds.RPM_PROD and
-                        r.pressure_bar is not None and r.pressure_bar >= self.thresholds.P_PROD):
-                        production_readings += 1
+                # Consecutive readings that meet PRODUCTION criteria (maintained on push)
+                production_readings = self._consec_prod
                 
                 # If we have enough consecutive production readings, allow transition
                 if production_readings >= 10:  # At least 10 consecutive production readings
-                    logger.info(f"PRODUCTION transition allowed: {production_readings} consecutive production readings")
+                    logger.info("PRODUCTION transition allowed: {} consecutive production readings", production_readings)
                     self.timer.clear_timer(timer_name)
-                    self.timer.set_state_start(new_state)
+                    self.timer.set_state_start(new_state, now)
                     return new_state, confidence
                 else:
                     # Still waiting - return current state
-                    logger.debug(f"PRODUCTION transition waiting: {production_readings}/10 consecutive production readings")
+                    logger.debug("PRODUCTION transition waiting: {}/10 consecutive production readings", production_readings)
                     return current, confidence
         
         # Exiting production (requires 120s)
-        elif current == MachineState.PRODUCTION and new_state != MachineState.PRODUCTION:
-            timer_name = f"exit_production_{self.machine_id}"
+        elif current == _PRODUCTION and new_state != _PRODUCTION:
+            timer_name = self._exit_production_timer
             
-            if not self.timer.is_timer_expired(timer_name):
+            if not self.timer.is_timer_expired(timer_name, now):
                 return current, confidence
             
             # Check if we've been out of production criteria for 120s
@@ -542,29 +918,28 @@ class MachineStateDetector:
         
         # Other state changes (60s debounce)
         else:
-            timer_name = f"state_change_{self.machine_id}"
+            timer_name = self._state_change_timer
             
-            if not self.timer.is_timer_expired(timer_name):
+            if not self.timer.is_timer_expired(timer_name, now):
                 return current, confidence
             
             self.timer.clear_timer(timer_name)
             return new_state, confidence
     
-    def get_current_state(self) -> MachineStateInfo:
-        """Get current machine state"""
-        now = datetime.utcnow()
+    def get_current_state(self, now: Optional[datetime] = None) -> MachineStateInfo:
+        """Get current machine state (the live, in-place updated info unless no data / stale)"""
+        if now is None:
+            now = datetime.utcnow()
         time_since_update = (now - self.current_state.last_updated).total_seconds()
         
         # Check if we have any readings at all
-        has_any_readings = len(self.reading_buffer) > 0
+        has_any_readings = self._filled > 0
         
         # Check if we have recent readings (within last 2 minutes)
         has_recent_readings = False
-        if has_any_readings:
-            last_reading = self.reading_buffer[-1]
-            if hasattr(last_reading, 'timestamp') and last_reading.timestamp:
-                time_since_last_reading = (now - last_reading.timestamp).total_seconds()
-                has_recent_readings = time_since_last_reading < 120  # 2 minutes
+        if has_any_readings and self._last_reading_at:
+            time_since_last_reading = (now - self._last_reading_at).total_seconds()
+            has_recent_readings = time_since_last_reading < 120  # 2 minutes
         
         # If no readings at all, or state is stale (no data for 5+ minutes), return OFF
         if not has_any_readings:
@@ -598,20 +973,86 @@ class MachineStateDetector:
     
     def is_in_production(self) -> bool:
         """Check if machine is currently in PRODUCTION state"""
-        return self.current_state.state == MachineState.PRODUCTION
+        return self._state_id == _PRODUCTION
     
     def get_state_duration(self) -> timedelta:
         """Get duration of current state"""
-        return self.timer.get_state_duration(self.current_state.state)
+        return timedelta(seconds=self.timer.get_state_duration(self._state_id))
+
+# Global registry for machine state detectors. Only touched from the event loop by these
+# synchronous helpers (no await between lookup and insert), so it needs no lock or sharding.
+# It must stay process-wide: the poller task feeds detectors that API requests read, so a
+# per-task/per-request (contextvars) map would hide live state from the readers.
+# Kept in access order (most recently used last) so eviction pops the front in O(1).
+_machine_detectors: "OrderedDict[str, MachineStateDetector]" = OrderedDict()
+
+# Upper bound on registered detectors; the least recently used one is evicted
+MAX_MACHINE_DETECTORS = 10_000
+
+# Sensor types (lowercase) mapped to detector fields
+_SENSOR_MAP: Dict[str, Optional[str]] = {
+    'temperature': 'temp_zone_1',  # Use zone 1 for general temperature
+    'temperature sensor': 'temp_zone_1',
+    'pressure': 'pressure_bar',
+    'pressure sensor': 'pressure_bar',
+    'vibration': None,  # Not directly mapped, but could affect derived metrics
+    'vibration sensor': None,
+    'motor_current': 'motor_load',
+    'motor current': 'motor_load',
+    'motor current sensor': 'motor_load',
+    'rpm': 'screw_rpm',
+    'rpm sensor': 'screw_rpm',
+    'speed sensor': 'screw_rpm',
+    'load sensor': 'motor_load',
+    'current sensor': 'motor_load',
+    'torque sensor': None,  # Could be mapped to motor_load if needed
+    'flow sensor': None,
+    'oil level sensor': None,
+}
+
+@lru_cache(maxsize=64)
+def _map_sensor(sensor_type: str) -> Optional[str]:
+    """Detector field for a sensor type (case-insensitive); deployments only see a few distinct types"""
+    return _SENSOR_MAP.get(sensor_type.lower())
+
+# Reading fields carried over from the current state's metrics into a new single-sensor reading,
+# as (reading field, metrics attribute). Pairs whose attribute DerivedMetrics doesn't define are
+# dropped here once, so the per-sample loop needs no hasattr/getattr-default probing.
+_CARRY_FORWARD_FIELDS: Tuple[Tuple[str, str], ...] = tuple(
+    (reading_field, metrics_field)
+    for reading_field, metrics_field in (
+        ('temp_zone_1', 'temp_avg'),
+        ('pressure_bar', 'pressure_bar'),
+        ('screw_rpm', 'screw_rpm'),
+        ('motor_load', 'motor_load'),
+    )
+    if metrics_field in _METRIC_FIELDS
+)
+
+# Per-sample logs are DEBUG; a running sample count is logged at INFO every N samples
+SENSOR_SAMPLE_LOG_INTERVAL = 10_000
+_sensor_samples_processed = 0
 
-# Global registry for machine state detectors
-_machine_detectors: Dict[str, MachineStateDetector] = {}
+# State transitions waiting to be persisted by the writer task, and the most written per flush
+STATE_WRITE_QUEUE_SIZE = 10_000
+STATE_WRITE_BATCH_SIZE = 500
+_state_write_queue: "asyncio.Queue" = asyncio.Queue(maxsize=STATE_WRITE_QUEUE_SIZE)
+_state_writer_task: Optional[asyncio.Task] = None
 
 def get_machine_detector(machine_id: str, thresholds: Optional[StateThresholds] = None) -> MachineStateDetector:
     """Get or create machine state detector for a machine"""
-    if machine_id not in _machine_detectors:
-        _machine_detectors[machine_id] = MachineStateDetector(machine_id, thresholds)
-    return _machine_detectors[machine_id]
+    detector = _machine_detectors.get(machine_id)
+    if detector is not None:
+        _machine_detectors.move_to_end(machine_id)
+    else:
+        if len(_machine_detectors) >= MAX_MACHINE_DETECTORS:
+            # Evict the detector that has gone longest without use (abandoned machine)
+            stale_id, _ = _machine_detectors.popitem(last=False)
+            logger.info(f"Evicted machine state detector for {stale_id} (registry full)")
+        # Interned ids make later registry lookups hash/compare by identity
+        machine_id = sys.intern(machine_id)
+        detector = _machine_detectors[machine_id] = MachineStateDetector(machine_id, thresholds)
+    return detector
 
 def remove_machine_detector(machine_id: str):
     """Remove machine state detector"""
@@ -619,103 +1060,174 @@ def remove_machine_detector(machine_id: str):
 
 def get_all_machine_states() -> Dict[str, MachineStateInfo]:
     """Get current states of all machines"""
-    return {machine_id: detector.get_current_state() 
+    # One clock read for the whole fleet; live states are returned by reference, not copied
+    now = datetime.utcnow()
+    return {machine_id: detector.get_current_state(now)
             for machine_id, detector in _machine_detectors.items()}
 
 async def process_sensor_data_for_state(
     session, machine_id: str, sensor_type: str, value: float, timestamp: datetime
 ):
-    """Process incoming sensor data for machine state detection"""
+    """Process incoming sensor data for machine state detection
+    
+    add_reading handles its own failures (falls back to OFF) and the DB write path logs its own
+    errors, so there is no blanket exception guard here.
+    """
+    new_state = _process_sensor_data_sync(machine_id, sensor_type, value, timestamp)
+    
+    # Store state in database if changed
+    if new_state is not None:
+        await enqueue_machine_state(session, machine_id, new_state)
+        logger.info(f"Machine {machine_id} state changed to {new_state.state.value}")
+
+def _process_sensor_data_sync(
+    machine_id: str, sensor_type: str, value: float, timestamp: datetime
+) -> Optional[MachineStateInfo]:
+    """Feed one sensor value to the machine's detector; returns the new state info if it changed
+    
+    Synchronous so the common no-transition sample never creates a coroutine; only a state
+    change needs the (async) database write.
+    """
+    global _sensor_samples_processed
+    _sensor_samples_processed += 1
+    if _sensor_samples_processed % SENSOR_SAMPLE_LOG_INTERVAL == 0:
+        logger.info("Machine state detection processed {} sensor samples", _sensor_samples_processed)
+    logger.debug("Entering process_sensor_data_for_state: machine_id={}, sensor_type={}", machine_id, sensor_type)
+    
+    # Use the global detector registry
+    detector = get_machine_detector(machine_id)
+    
+    # Pass sensor_type as received: _map_sensor caches the lowercased lookup per distinct
+    # string, so callers don't need to lower() or intern it at the ingest boundary
+    field_name = _map_sensor(sensor_type)
+    logger.debug("Processing sensor data: machine_id={}, sensor_type={}, field_name={}", machine_id, sensor_type, field_name)
+    
+    if field_name:
+        # Detector state before this reading (add_reading updates current_state in place)
+        prev_state_id = detector._state_id
+        current_state = detector.current_state
+        
+        # Create a new reading with the new value and existing values
+        reading = SensorReading(timestamp=timestamp)
+        
+        # Copy existing values from current state metrics if available
+        metrics = current_state.metrics
+        if metrics:
+            for reading_field, metrics_field in _CARRY_FORWARD_FIELDS:
+                if reading_field != field_name:
+                    carried = getattr(metrics, metrics_field)
+                    if carried:
+                        setattr(reading, reading_field, carried)
+        
+        # Update the specific field (mapped field names are SensorReading attributes)
+        setattr(reading, field_name, value)
+        
+        # Process the reading for state detection
+        new_state = detector.add_reading(reading)
+        if detector._state_id != prev_state_id:
+            return new_state
+    return None
+
+def _machine_state_row(machine_id: str, state_info: MachineStateInfo) -> Dict[str, Any]:
+    """Column values of the machine_state history row for a transition (snapshot of state_info)"""
+    row = {
+        "machine_id": machine_id,
+        "state": state_info.state.value,
+        "confidence": state_info.confidence,
+        "state_since": state_info.state_since,
+        "last_updated": state_info.last_updated,
+        "flags": state_info.flags or {},
+    }
+    # DerivedMetrics fields map one-to-one onto the metric columns
+    metrics = state_info.metrics
+    if metrics:
+        for name in _METRIC_FIELDS:
+            row[name] = getattr(metrics, name)
+    return row
+
+async def enqueue_machine_state(session, machine_id: str, state_info: MachineStateInfo):
+    """Queue a state transition for the batched writer, or store it directly if the writer isn't running"""
+    if _state_writer_task is not None and not _state_writer_task.done():
+        try:
+            # Snapshot now - the detector keeps mutating its MachineStateInfo
+            _state_write_queue.put_nowait(_machine_state_row(machine_id, state_info))
+            return
+        except asyncio.QueueFull:
+            logger.warning(f"Machine state write queue full - storing {machine_id} transition directly")
+    await store_machine_state_in_db(session, machine_id, state_info)
+
+async def _state_writer():
+    """Persist queued state transitions in batches until the None sentinel from stop_state_writer"""
+    from app.db.session import AsyncSessionLocal
+    from app.models.machine_state import MachineState
+    
+    # Core insert: no ORM unit-of-work / identity-map bookkeeping for write-only history rows
+    insert_stmt = MachineState.__table__.insert()
+    
+    stopping = False
+    while not stopping:
+        row = await _state_write_queue.get()
+        if row is None:
+            _state_write_queue.task_done()
+            break
+        rows = [row]
+        while len(rows) < STATE_WRITE_BATCH_SIZE and not _state_write_queue.empty():
+            row = _state_write_queue.get_nowait()
+            if row is None:
+                stopping = True
+                break
+            rows.append(row)
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(insert_stmt, rows)
+                await session.commit()
+            logger.debug("Stored {} machine state transitions", len(rows))
+        except Exception:
+            # Keep the writer alive on any failure (including connection errors)
+            logger.exception("Error storing machine state batch - dropped {} transitions", len(rows))
+        finally:
+            for _ in range(len(rows) + stopping):
+                _state_write_queue.task_done()
+
+def start_state_writer(loop: asyncio.AbstractEventLoop) -> None:
+    """Start the background task that batches machine state transitions into the database"""
+    global _state_writer_task
+    if _state_writer_task and not _state_writer_task.done():
+        return
+    _state_writer_task = loop.create_task(_state_writer())
+    logger.info("Machine state writer started")
+
+async def stop_state_writer() -> None:
+    """Flush queued state transitions and stop the writer task"""
+    global _state_writer_task
+    task, _state_writer_task = _state_writer_task, None
+    if task is None or task.done():
+        return
+    # Transitions enqueued from here on are stored directly; the sentinel lets the writer
+    # finish the batch in flight and everything queued ahead of it
     try:
-        logger.info(f"Entering process_sensor_data_for_state: machine_id={machine_id}, sensor_type={sensor_type}")
-        
-        # Use the global detector registry
-        detector = get_machine_detector(machine_id)
-        
-        # Map sensor types to detector fields
-        sensor_mapping = {
-            'temperature': 'temp_zone_1',  # Use zone 1 for general temperature
-            'temperature sensor': 'temp_zone_1',
-            'pressure': 'pressure_bar',
-            'pressure sensor': 'pressure_bar',
-            'vibration': None,  # Not directly mapped, but could affect derived metrics
-            'vibration sensor': None,
-            'motor_current': 'motor_load',
-            'motor current': 'motor_load',
-            'motor current sensor': 'motor_load',
-            'rpm': 'screw_rpm',
-            'rpm sensor': 'screw_rpm',
-            'speed sensor': 'screw_rpm',
-            'load sensor': 'motor_load',
-            'current sensor': 'motor_load',
-            'torque sensor': None,  # Could be mapped to motor_load if needed
-            'flow sensor': None,
-            'oil level sensor': None
-        }
-        
-        field_name = sensor_mapping.get(sensor_type.lower())
-        logger.info(f"Processing sensor data: machine_id={machine_id}, sensor_type={sensor_type}, field_name={field_name}")
-        
-        if field_name:
-            # Get current state and existing sensor data
-            current_state = detector.get_current_state()
-            
-            # Create a new reading with the new value and existing values
-            reading = SensorReading(timestamp=timestamp)
-            
-            # Copy existing values from current state metrics if available
-            if current_state.metrics:
-                if field_name != 'temp_zone_1' and current_state.metrics.temp_avg:
-                    reading.temp_zone_1 = current_state.metrics.temp_avg
-                if field_name != 'pressure_bar' and hasattr(current_state.metrics, 'pressure_bar') and current_state.metrics.pressure_bar:
-                    reading.pressure_bar = current_state.metrics.pressure_bar
-                if field_name != 'screw_rpm' and hasattr(current_state.metrics, 'screw_rpm') and current_state.metrics.screw_rpm:
-                    reading.screw_rpm = current_state.metrics.screw_rpm
-                if field_name != 'motor_load' and hasattr(current_state.metrics, 'motor_load') and current_state.metrics.motor_load:
-                    reading.motor_load = current_state.metrics.motor_load
-            
-            # Update the specific field
-            if field_name == 'temp_zone_1':
-                reading.temp_zone_1 = value
-            elif field_name == 'pressure_bar':
-                reading.pressure_bar = value
-            elif field_name == 'motor_load':
-                reading.motor_load = value
-            elif field_name == 'screw_rpm':
-                reading.screw_rpm = value
-            
-            # Process the reading for state detection
-            detector.add_reading(reading)
-            
-            # Store state in database if changed
-            new_state = detector.get_current_state()
-            if new_state.state != current_state.state:
-                await store_machine_state_in_db(session, machine_id, new_state)
-                logger.info(f"Machine {machine_id} state changed to {new_state.state.value}")
-                
-    except Exception as e:
-        logger.error(f"Error processing sensor data for machine state: {e}")
+        await asyncio.wait_for(_state_write_queue.put(None), timeout=10)
+        queued_sentinel = True
+        done, _ = await asyncio.wait({task}, timeout=10)
+    except asyncio.TimeoutError:
+        queued_sentinel = False
+        done = set()
+    if not done:
+        logger.warning(
+            "Machine state writer did not stop cleanly - {} queued transitions not stored",
+            _state_write_queue.qsize() - queued_sentinel,
+        )
+        task.cancel()
 
 async def store_machine_state_in_db(session, machine_id: str, state_info: MachineStateInfo):
     """Store machine state transition in database"""
+    from app.models.machine_state import MachineState
+    
+    session.add(MachineState(**_machine_state_row(machine_id, state_info)))
     try:
-        from app.models.machine_state import MachineState, MachineStateEnum
-        
-        # Create machine state record
-        machine_state = MachineState(
-            machine_id=machine_id,
-            state=MachineStateEnum(state_info.state.value),
-            confidence=state_info.confidence,
-            state_since=state_info.state_since,
-            last_updated=state_info.last_updated,
-            metrics=state_info.metrics.__dict__ if state_info.metrics else {},
-            flags=state_info.flags or {}
-        )
-        
-        session.add(machine_state)
         await session.flush()  # Get ID without committing
-        
-        logger.info(f"Stored machine state transition: {machine_id} -> {state_info.state.value}")
-        
-    except Exception as e:
-        logger.error(f"Error storing machine state in database: {e}")
+    except SQLAlchemyError:
+        logger.exception("Error storing machine state in database for {}", machine_id)
+        return
+    
+    logger.info(f"Stored machine state transition: {machine_id} -> {state_info.state.value}")
@@ -1,25 +1,39 @@
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 import json
+import math
 import re
-from typing import Any, Dict, List, Optional, Tuple
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import numpy as np
 from loguru import logger
+from sqlalchemy import or_, select
+from sqlalchemy.exc import IntegrityError
 from tenacity import retry, stop_after_attempt, wait_exponential
 
 from app.core.config import get_settings
 from app.db.session import AsyncSessionLocal
 from app.schemas.machine import MachineCreate
-from app.schemas.prediction import PredictionCreate, PredictionRequest
+from app.schemas.prediction import PredictionCreate
 from app.schemas.sensor import SensorCreate
-from app.services import machine_service, prediction_service, sensor_service
+from app.schemas.sensor_data import SensorDataIn as SensorDataInSchema
+from app.services import machine_service, prediction_service, sensor_data_service, sensor_service
 from app.services import settings_service
+from app.services.baseline_learning_service import baseline_learning_service
 from app.services.machine_state_manager import MachineStateService
 from app.services.machine_state_service import SensorReading
 from app.services.extruder_ai_service import extruder_ai_service
 from app.models.machine import Machine
+from app.models.profile import Profile, ProfileBaselineStats
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional - fall back to NumPy
+    njit = None
 
 
 @dataclass
@@ -33,6 +47,251 @@ class ExtruderSqlRow:
     temp_zone4_c: float
 
 
+# Value columns of the feature window, in ExtruderSqlRow field order
+WINDOW_COLUMNS: Tuple[str, ...] = (
+    "screw_speed_rpm", "pressure_bar", "temp_zone1_c", "temp_zone2_c", "temp_zone3_c", "temp_zone4_c",
+)
+
+# Rows per fetchmany() round when reading new MSSQL rows
+FETCH_BATCH_ROWS = 1024
+
+# The MSSQL connection is kept open across polls; every CONNECTION_PING_POLLS polls it is
+# checked with a cheap SELECT 1 before the real query and reopened if it went stale
+CONNECTION_PING_POLLS = 20
+
+# How long cached machine metadata (current material) is used before reloading it;
+# material changes through the dashboard invalidate it immediately
+MACHINE_META_CACHE_SECONDS = 300
+
+# How long the active profile's baseline_learning flag is trusted before re-querying it.
+# collect_sample re-checks the flag, so a stale "learning" entry never stores samples.
+PROFILE_CACHE_SECONDS = 30
+
+# How long the active profile's baseline stats are reused for AI requests; they only change
+# when a profile is created, finalized or rolled back, which invalidates the cache
+BASELINE_CACHE_SECONDS = 300
+
+# Polls that bring no newer row skip all feature/scoring work; one info line is logged
+# every IDLE_POLL_LOG_EVERY such polls so the data cadence stays visible
+IDLE_POLL_LOG_EVERY = 60
+
+# Buffered MSSQL predictions are flushed once this many are waiting, or before the oldest
+# would wait longer than PREDICTION_FLUSH_SECONDS (so slow poll intervals flush every poll)
+PREDICTION_BATCH_SIZE = 50
+PREDICTION_FLUSH_SECONDS = 5
+
+# Feature name prefixes of the series summarized by _compute_features, in matrix row order
+FEATURE_SERIES: Tuple[str, ...] = (
+    "rpm", "pressure", "temp_avg", "temp_zone1", "temp_zone2", "temp_zone3", "temp_zone4",
+)
+
+# Without numba, windows up to this many rows use the pure-Python _window_features_small:
+# below ~64 rows NumPy's per-call overhead costs more than the arithmetic itself
+SMALL_WINDOW_ROWS = 32
+
+# Keys of the _window_features output vector, in order
+FEATURE_KEYS: Tuple[str, ...] = tuple(
+    f"{prefix}_{stat}" for prefix in FEATURE_SERIES for stat in ("ma", "std", "delta", "delta_from_ma")
+) + ("corr_pressure_rpm", "corr_tempavg_rpm")
+
+
+def _window_features_numpy(values: np.ndarray) -> np.ndarray:
+    """Window features (FEATURE_KEYS order) from a (6, n >= 2) column matrix in WINDOW_COLUMNS order"""
+    n = values.shape[1]
+    rpm, pressure, tz1, tz2, tz3, tz4 = values
+    temp_avg = (tz1 + tz2 + tz3 + tz4) * 0.25
+    # All series as one (7, n) matrix in FEATURE_SERIES order: one mean and one std reduction
+    series = np.vstack((rpm, pressure, temp_avg, tz1, tz2, tz3, tz4))
+    means = series.mean(axis=1)
+    stds = series.std(axis=1)
+    lasts = series[:, -1]
+    out = np.empty(len(FEATURE_KEYS))
+    out[:-2] = np.column_stack((means, stds, lasts - series[:, -2], lasts - means)).ravel()
+    
+    # Pearson correlations against rpm, reusing the means/stds above (rows 0-2: rpm, pressure, temp_avg)
+    out[-2:] = 0.0
+    if n >= 3:
+        centered = series[:3] - means[:3, None]
+        covs = (centered[1:] * centered[0]).mean(axis=1)
+        denoms = stds[1:3] * stds[0]
+        # Constant series (zero std) have no defined correlation - report 0.0
+        positive = denoms > 0.0
+        out[-2:][positive] = np.clip(covs[positive] / denoms[positive], -1.0, 1.0)
+    return out
+
+
+def _window_features_small(values: np.ndarray) -> List[float]:
+    """_window_features_numpy on plain Python floats, for windows of at most SMALL_WINDOW_ROWS"""
+    rpm, pressure, tz1, tz2, tz3, tz4 = values.tolist()
+    n = len(rpm)
+    temp_avg = [(a + b + c + d) * 0.25 for a, b, c, d in zip(tz1, tz2, tz3, tz4)]
+    out: List[float] = []
+    means: List[float] = []
+    stds: List[float] = []
+    for x in (rpm, pressure, temp_avg, tz1, tz2, tz3, tz4):
+        mean = sum(x) / n
+        std = math.sqrt(sum([(v - mean) * (v - mean) for v in x]) / n)
+        means.append(mean)
+        stds.append(std)
+        out += (mean, std, x[-1] - x[-2], x[-1] - mean)
+    for k, other in ((1, pressure), (2, temp_avg)):
+        denom = stds[k] * stds[0]
+        if n >= 3 and denom > 0.0:
+            cov = sum([(o - means[k]) * (r - means[0]) for o, r in zip(other, rpm)]) / n
+            out.append(min(1.0, max(-1.0, cov / denom)))
+        else:
+            out.append(0.0)
+    return out
+
+
+if njit is not None:
+    @njit(cache=True)
+    def _window_features(values):
+        """Native version of _window_features_numpy: one compiled pass per statistic, no temporaries"""
+        n = values.shape[1]
+        num_series = 7
+        temp_avg = np.empty(n)
+        for j in range(n):
+            temp_avg[j] = (values[2, j] + values[3, j] + values[4, j] + values[5, j]) * 0.25
+        # FEATURE_SERIES order: rpm, pressure, temp_avg, temp_zone1..4
+        rows = (0, 1, -1, 2, 3, 4, 5)
+        means = np.empty(num_series)
+        stds = np.empty(num_series)
+        out = np.zeros(num_series * 4 + 2)
+        for i in range(num_series):
+            x = temp_avg if rows[i] < 0 else values[rows[i]]
+            total = 0.0
+            for j in range(n):
+                total += x[j]
+            mean = total / n
+            ss = 0.0
+            for j in range(n):
+                d = x[j] - mean
+                ss += d * d
+            means[i] = mean
+            stds[i] = np.sqrt(ss / n)
+            out[4 * i] = mean
+            out[4 * i + 1] = stds[i]
+            out[4 * i + 2] = x[n - 1] - x[n - 2]
+            out[4 * i + 3] = x[n - 1] - mean
+        if n >= 3:
+            for k in range(2):
+                other = values[1] if k == 0 else temp_avg
+                denom = stds[k + 1] * stds[0]
+                if denom > 0.0:
+                    cov = 0.0
+                    for j in range(n):
+                        cov += (other[j] - means[k + 1]) * (values[0, j] - means[0])
+                    out[num_series * 4 + k] = min(1.0, max(-1.0, cov / n / denom))
+        return out
+else:
+    logger.warning("numba not installed - MSSQL window features use the NumPy implementation")
+    _window_features = _window_features_numpy
+
+
+# Table and index names are interpolated into SQL, so only simple identifiers are allowed
+_IDENTIFIER_RE = re.compile(r"[A-Za-z0-9_]+")
+
+_BLOCKED_SQL_TOKENS = (
+    "insert ",
+    "update ",
+    "delete ",
+    "merge ",
+    "alter ",
+    "drop ",
+    "create ",
+    "truncate ",
+    "exec ",
+    "execute ",
+    ";",
+)
+
+
+def _ensure_select_only(sql: str) -> None:
+    s = (sql or "").strip().lower()
+    if not s.startswith("select"):
+        raise ValueError("Non-SELECT statement blocked")
+    if any(tok in s for tok in _BLOCKED_SQL_TOKENS):
+        raise ValueError("Potentially unsafe SQL blocked")
+
+
+class _WindowBuffer:
+    """Feature window as column arrays (struct of arrays), oldest row first.
+    
+    Live rows occupy [start, end) of preallocated arrays, so every column is a contiguous
+    NumPy view; trimming advances start and appends compact or grow the arrays when full.
+    Values stay float64: the window is small, and the correlation features subtract
+    nearly equal sums that float32 would round away.
+    """
+    
+    __slots__ = ("_td", "_vals", "_start", "_end")
+    
+    def __init__(self, capacity: int = 1024) -> None:
+        self._td = np.empty(capacity, dtype="datetime64[us]")
+        self._vals = np.empty((len(WINDOW_COLUMNS), capacity), dtype=np.float64)
+        self._start = 0
+        self._end = 0
+    
+    def __len__(self) -> int:
+        return self._end - self._start
+    
+    def clear(self) -> None:
+        self._start = self._end = 0
+    
+    @property
+    def trend_dates(self) -> np.ndarray:
+        return self._td[self._start:self._end]
+    
+    @property
+    def values(self) -> np.ndarray:
+        """(columns, rows) view in WINDOW_COLUMNS order"""
+        return self._vals[:, self._start:self._end]
+    
+    def last_trend_date(self) -> datetime:
+        return self._td[self._end - 1].item()
+    
+    def _reserve(self, n: int) -> None:
+        live = self._end - self._start
+        capacity = self._td.shape[0]
+        if self._end + n <= capacity:
+            return
+        if live + n > capacity:
+            capacity = max(2 * capacity, live + n)
+            td = np.empty(capacity, dtype=self._td.dtype)
+            vals = np.empty((self._vals.shape[0], capacity), dtype=np.float64)
+        else:
+            td, vals = self._td, self._vals
+        # Move the live rows to the front (overlapping copies are safe in NumPy)
+        td[:live] = self._td[self._start:self._end]
+        vals[:, :live] = self._vals[:, self._start:self._end]
+        self._td, self._vals = td, vals
+        self._start, self._end = 0, live
+    
+    def extend(self, rows: List[ExtruderSqlRow]) -> None:
+        """Append rows, keeping the window ordered by trend date"""
+        n = len(rows)
+        if not n:
+            return
+        self._reserve(n)
+        lo, hi = self._end, self._end + n
+        self._td[lo:hi] = [r.trend_date for r in rows]
+        self._vals[:, lo:hi] = np.array(
+            [[getattr(r, col) for col in WINDOW_COLUMNS] for r in rows], dtype=np.float64
+        ).T
+        self._end = hi
+        # Rows arrive in TrendDate order; only re-sort if this batch broke the ordering. The
+        # stable sort is a timsort, which merges the already-sorted window and batch runs in
+        # linear time rather than sorting from scratch.
+        if (np.diff(self._td[max(self._start, lo - 1):hi]) < np.timedelta64(0)).any():
+            order = np.argsort(self._td[self._start:hi], kind="stable") + self._start
+            self._td[self._start:hi] = self._td[order]
+            self._vals[:, self._start:hi] = self._vals[:, order]
+    
+    def trim_before(self, cutoff: Union[datetime, np.datetime64]) -> None:
+        """Drop rows older than cutoff (binary search on the sorted dates)"""
+        self._start += int(np.searchsorted(self.trend_dates, np.datetime64(cutoff, "us"), side="left"))
+
+
 class MSSQLExtruderPoller:
     def __init__(
         self,
@@ -49,6 +308,8 @@ class MSSQLExtruderPoller:
         max_rows_per_poll: int,
         machine_name: str,
         sensor_name: str,
+        index_hint: str = "",
+        thread_pool_size: int = 2,
     ) -> None:
         self.enabled = enabled
         self.host = host
@@ -62,23 +323,66 @@ class MSSQLExtruderPoller:
         self.max_rows_per_poll = max_rows_per_poll
         self.machine_name = machine_name
         self.sensor_name = sensor_name
+        # Optional name of a TrendDate index to force with WITH (INDEX(...)) on the row query
+        self.index_hint = index_hint
+        # (seed, bootstrap, keyset) SQL, built on first fetch after each config change
+        self._queries: Optional[Tuple[str, str, str]] = None
+        # Blocking MSSQL calls run on their own threads, so a slow server cannot tie up the
+        # default executor used by asyncio.to_thread elsewhere (and vice versa)
+        self._executor = ThreadPoolExecutor(max_workers=thread_pool_size, thread_name_prefix="mssql")
 
         self._task: Optional[asyncio.Task] = None
         self._stop = asyncio.Event()
         self._last_trend_date: Optional[datetime] = None
-        self._window: List[ExtruderSqlRow] = []
+        self._window = _WindowBuffer()
 
         self._machine_id = None
         self._sensor_id = None
+        # str() of the ids above, formatted once for state keys and AI requests
+        self._machine_id_str: Optional[str] = None
+        self._sensor_id_str: Optional[str] = None
 
         self._config_last_loaded_at: Optional[datetime] = None
         self._config_reload_seconds: int = 30
         self._effective_enabled: bool = False
-        self._config_fingerprint: Optional[str] = None
+        self._config_fingerprint: Optional[Tuple[Any, ...]] = None
+
+        # Long-lived pymssql connection, only touched from _fetch_rows_blocking/_close_connection
+        # worker threads under _conn_lock; _conn_key records the settings it was opened with
+        self._conn = None
+        self._conn_key: Optional[Tuple[Any, ...]] = None
+        self._conn_lock = threading.Lock()
+        self._polls_since_ping: int = 0
+
+        # Next poll's fetch, started while the current rows are scored and persisted, and
+        # the config fingerprint it was started under; the semaphore keeps fetches from stacking
+        self._pending_fetch: Optional[asyncio.Task] = None
+        self._pending_fetch_fingerprint: Optional[Tuple[Any, ...]] = None
+        self._fetch_slot = asyncio.Semaphore(1)
+
+        # Cached machine metadata_json (current_material etc.), see _machine_metadata
+        self._machine_meta: Dict[str, Any] = {}
+        self._machine_meta_expires_at: Optional[datetime] = None
+
+        # (material_id, expires_at, profile_id, baseline_learning) from _learning_profile
+        self._profile_cache: Optional[Tuple[str, datetime, Optional[Any], bool]] = None
+
+        # material_id -> (expires_at, profile_id, baseline_stats) from _baseline
+        self._baseline_cache: Dict[str, Tuple[datetime, Optional[Any], Optional[Dict[str, Dict[str, float]]]]] = {}
+
+        # Predictions waiting for a batched insert (see _flush_predictions)
+        self._pred_buffer: List[PredictionCreate] = []
+        self._pred_flush_at: Optional[float] = None  # time.monotonic() deadline
+
+        # Consecutive polls without a newer row (see IDLE_POLL_LOG_EVERY)
+        self._idle_polls: int = 0
 
         self._consecutive_failures: int = 0
-        self._next_retry_at: Optional[datetime] = None
+        # time.monotonic() deadlines/stamps, immune to wall-clock jumps
+        self._next_retry_at: Optional[float] = None
         self._max_backoff_seconds: int = 300
+        self._last_disabled_log: float = -math.inf
+        self._last_missing_config_log: float = -math.inf
 
     def start(self, loop: asyncio.AbstractEventLoop) -> None:
         if not self.enabled:
@@ -102,12 +406,102 @@ class MSSQLExtruderPoller:
             await asyncio.wait_for(self._task, timeout=10)
         except Exception:
             pass
+        self._cancel_pending_fetch()
+        await self._flush_predictions()
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close_connection)
+
+    def _close_connection(self) -> None:
+        with self._conn_lock:
+            self._drop_connection()
+
+    def _drop_connection(self) -> None:
+        """Close and forget the MSSQL connection (caller holds _conn_lock)"""
+        conn, self._conn, self._conn_key = self._conn, None, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _get_connection(self):
+        """Open connection for the current settings, (re)connecting when needed (caller holds _conn_lock)"""
+        import pymssql
+
+        key = (self.host, self.port, self.username, self.password, self.database)
+        if self._conn is not None and self._conn_key != key:
+            # Settings were reloaded since this connection was opened
+            self._drop_connection()
+
+        if self._conn is not None:
+            self._polls_since_ping += 1
+            if self._polls_since_ping < CONNECTION_PING_POLLS:
+                return self._conn
+            self._polls_since_ping = 0
+            try:
+                cur = self._conn.cursor()
+                cur.execute("SELECT 1")
+                cur.fetchall()
+                return self._conn
+            except Exception as e:
+                logger.warning(f"MSSQL connection ping failed, reconnecting: {e}")
+                self._drop_connection()
+
+        conn = pymssql.connect(
+            server=self.host,
+            user=self.username,
+            password=self.password,
+            database=self.database,
+            port=self.port,
+            login_timeout=10,
+            timeout=10,
+        )
+        # Make the connection read-friendly. Session settings persist for its lifetime.
+        try:
+            conn.autocommit(True)
+        except Exception:
+            pass
+        try:
+            cur = conn.cursor()
+            cur.execute("SET NOCOUNT ON")
+            cur.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
+        except Exception:
+            # Not critical; continue.
+            pass
+        self._conn, self._conn_key = conn, key
+        self._polls_since_ping = 0
+        return conn
+
+    async def _fetch_rows(self, delay: float = 0.0) -> List[ExtruderSqlRow]:
+        if delay:
+            await asyncio.sleep(delay)
+        async with self._fetch_slot:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, self._fetch_rows_blocking)
+
+    def _cancel_pending_fetch(self) -> None:
+        if self._pending_fetch is not None:
+            self._pending_fetch.cancel()
+            self._pending_fetch = None
+
+    async def _flush_predictions(self) -> None:
+        """Store buffered predictions with one multi-row INSERT and one commit"""
+        batch, self._pred_buffer = self._pred_buffer, []
+        self._pred_flush_at = None
+        if not batch:
+            return
+        try:
+            async with AsyncSessionLocal() as session:
+                await prediction_service.persist_predictions(session, batch)
+        except Exception as e:
+            logger.error(f"Failed to persist {len(batch)} MSSQL predictions: {e}", exc_info=True)
 
     @staticmethod
     def _safe_float(v: Any) -> float:
+        # pymssql returns float for real/float columns; only other types pay for the conversion
+        if type(v) is float:
+            return v
+        if v is None:
+            return 0.0
         try:
-            if v is None:
-                return 0.0
             return float(v)
         except Exception:
             return 0.0
@@ -115,106 +509,64 @@ class MSSQLExtruderPoller:
     def _trim_window(self) -> None:
         if not self._window:
             return
-        cutoff = self._window[-1].trend_date - timedelta(minutes=self.window_minutes)
-        self._window = [r for r in self._window if r.trend_date >= cutoff]
+        # Cutoff computed in datetime64 straight from the newest row, no datetime round trip
+        self._window.trim_before(self._window.trend_dates[-1] - np.timedelta64(self.window_minutes, "m"))
 
     def _compute_features(self) -> Tuple[Dict[str, float], Dict[str, Any]]:
-        rows = self._window
-        if len(rows) < 2:
-            latest = rows[-1] if rows else None
+        n = len(self._window)
+        # Latest row as Python floats, in WINDOW_COLUMNS order
+        rpm, pressure, tz1, tz2, tz3, tz4 = self._window.values[:, -1].tolist() if n else (0.0,) * 6
+        temp_avg = (tz1 + tz2 + tz3 + tz4) * 0.25
+        if n < 2:
             readings = {
-                "rpm": float(latest.screw_speed_rpm) if latest else 0.0,
-                "pressure": float(latest.pressure_bar) if latest else 0.0,
-                "temperature": float(
-                    np.mean([
-                        latest.temp_zone1_c,
-                        latest.temp_zone2_c,
-                        latest.temp_zone3_c,
-                        latest.temp_zone4_c,
-                    ])
-                )
-                if latest
-                else 0.0,
+                "rpm": rpm,
+                "pressure": pressure,
+                "temperature": temp_avg,
             }
             meta = {
-                "window_size": len(rows),
+                "window_size": n,
                 "window_minutes": self.window_minutes,
                 "features": {},
             }
             return readings, meta
 
-        arr = {
-            "rpm": np.array([r.screw_speed_rpm for r in rows], dtype=np.float64),
-            "pressure": np.array([r.pressure_bar for r in rows], dtype=np.float64),
-            "tz1": np.array([r.temp_zone1_c for r in rows], dtype=np.float64),
-            "tz2": np.array([r.temp_zone2_c for r in rows], dtype=np.float64),
-            "tz3": np.array([r.temp_zone3_c for r in rows], dtype=np.float64),
-            "tz4": np.array([r.temp_zone4_c for r in rows], dtype=np.float64),
-        }
-        temp_avg = (arr["tz1"] + arr["tz2"] + arr["tz3"] + arr["tz4"]) / 4.0
-
-        def stats(x: np.ndarray, prefix: str) -> Dict[str, float]:
-            x = np.asarray(x, dtype=np.float64)
-            if len(x) == 0:
-                return {}
-            return {
-                f"{prefix}_ma": float(np.mean(x)),
-                f"{prefix}_std": float(np.std(x)),
-                f"{prefix}_delta": float(x[-1] - x[-2]) if len(x) >= 2 else 0.0,
-                f"{prefix}_delta_from_ma": float(x[-1] - float(np.mean(x))),
-            }
+        # Recomputed over the whole window on purpose: it is one vectorized (or compiled) pass
+        # over at most a few thousand contiguous rows, while rolling (Welford) moments would
+        # need per-row add/remove updates plus co-moments for the correlations, and drift as
+        # rows are evicted for as long as the poller runs.
+        values = self._window.values
+        if njit is None and n <= SMALL_WINDOW_ROWS:
+            feature_values = _window_features_small(values)
+        else:
+            feature_values = _window_features(values).tolist()
+        # Both paths yield Python floats, so readings/features need no further casts
+        features = dict(zip(FEATURE_KEYS, feature_values))
 
-        features: Dict[str, float] = {}
-        features.update(stats(arr["rpm"], "rpm"))
-        features.update(stats(arr["pressure"], "pressure"))
-        features.update(stats(temp_avg, "temp_avg"))
-        features.update(stats(arr["tz1"], "temp_zone1"))
-        features.update(stats(arr["tz2"], "temp_zone2"))
-        features.update(stats(arr["tz3"], "temp_zone3"))
-        features.update(stats(arr["tz4"], "temp_zone4"))
-
-        def corr(a: np.ndarray, b: np.ndarray) -> float:
-            if len(a) < 3 or len(b) < 3:
-                return 0.0
-            try:
-                c = float(np.corrcoef(a, b)[0, 1])
-                if np.isnan(c) or np.isinf(c):
-                    return 0.0
-                return c
-            except Exception:
-                return 0.0
-
-        features["corr_pressure_rpm"] = corr(arr["pressure"], arr["rpm"])
-        features["corr_tempavg_rpm"] = corr(temp_avg, arr["rpm"])
-
-        latest = rows[-1]
         readings = {
-            "rpm": float(latest.screw_speed_rpm),
-            "pressure": float(latest.pressure_bar),
-            "temperature": float(np.mean([latest.temp_zone1_c, latest.temp_zone2_c, latest.temp_zone3_c, latest.temp_zone4_c])),
-            "temp_zone1": float(latest.temp_zone1_c),
-            "temp_zone2": float(latest.temp_zone2_c),
-            "temp_zone3": float(latest.temp_zone3_c),
-            "temp_zone4": float(latest.temp_zone4_c),
-            "pressure_delta": float(features.get("pressure_delta", 0.0)),
-            "rpm_delta": float(features.get("rpm_delta", 0.0)),
-            "temp_avg_delta": float(features.get("temp_avg_delta", 0.0)),
-            "corr_pressure_rpm": float(features.get("corr_pressure_rpm", 0.0)),
+            "rpm": rpm,
+            "pressure": pressure,
+            "temperature": temp_avg,
+            "temp_zone1": tz1,
+            "temp_zone2": tz2,
+            "temp_zone3": tz3,
+            "temp_zone4": tz4,
+            "pressure_delta": features["pressure_delta"],
+            "rpm_delta": features["rpm_delta"],
+            "temp_avg_delta": features["temp_avg_delta"],
+            "corr_pressure_rpm": features["corr_pressure_rpm"],
         }
 
-        drift_score = float(
-            min(
-                1.0,
-                (
-                    abs(features.get("pressure_delta_from_ma", 0.0)) / 50.0
-                    + abs(features.get("temp_avg_delta_from_ma", 0.0)) / 20.0
-                )
-                / 2.0,
+        drift_score = min(
+            1.0,
+            (
+                abs(features["pressure_delta_from_ma"]) / 50.0
+                + abs(features["temp_avg_delta_from_ma"]) / 20.0
             )
+            / 2.0,
         )
 
         meta = {
-            "window_size": len(rows),
+            "window_size": n,
             "window_minutes": self.window_minutes,
             "features": features,
             "drift_score": drift_score,
@@ -260,6 +612,8 @@ class MSSQLExtruderPoller:
 
             self._machine_id = machine.id
             self._sensor_id = sensor.id
+            self._machine_id_str = str(machine.id)
+            self._sensor_id_str = str(sensor.id)
 
             # Ensure the machine is marked as an extruder for downstream logic that
             # checks metadata fields like machine_type/type.
@@ -276,6 +630,9 @@ class MSSQLExtruderPoller:
                 session.add(machine)
                 await session.commit()
 
+            self._machine_meta = dict(md)
+            self._machine_meta_expires_at = datetime.utcnow() + timedelta(seconds=MACHINE_META_CACHE_SECONDS)
+
     async def _load_runtime_config(self) -> None:
         now = datetime.utcnow()
         if self._config_last_loaded_at and (now - self._config_last_loaded_at).total_seconds() < self._config_reload_seconds:
@@ -310,7 +667,19 @@ class MSSQLExtruderPoller:
         # Master enable comes from env; effective enable comes from DB toggle.
         effective_enabled = bool(merged.get("enabled"))
 
-        fingerprint = json.dumps(merged, sort_keys=True)
+        # Compared by value; no need to serialize the whole config to detect changes
+        fingerprint = (
+            merged["host"],
+            merged["port"],
+            merged["username"],
+            merged["password"],
+            merged["database"],
+            merged["table"],
+            merged["poll_interval_seconds"],
+            merged["window_minutes"],
+            merged["max_rows_per_poll"],
+            merged["enabled"],
+        )
         if self._config_fingerprint != fingerprint:
             self.host = merged["host"]
             self.port = merged["port"]
@@ -323,8 +692,9 @@ class MSSQLExtruderPoller:
             self.max_rows_per_poll = merged["max_rows_per_poll"]
 
             # Reset the window if the data source or window size changes.
-            self._window = []
+            self._window.clear()
             self._last_trend_date = None
+            self._queries = None
 
             self._config_fingerprint = fingerprint
             logger.info("MSSQL extruder poller config reloaded from DB")
@@ -332,112 +702,96 @@ class MSSQLExtruderPoller:
         self._effective_enabled = effective_enabled
         self._config_last_loaded_at = now
 
-    @retry(stop=stop_after_attempt(5), wait=wait_exponential(min=1, max=20))
-    def _fetch_rows_sync(self) -> List[ExtruderSqlRow]:
-        import pymssql
-
+    def _build_queries(self) -> Tuple[str, str, str]:
+        """Seed, bootstrap and keyset statements for the configured table (fixed per config)"""
         # Prevent injection or accidental multi-statement execution via config.
         # Allow only simple identifiers like Tab_Actual.
-        if not re.fullmatch(r"[A-Za-z0-9_]+", self.table or ""):
+        if not _IDENTIFIER_RE.fullmatch(self.table or ""):
             raise ValueError("Invalid MSSQL table identifier")
+        if self.index_hint and not _IDENTIFIER_RE.fullmatch(self.index_hint):
+            raise ValueError("Invalid MSSQL index hint")
 
         table_sql = f"[dbo].[{self.table}]"
+        source_sql = f"{table_sql} WITH (INDEX([{self.index_hint}]))" if self.index_hint else table_sql
 
-        def _ensure_select_only(sql: str) -> None:
-            s = (sql or "").strip().lower()
-            if not s.startswith("select"):
-                raise ValueError("Non-SELECT statement blocked")
-            blocked = (
-                "insert ",
-                "update ",
-                "delete ",
-                "merge ",
-                "alter ",
-                "drop ",
-                "create ",
-                "truncate ",
-                "exec ",
-                "execute ",
-                ";",
+        seed_sql = f"SELECT TOP (1) TrendDate FROM {table_sql} ORDER BY TrendDate DESC"
+        _ensure_select_only(seed_sql)
+
+        def row_query(op: str) -> str:
+            query = (
+                f"SELECT TOP (@top) TrendDate, Val_4, Val_6, Val_7, Val_8, Val_9, Val_10 "
+                f"FROM {source_sql} "
+                f"WHERE TrendDate {op} @since "
+                f"ORDER BY TrendDate ASC"
             )
-            if any(tok in s for tok in blocked):
-                raise ValueError("Potentially unsafe SQL blocked")
+            _ensure_select_only(query)
+            # Through sp_executesql with TOP and the keyset as real parameters, so SQL Server
+            # caches one plan instead of compiling each poll's literal values; @since is datetime2
+            # because datetime rounds to 1/300 s and would skip or repeat rows at the keyset edge
+            return f"EXEC sp_executesql N'{query}', N'@top int, @since datetime2', @top = %d, @since = %s"
 
-        conn = pymssql.connect(
-            server=self.host,
-            user=self.username,
-            password=self.password,
-            database=self.database,
-            port=self.port,
-            login_timeout=10,
-            timeout=10,
-        )
-        try:
-            # Make the connection read-friendly.
-            try:
-                conn.autocommit(True)
-            except Exception:
-                pass
+        # First fetch includes the window start; later ones continue after the last row
+        return seed_sql, row_query(">="), row_query(">")
 
-            cur = conn.cursor(as_dict=True)
-            try:
-                cur.execute("SET NOCOUNT ON")
-                cur.execute("SET TRANSACTION ISOLATION LEVEL READ COMMITTED")
-            except Exception:
-                # Not critical; continue.
-                pass
+    @retry(stop=stop_after_attempt(5), wait=wait_exponential(min=1, max=20))
+    def _fetch_rows_blocking(self) -> List[ExtruderSqlRow]:
+        import pymssql
 
-            if self._last_trend_date is None:
-                query = (
-                    f"SELECT TOP ({self.max_rows_per_poll}) TrendDate, Val_4, Val_6, Val_7, Val_8, Val_9, Val_10 "
-                    f"FROM {table_sql} "
-                    f"WHERE TrendDate >= DATEADD(minute, -{int(self.window_minutes)}, GETDATE()) "
-                    f"ORDER BY TrendDate ASC"
-                )
-                _ensure_select_only(query)
-                cur.execute(query)
-            else:
-                query = (
-                    f"SELECT TOP ({self.max_rows_per_poll}) TrendDate, Val_4, Val_6, Val_7, Val_8, Val_9, Val_10 "
-                    f"FROM {table_sql} "
-                    f"WHERE TrendDate > %s "
-                    f"ORDER BY TrendDate ASC"
-                )
-                _ensure_select_only(query)
-                cur.execute(query, (self._last_trend_date,))
+        if self._queries is None:
+            self._queries = self._build_queries()
+        seed_sql, bootstrap_sql, keyset_sql = self._queries
 
-            rows = cur.fetchall() or []
-            out: List[ExtruderSqlRow] = []
-            for r in rows:
-                td = r.get("TrendDate")
-                if not isinstance(td, datetime):
-                    continue
-                out.append(
-                    ExtruderSqlRow(
-                        trend_date=td,
-                        screw_speed_rpm=self._safe_float(r.get("Val_4")),
-                        pressure_bar=self._safe_float(r.get("Val_6")),
-                        temp_zone1_c=self._safe_float(r.get("Val_7")),
-                        temp_zone2_c=self._safe_float(r.get("Val_8")),
-                        temp_zone3_c=self._safe_float(r.get("Val_9")),
-                        temp_zone4_c=self._safe_float(r.get("Val_10")),
-                    )
-                )
-            return out
-        finally:
+        with self._conn_lock:
             try:
-                conn.close()
-            except Exception:
-                pass
+                conn = self._get_connection()
+                # Positional tuples (no per-row dict), streamed in FETCH_BATCH_ROWS chunks
+                cur = conn.cursor()
+                since = self._last_trend_date
+                if since is None:
+                    # Cold start: seed the keyset from the newest row, so the first fetch is the
+                    # same index range read as every later poll instead of a separate window scan
+                    cur.execute(seed_sql)
+                    seed = cur.fetchone()
+                    if not seed or not isinstance(seed[0], datetime):
+                        return []
+                    since = seed[0] - timedelta(minutes=int(self.window_minutes))
+                    cur.execute(bootstrap_sql, (int(self.max_rows_per_poll), since))
+                else:
+                    cur.execute(keyset_sql, (int(self.max_rows_per_poll), since))
+
+                safe_float = self._safe_float
+                out: List[ExtruderSqlRow] = []
+                while True:
+                    chunk = cur.fetchmany(FETCH_BATCH_ROWS)
+                    if not chunk:
+                        break
+                    # Column order as selected: TrendDate, Val_4, Val_6, Val_7, Val_8, Val_9, Val_10.
+                    # Float values are taken as-is; only None/Decimal/other go through safe_float.
+                    for td, v4, v6, v7, v8, v9, v10 in chunk:
+                        if not isinstance(td, datetime):
+                            continue
+                        out.append(
+                            ExtruderSqlRow(
+                                td,
+                                v4 if type(v4) is float else safe_float(v4),
+                                v6 if type(v6) is float else safe_float(v6),
+                                v7 if type(v7) is float else safe_float(v7),
+                                v8 if type(v8) is float else safe_float(v8),
+                                v9 if type(v9) is float else safe_float(v9),
+                                v10 if type(v10) is float else safe_float(v10),
+                            )
+                        )
+                return out
+            except (pymssql.OperationalError, pymssql.InterfaceError):
+                # Broken connection: drop it so the retry (or next poll) reconnects
+                self._drop_connection()
+                raise
 
     async def _persist_sensor_snapshot(self, ts: datetime, readings: Dict[str, float]) -> None:
         """Persist a single sensor snapshot to sensor_data. Used for backward compatibility; prefer _persist_one_row for per-row storage."""
         if self._machine_id is None or self._sensor_id is None:
             return
         try:
-            from app.schemas.sensor_data import SensorDataIn as SensorDataInSchema
-            from app.services import sensor_data_service
-
             sensor_payload = SensorDataInSchema(
                 sensor_id=self._sensor_id,
                 machine_id=self._machine_id,
@@ -463,12 +817,7 @@ class MSSQLExtruderPoller:
         """Persist one MSSQL row to sensor_data. Uses idempotency_key to avoid duplicates on restart/re-poll."""
         if self._machine_id is None or self._sensor_id is None:
             return
-        from sqlalchemy.exc import IntegrityError
-
         try:
-            from app.schemas.sensor_data import SensorDataIn as SensorDataInSchema
-            from app.services import sensor_data_service
-
             ts = row.trend_date
             idempotency_key = f"{self._sensor_id}_{ts.isoformat()}"
             sensor_payload = SensorDataInSchema(
@@ -534,8 +883,17 @@ class MSSQLExtruderPoller:
                     "ai_raw": ai_result,
                 },
             )
-            # Store prediction (this also handles broadcasting to realtime channels)
-            await prediction_service.create_prediction(session, pred)
+            # Buffer the prediction; flushed as one batch (and broadcast) once PREDICTION_BATCH_SIZE
+            # are waiting, or now if the next poll would hold it past PREDICTION_FLUSH_SECONDS
+            self._pred_buffer.append(pred)
+            now = time.monotonic()
+            if self._pred_flush_at is None:
+                self._pred_flush_at = now + PREDICTION_FLUSH_SECONDS
+            if (
+                len(self._pred_buffer) >= PREDICTION_BATCH_SIZE
+                or now + self.poll_interval_seconds > self._pred_flush_at
+            ):
+                await self._flush_predictions()
 
             # ---------------- Machine state detection & extruder AI incidents ----------------
             try:
@@ -554,133 +912,214 @@ class MSSQLExtruderPoller:
                 )
 
                 # Process the reading and persist machine state / transitions / alerts.
-                await state_service.process_sensor_reading(str(self._machine_id), sensor_reading)
+                machine_id = self._machine_id_str
+                await state_service.process_sensor_reading(machine_id, sensor_reading)
 
-                # Load machine entity for extruder AI decision service.
                 # IMPORTANT: Process evaluation (traffic-light, baseline, anomalies) only runs in PRODUCTION.
-                machine = await session.get(Machine, self._machine_id)
-                if machine:
-                    # Check if machine is in PRODUCTION state before running AI decision logic
-                    current_state_info = await state_service.get_current_state(str(machine.id))
-                    is_in_production = (
-                        current_state_info is not None and 
-                        current_state_info.state.value == "PRODUCTION"
-                    )
-                    
-                    if is_in_production:
-                        # ---------------- Baseline Learning Sample Collection ----------------
-                        # Collect samples for baseline learning if active
-                        try:
-                            from app.services.baseline_learning_service import baseline_learning_service
-                            
-                            # Get material_id from machine metadata (default to "Material 1" if not set)
-                            material_id = (machine.metadata_json or {}).get("current_material", "Material 1")
-                            logger.info(
-                                f"🔍 Baseline learning check: machine_id={machine.id}, material_id={material_id}, "
-                                f"machine_state=PRODUCTION, machine_metadata={machine.metadata_json}"
-                            )
+                # Check if machine is in PRODUCTION state before running AI decision logic
+                current_state_info = await state_service.get_current_state(machine_id)
+                is_in_production = (
+                    current_state_info is not None and 
+                    current_state_info.state.value == "PRODUCTION"
+                )
+                
+                if is_in_production:
+                    # ---------------- Baseline Learning Sample Collection ----------------
+                    # Collect samples for baseline learning if active
+                    try:
+                        # Get material_id from machine metadata (default to "Material 1" if not set)
+                        material_id = (await self._machine_metadata(session)).get("current_material", "Material 1")
+                        profile_id, learning = await self._learning_profile(session, material_id)
+                        
+                        if learning:
+                            # Collect samples for baseline learning (only in PRODUCTION)
+                            samples = {
+                                "ScrewSpeed_rpm": readings.get("rpm"),
+                                "Pressure_bar": readings.get("pressure"),
+                                "Temp_Zone1_C": readings.get("temp_zone1"),
+                                "Temp_Zone2_C": readings.get("temp_zone2"),
+                                "Temp_Zone3_C": readings.get("temp_zone3"),
+                                "Temp_Zone4_C": readings.get("temp_zone4"),
+                            }
                             
-                            # Get active profile
-                            profile = await baseline_learning_service.get_active_profile(
-                                session, machine.id, material_id
-                            )
+                            # Calculate Temp_Avg and Temp_Spread
+                            temps = [
+                                readings.get("temp_zone1"),
+                                readings.get("temp_zone2"),
+                                readings.get("temp_zone3"),
+                                readings.get("temp_zone4"),
+                            ]
+                            valid_temps = [t for t in temps if t is not None]
+                            if valid_temps:
+                                samples["Temp_Avg"] = sum(valid_temps) / len(valid_temps)
+                                samples["Temp_Spread"] = max(valid_temps) - min(valid_temps) if len(valid_temps) >= 2 else 0.0
                             
-                            if profile and profile.baseline_learning:
-                                logger.info(
-                                    f"✅ Profile {profile.id} found with baseline_learning=True, "
-                                    f"collecting samples for material_id={material_id}"
+                            # Collect samples (only non-None values)
+                            valid_samples = {k: v for k, v in samples.items() if v is not None}
+                            if valid_samples:
+                                collected_count = await baseline_learning_service.collect_samples_batch(
+                                    session,
+                                    profile_id,
+                                    valid_samples,
+                                    "PRODUCTION",
+                                    ts,
                                 )
-                                # Collect samples for baseline learning (only in PRODUCTION)
-                                samples = {
-                                    "ScrewSpeed_rpm": readings.get("rpm"),
-                                    "Pressure_bar": readings.get("pressure"),
-                                    "Temp_Zone1_C": readings.get("temp_zone1"),
-                                    "Temp_Zone2_C": readings.get("temp_zone2"),
-                                    "Temp_Zone3_C": readings.get("temp_zone3"),
-                                    "Temp_Zone4_C": readings.get("temp_zone4"),
-                                }
-                                
-                                # Calculate Temp_Avg and Temp_Spread
-                                temps = [
-                                    readings.get("temp_zone1"),
-                                    readings.get("temp_zone2"),
-                                    readings.get("temp_zone3"),
-                                    readings.get("temp_zone4"),
-                                ]
-                                valid_temps = [t for t in temps if t is not None]
-                                if valid_temps:
-                                    import statistics
-                                    samples["Temp_Avg"] = statistics.mean(valid_temps)
-                                    samples["Temp_Spread"] = max(valid_temps) - min(valid_temps) if len(valid_temps) >= 2 else 0.0
-                                
-                                # Collect samples (only non-None values)
-                                valid_samples = {k: v for k, v in samples.items() if v is not None}
-                                if valid_samples:
-                                    collected_count = await baseline_learning_service.collect_samples_batch(
-                                        session,
-                                        profile.id,
-                                        valid_samples,
-                                        "PRODUCTION",
-                                        ts,
+                                if collected_count > 0:
+                                    logger.info(
+                                        f"✅ Collected {collected_count} baseline samples for profile {profile_id} "
+                                        f"(machine_id={machine_id}, material_id={material_id})"
                                     )
-                                    if collected_count > 0:
-                                        logger.info(
-                                            f"✅ Collected {collected_count} baseline samples for profile {profile.id} "
-                                            f"(machine_id={machine.id}, material_id={material_id})"
-                                        )
-                                    else:
-                                        logger.warning(
-                                            f"⚠️ No samples collected for profile {profile.id} "
-                                            f"(machine_id={machine.id}, material_id={material_id}) - "
-                                            f"valid_samples={len(valid_samples)}, readings={readings}"
-                                        )
-                            elif profile:
-                                logger.info(
-                                    f"⏸️ Profile {profile.id} found but baseline_learning={profile.baseline_learning}, "
-                                    f"skipping sample collection (material_id={material_id})"
-                                )
-                            else:
-                                logger.warning(
-                                    f"⚠️ No active profile found for machine_id={machine.id}, material_id={material_id}, "
-                                    f"skipping baseline sample collection. "
-                                    f"Machine metadata: {machine.metadata_json}"
-                                )
-                        except Exception as e:
-                            # Non-blocking: baseline learning should not break main flow
-                            logger.warning(f"Baseline learning sample collection failed: {e}", exc_info=True)
-                        
-                        # Feed canonical variables into the extruder AI decision window.
-                        # We always provide pressure and average temperature when available.
-                        if readings.get("temperature") is not None:
-                            extruder_ai_service.observe(
-                                machine_id=str(machine.id),
-                                var_name="temperature",
-                                value=float(readings["temperature"]),
-                                timestamp=ts,
-                            )
-                        if readings.get("pressure") is not None:
-                            extruder_ai_service.observe(
-                                machine_id=str(machine.id),
-                                var_name="pressure",
-                                value=float(readings["pressure"]),
-                                timestamp=ts,
-                            )
+                                else:
+                                    logger.warning(
+                                        f"⚠️ No samples collected for profile {profile_id} "
+                                        f"(machine_id={machine_id}, material_id={material_id}) - "
+                                        f"valid_samples={len(valid_samples)}, readings={readings}"
+                                    )
+                    except Exception as e:
+                        # Non-blocking: baseline learning should not break main flow
+                        logger.warning(f"Baseline learning sample collection failed: {e}", exc_info=True)
+                    
+                    # Feed canonical variables into the extruder AI decision window.
+                    # We always provide pressure and average temperature when available.
+                    if readings.get("temperature") is not None:
+                        extruder_ai_service.observe(
+                            machine_id=machine_id,
+                            var_name="temperature",
+                            value=float(readings["temperature"]),
+                            timestamp=ts,
+                        )
+                    if readings.get("pressure") is not None:
+                        extruder_ai_service.observe(
+                            machine_id=machine_id,
+                            var_name="pressure",
+                            value=float(readings["pressure"]),
+                            timestamp=ts,
+                        )
 
-                        # Decide on profile transitions and calmly create/resolve incidents.
-                        # Only in PRODUCTION state.
-                        decision = extruder_ai_service.decide(machine_id=str(machine.id), now=ts)
-                        if decision:
+                    # Decide on profile transitions and calmly create/resolve incidents.
+                    # Only in PRODUCTION state.
+                    decision = extruder_ai_service.decide(machine_id=machine_id, now=ts)
+                    if decision:
+                        # The AI state is written to the machine row, so load the entity here only
+                        machine = await session.get(Machine, self._machine_id)
+                        if machine:
                             await extruder_ai_service.apply_and_maybe_raise_incident(
                                 session,
                                 machine=machine,
                                 observed_at=ts,
                                 decision=decision,
                             )
-                    # When not in PRODUCTION: skip AI decision logic (no traffic-light, no baselines, no risk scores)
+                # When not in PRODUCTION: skip AI decision logic (no traffic-light, no baselines, no risk scores)
             except Exception as e:
                 # Non-blocking: prediction persistence must not fail due to state/incident logic.
                 logger.error(f"MSSQL extruder machine state / incident processing failed: {e}", exc_info=True)
 
+    async def _machine_metadata(self, session) -> Dict[str, Any]:
+        """Machine metadata_json, reloaded at most every MACHINE_META_CACHE_SECONDS or after invalidation"""
+        now = datetime.utcnow()
+        if self._machine_meta_expires_at is None or now >= self._machine_meta_expires_at:
+            machine = await session.get(Machine, self._machine_id)
+            self._machine_meta = dict((machine.metadata_json if machine else None) or {})
+            self._machine_meta_expires_at = now + timedelta(seconds=MACHINE_META_CACHE_SECONDS)
+        return self._machine_meta
+
+    def invalidate_machine_metadata(self) -> None:
+        """Force the next poll to reload machine metadata (e.g. after a material change)"""
+        self._machine_meta_expires_at = None
+        self.invalidate_profiles()
+
+    def invalidate_profiles(self) -> None:
+        """Drop cached profile lookups (e.g. after a profile is created, finalized or rolled back)"""
+        self._profile_cache = None
+        self._baseline_cache.clear()
+
+    async def _learning_profile(self, session, material_id: str) -> Tuple[Optional[Any], bool]:
+        """(profile id, baseline_learning) of the active profile, re-queried at most every PROFILE_CACHE_SECONDS"""
+        now = datetime.utcnow()
+        cached = self._profile_cache
+        if cached is not None and cached[0] == material_id and now < cached[1]:
+            return cached[2], cached[3]
+
+        logger.info(
+            f"🔍 Baseline learning check: machine_id={self._machine_id}, material_id={material_id}, "
+            f"machine_state=PRODUCTION, machine_metadata={self._machine_meta}"
+        )
+        profile = await baseline_learning_service.get_active_profile(session, self._machine_id, material_id)
+        if profile and profile.baseline_learning:
+            logger.info(
+                f"✅ Profile {profile.id} found with baseline_learning=True, "
+                f"collecting samples for material_id={material_id}"
+            )
+        elif profile:
+            logger.info(
+                f"⏸️ Profile {profile.id} found but baseline_learning={profile.baseline_learning}, "
+                f"skipping sample collection (material_id={material_id})"
+            )
+        else:
+            logger.warning(
+                f"⚠️ No active profile found for machine_id={self._machine_id}, material_id={material_id}, "
+                f"skipping baseline sample collection. "
+                f"Machine metadata: {self._machine_meta}"
+            )
+
+        profile_id = profile.id if profile else None
+        learning = bool(profile and profile.baseline_learning)
+        self._profile_cache = (material_id, now + timedelta(seconds=PROFILE_CACHE_SECONDS), profile_id, learning)
+        return profile_id, learning
+
+    async def _baseline(self, session, material_id: str) -> Tuple[Optional[Any], Optional[Dict[str, Dict[str, float]]]]:
+        """(profile id, baseline stats) sent with AI requests, re-queried at most every BASELINE_CACHE_SECONDS"""
+        now = datetime.utcnow()
+        cached = self._baseline_cache.get(material_id)
+        if cached is not None and now < cached[0]:
+            return cached[1], cached[2]
+
+        profile_id = None
+        baseline_stats = None
+        # Active profile(s) for this material and their baseline stats in one query:
+        # the machine-specific profile and the material default, each joined to its stats
+        result = await session.execute(
+            select(
+                Profile.id,
+                Profile.machine_id,
+                Profile.baseline_ready,
+                ProfileBaselineStats.metric_name,
+                ProfileBaselineStats.baseline_mean,
+                ProfileBaselineStats.baseline_std,
+                ProfileBaselineStats.p05,
+                ProfileBaselineStats.p95,
+            )
+            .outerjoin(ProfileBaselineStats, ProfileBaselineStats.profile_id == Profile.id)
+            .where(
+                Profile.material_id == material_id,
+                Profile.is_active == True,
+                or_(Profile.machine_id == self._machine_id, Profile.machine_id.is_(None)),
+            )
+        )
+        rows = result.all()
+        # Machine-specific profile wins over the material default (as in get_active_profile)
+        rows = [r for r in rows if r.machine_id is not None] or rows
+
+        if rows and rows[0].baseline_ready:
+            profile_id = rows[0].id
+
+            # Baseline stats for all metrics, built without None values in one pass over the rows
+            stats = {}
+            for r in rows:
+                if r.metric_name is None:
+                    continue
+                values = {
+                    k: float(v)
+                    for k, v in (("mean", r.baseline_mean), ("std", r.baseline_std), ("p05", r.p05), ("p95", r.p95))
+                    if v is not None
+                }
+                if values:
+                    stats[r.metric_name] = values
+            baseline_stats = stats or None
+
+        self._baseline_cache[material_id] = (now + timedelta(seconds=BASELINE_CACHE_SECONDS), profile_id, baseline_stats)
+        return profile_id, baseline_stats
+
     async def _score_with_ai_service(self, *, ts: datetime, readings: Dict[str, float]) -> Dict[str, Any]:
         if self._machine_id is None or self._sensor_id is None:
             return {}
@@ -692,59 +1131,28 @@ class MSSQLExtruderPoller:
         
         try:
             async with AsyncSessionLocal() as session:
-                machine = await session.get(Machine, self._machine_id)
-                if machine:
-                    material_id = (machine.metadata_json or {}).get("current_material", "Material 1")
-                    
-                    from app.services.baseline_learning_service import baseline_learning_service
-                    from app.models.profile import ProfileBaselineStats
-                    from sqlalchemy import select
-                    
-                    # Get active profile
-                    profile = await baseline_learning_service.get_active_profile(
-                        session, machine.id, material_id
-                    )
-                    
-                    if profile and profile.baseline_ready:
-                        profile_id = profile.id
-                        
-                        # Load baseline stats for all metrics
-                        stats_result = await session.execute(
-                            select(ProfileBaselineStats)
-                            .where(ProfileBaselineStats.profile_id == profile.id)
-                        )
-                        
-                        baseline_stats = {}
-                        for stat in stats_result.scalars().all():
-                            baseline_stats[stat.metric_name] = {
-                                "mean": float(stat.baseline_mean) if stat.baseline_mean is not None else None,
-                                "std": float(stat.baseline_std) if stat.baseline_std is not None else None,
-                                "p05": float(stat.p05) if stat.p05 is not None else None,
-                                "p95": float(stat.p95) if stat.p95 is not None else None,
-                            }
-                        
-                        # Remove None values
-                        baseline_stats = {k: {k2: v2 for k2, v2 in v.items() if v2 is not None} 
-                                        for k, v in baseline_stats.items() if any(v2 is not None for v2 in v.values())}
-                        
-                        if not baseline_stats:
-                            baseline_stats = None
+                material_id = (await self._machine_metadata(session)).get("current_material", "Material 1")
+                
+                profile_id, baseline_stats = await self._baseline(session, material_id)
         except Exception as e:
             # Non-blocking: baseline loading should not break predictions
             logger.debug(f"Failed to load baseline stats for AI prediction: {e}")
 
-        payload = PredictionRequest(
-            sensor_id=self._sensor_id,
-            machine_id=self._machine_id,
-            timestamp=ts,
-            value=float(readings.get("pressure", 0.0)),
-            context={"readings": readings},
-            profile_id=profile_id,
-            material_id=material_id,
-            baseline_stats=baseline_stats,
-        )
-        result = await prediction_service.call_ai_service(payload)
-        return result
+        # Request body built directly (as call_ai_service would from a PredictionRequest),
+        # with the ids already formatted; readings are always present here
+        ai_request = {
+            "sensor_id": self._sensor_id_str,
+            "machine_id": self._machine_id_str,
+            "timestamp": ts.isoformat(),
+            "readings": readings,
+        }
+        if profile_id:
+            ai_request["profile_id"] = str(profile_id)
+        if material_id:
+            ai_request["material_id"] = material_id
+        if baseline_stats:
+            ai_request["baseline_stats"] = baseline_stats
+        return await prediction_service.post_ai_request(ai_request)
 
     async def _run(self) -> None:
         logger.info("🚀 MSSQL extruder poller _run() started")
@@ -754,75 +1162,108 @@ class MSSQLExtruderPoller:
         while not self._stop.is_set():
             try:
                 await self._load_runtime_config()
+                now = time.monotonic()
 
                 if not self._effective_enabled:
                     # Log once per minute to avoid spam, but make it visible
-                    if not hasattr(self, '_last_disabled_log') or (datetime.utcnow() - self._last_disabled_log).total_seconds() > 60:
+                    if now - self._last_disabled_log > 60:
                         logger.warning(
                             "⏸️ MSSQL extruder poller DISABLED via DB setting (connections.mssql.enabled=false). "
                             "Enable it in Settings → Connections to start data collection."
                         )
-                        self._last_disabled_log = datetime.utcnow()
+                        self._last_disabled_log = now
+                    self._cancel_pending_fetch()
                     await asyncio.sleep(2)
                     continue
 
                 if not self.host or not self.username or not self.password:
                     # Log once per minute to avoid spam
-                    if not hasattr(self, '_last_missing_config_log') or (datetime.utcnow() - self._last_missing_config_log).total_seconds() > 60:
+                    if now - self._last_missing_config_log > 60:
                         logger.error(
                             f"❌ MSSQL extruder poller enabled but missing connection settings: "
                             f"host={bool(self.host)}, username={bool(self.username)}, password={bool(self.password)}. "
                             f"Configure MSSQL connection in Settings → Connections or set environment variables."
                         )
-                        self._last_missing_config_log = datetime.utcnow()
+                        self._last_missing_config_log = now
+                    self._cancel_pending_fetch()
                     await asyncio.sleep(5)
                     continue
 
-                now = datetime.utcnow()
-                if self._next_retry_at and now < self._next_retry_at:
+                if self._next_retry_at is not None and now < self._next_retry_at:
                     await asyncio.sleep(1)
                     continue
 
-                new_rows = await asyncio.to_thread(self._fetch_rows_sync)
+                if self._pending_fetch is not None:
+                    pending, self._pending_fetch = self._pending_fetch, None
+                    new_rows = await pending
+                    if self._pending_fetch_fingerprint != self._config_fingerprint:
+                        # Fetched under settings that were reloaded since; refetch from the new source
+                        new_rows = await self._fetch_rows()
+                else:
+                    new_rows = await self._fetch_rows()
+                previous_trend_date = self._last_trend_date
                 if new_rows:
                     logger.info(f"📥 MSSQL poller fetched {len(new_rows)} new rows")
                     # Persist each new row to sensor_data so /dashboard/extruder/history has data
                     for r in new_rows:
                         await self._persist_one_row(r)
-                    for r in new_rows:
-                        self._window.append(r)
-                    self._window.sort(key=lambda x: x.trend_date)
+                    self._window.extend(new_rows)
                     self._trim_window()
 
-                    self._last_trend_date = self._window[-1].trend_date
-
-                    readings, meta = self._compute_features()
-                    ts = self._window[-1].trend_date
+                    self._last_trend_date = self._window.last_trend_date()
 
-                    logger.info(
-                        f"🔄 Processing MSSQL data: ts={ts.isoformat()}, readings={readings}, window_size={meta.get('window_size')}"
+                # Features, scoring and the prediction only run when the window gained a newer
+                # row; idle polls (poll interval shorter than the data cadence) stop here
+                advanced = self._last_trend_date is not None and (
+                    previous_trend_date is None or self._last_trend_date > previous_trend_date
+                )
+                if advanced:
+                    self._idle_polls = 0
+
+                    # Start the next poll's fetch now so its wait and query overlap with
+                    # computing, scoring and persisting this batch (double buffering)
+                    self._pending_fetch = asyncio.create_task(self._fetch_rows(self.poll_interval_seconds))
+                    self._pending_fetch_fingerprint = self._config_fingerprint
+
+                    # Off the event loop; the window is only mutated by this loop
+                    readings, meta = await asyncio.to_thread(self._compute_features)
+                    ts = self._last_trend_date
+
+                    # Per-tick logs format their arguments only if a sink accepts the record
+                    logger.opt(lazy=True).info(
+                        "🔄 Processing MSSQL data: ts={}, readings={}, window_size={}",
+                        ts.isoformat,
+                        lambda: readings,
+                        lambda: meta.get("window_size"),
                     )
 
                     ai_result = await self._score_with_ai_service(ts=ts, readings=readings)
                     await self._persist_prediction(ts=ts, ai_result=ai_result, readings=readings, meta=meta)
 
-                    logger.info(
+                    logger.opt(lazy=True).info(
                         "MSSQL extruder tick: ts={}, score={}, status={}, drift={}, window_points={}",
-                        ts.isoformat(),
-                        ai_result.get("score"),
-                        ai_result.get("status"),
-                        meta.get("drift_score"),
-                        meta.get("window_size"),
+                        ts.isoformat,
+                        lambda: ai_result.get("score"),
+                        lambda: ai_result.get("status"),
+                        lambda: meta.get("drift_score"),
+                        lambda: meta.get("window_size"),
                     )
                 else:
-                    logger.debug(f"MSSQL poller: No new rows fetched (window_size={len(self._window)})")
+                    self._idle_polls += 1
+                    if self._idle_polls % IDLE_POLL_LOG_EVERY == 0:
+                        logger.info(
+                            "MSSQL poller idle: no new rows for {} polls (last_trend_date={}, window_size={})",
+                            self._idle_polls,
+                            self._last_trend_date,
+                            len(self._window),
+                        )
 
                 self._consecutive_failures = 0
                 self._next_retry_at = None
             except Exception as e:
                 self._consecutive_failures += 1
                 backoff = min(self._max_backoff_seconds, 2 ** min(self._consecutive_failures, 8))
-                self._next_retry_at = datetime.utcnow() + timedelta(seconds=backoff)
+                self._next_retry_at = time.monotonic() + backoff
                 logger.error(
                     "MSSQL extruder poller error (attempt={} backoff_s={}): {}",
                     self._consecutive_failures,
@@ -830,7 +1271,11 @@ class MSSQLExtruderPoller:
                     str(e),
                 )
 
-            await asyncio.sleep(self.poll_interval_seconds)
+            # A pending fetch already waits out the poll interval
+            if self._pending_fetch is None:
+                await asyncio.sleep(self.poll_interval_seconds)
+
+        self._cancel_pending_fetch()
 
 
 def build_mssql_extruder_poller_from_env() -> MSSQLExtruderPoller:
@@ -851,6 +1296,9 @@ def build_mssql_extruder_poller_from_env() -> MSSQLExtruderPoller:
     window_minutes = int(os.getenv("MSSQL_WINDOW_MINUTES", "10"))
     max_rows_per_poll = int(os.getenv("MSSQL_MAX_ROWS_PER_POLL", "5000"))
 
+    index_hint = os.getenv("MSSQL_INDEX_HINT", "")
+    thread_pool_size = int(os.getenv("MSSQL_THREAD_POOL", "2"))
+
     machine_name = os.getenv("MSSQL_MACHINE_NAME", "Extruder-SQL")
     sensor_name = os.getenv("MSSQL_SENSOR_NAME", "Extruder SQL Snapshot")
 
@@ -867,6 +1315,8 @@ def build_mssql_extruder_poller_from_env() -> MSSQLExtruderPoller:
         max_rows_per_poll=max_rows_per_poll,
         machine_name=machine_name,
         sensor_name=sensor_name,
+        index_hint=index_hint,
+        thread_pool_size=thread_pool_size,
     )
 
 
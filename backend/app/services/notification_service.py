@@ -1,10 +1,12 @@
 import asyncio
 import json
-import smtplib
+import time
 from datetime import datetime
 from email.message import EmailMessage
+from functools import lru_cache
 from typing import Optional, List
 
+import aiosmtplib
 import httpx
 from loguru import logger
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -21,9 +23,65 @@ settings = get_settings()
 _email_ready: bool = False
 _email_last_error: Optional[str] = None
 
+# Outgoing mail is queued and delivered by one worker task over a single long-lived,
+# authenticated SMTP session; when the queue is full new messages are dropped (and logged)
+EMAIL_QUEUE_SIZE = 1000
+# Idle interval after which the worker NOOPs the SMTP session to keep it (and check it) alive
+SMTP_NOOP_SECONDS = 60
 
+_email_queue: Optional[asyncio.Queue] = None
+_email_worker_task: Optional[asyncio.Task] = None
+_smtp: Optional[aiosmtplib.SMTP] = None
+_smtp_lock = asyncio.Lock()
+
+# Alarm notifications (recipient lookup + email, Slack) are dispatched by one worker task
+# from a bounded queue instead of one fire-and-forget task each; full queue drops (logged)
+NOTIFICATION_QUEUE_SIZE = 1000
+
+_notification_queue: Optional[asyncio.Queue] = None
+_notification_worker_task: Optional[asyncio.Task] = None
+
+# After SLACK_BREAKER_FAILURES consecutive failed webhook posts, Slack notifications are
+# skipped for SLACK_BREAKER_SECONDS instead of each one waiting out the timeout
+SLACK_BREAKER_FAILURES = 5
+SLACK_BREAKER_SECONDS = 60
+
+# One keep-alive client for the Slack webhook, closed by close_slack_client() on shutdown
+_slack_client = httpx.AsyncClient(timeout=10)
+
+
+class _SlackBreaker:
+    """Consecutive-failure circuit breaker for the Slack webhook."""
+
+    def __init__(self) -> None:
+        self.failures = 0
+        self.open_until = 0.0
+
+    def allow(self) -> bool:
+        return time.monotonic() >= self.open_until
+
+    def record(self, ok: bool) -> None:
+        if ok:
+            self.failures = 0
+            return
+        self.failures += 1
+        if self.failures >= SLACK_BREAKER_FAILURES:
+            self.open_until = time.monotonic() + SLACK_BREAKER_SECONDS
+            self.failures = 0
+            logger.warning("Slack webhook failed {} times in a row, pausing Slack notifications for {}s",
+                           SLACK_BREAKER_FAILURES, SLACK_BREAKER_SECONDS)
+
+
+_slack_breaker = _SlackBreaker()
+
+
+@lru_cache(maxsize=1)
 def email_configured() -> bool:
-    """Check whether SMTP settings are present."""
+    """Check whether SMTP settings are present.
+
+    Settings are read once per process (see the module-level ``settings``), so the answer
+    is cached; call ``email_configured.cache_clear()`` after changing them in tests.
+    """
     return bool(settings.email_smtp_host and settings.email_smtp_user and settings.email_smtp_pass)
 
 
@@ -45,9 +103,8 @@ async def verify_email_transport() -> None:
         return
 
     try:
-        with smtplib.SMTP(settings.email_smtp_host, settings.email_smtp_port, timeout=10) as server:
-            server.starttls()
-            server.login(settings.email_smtp_user, settings.email_smtp_pass)
+        # Also warms up the shared session used by the email worker
+        await _smtp_session(check=True)
         _email_ready = True
         _email_last_error = None
         logger.info("SMTP transport verified successfully")
@@ -57,6 +114,151 @@ async def verify_email_transport() -> None:
         logger.warning("SMTP transport verification failed: {}", exc)
 
 
+async def _smtp_session(check: bool = False) -> aiosmtplib.SMTP:
+    """Shared SMTP session (STARTTLS + login done once), reconnected when it was dropped"""
+    global _smtp
+    async with _smtp_lock:
+        if _smtp is not None and _smtp.is_connected:
+            if not check:
+                return _smtp
+            try:
+                await _smtp.noop()
+                return _smtp
+            except aiosmtplib.SMTPException:
+                _close_smtp()
+        smtp = aiosmtplib.SMTP(
+            hostname=settings.email_smtp_host,
+            port=settings.email_smtp_port,
+            username=settings.email_smtp_user,
+            password=settings.email_smtp_pass,
+            start_tls=True,
+            timeout=10,
+        )
+        await smtp.connect()
+        _smtp = smtp
+        return smtp
+
+
+def _close_smtp() -> None:
+    global _smtp
+    if _smtp is not None:
+        _smtp.close()
+        _smtp = None
+
+
+async def _send_now(message: EmailMessage) -> None:
+    """Send one message over the shared SMTP session; connect/login/send errors are raised"""
+    # Second attempt only after the server dropped an idle session
+    for attempt in range(2):
+        try:
+            smtp = await _smtp_session()
+            await smtp.send_message(message)
+            logger.info(f"Email notification sent successfully to {message['To']}")
+            return
+        except aiosmtplib.SMTPServerDisconnected:
+            _close_smtp()
+            if attempt:
+                raise
+
+
+async def _deliver_email(message: EmailMessage) -> None:
+    try:
+        await _send_now(message)
+    except Exception as exc:
+        logger.warning(f"Failed to send email to {message['To']}: {exc}")
+
+
+async def _email_worker() -> None:
+    """Send queued messages one at a time until the None sentinel from stop_email_worker."""
+    while True:
+        try:
+            message = await asyncio.wait_for(_email_queue.get(), timeout=SMTP_NOOP_SECONDS)
+        except asyncio.TimeoutError:
+            # Idle: keep the session alive, or drop it if the server went away
+            if _smtp is not None:
+                try:
+                    await _smtp_session(check=True)
+                except Exception as exc:
+                    logger.debug("SMTP session health check failed: {}", exc)
+            continue
+        try:
+            if message is None:
+                break
+            await _deliver_email(message)
+        finally:
+            _email_queue.task_done()
+
+
+def _enqueue_email(message: EmailMessage) -> None:
+    global _email_queue, _email_worker_task
+    if _email_worker_task is None or _email_worker_task.done():
+        _email_queue = asyncio.Queue(maxsize=EMAIL_QUEUE_SIZE)
+        _email_worker_task = asyncio.get_running_loop().create_task(_email_worker())
+    try:
+        _email_queue.put_nowait(message)
+    except asyncio.QueueFull:
+        logger.warning(f"Email queue full, dropping email to {message['To']}: {message['Subject']}")
+
+
+async def stop_email_worker() -> None:
+    """Deliver what is still queued, then close the SMTP session."""
+    global _email_worker_task
+    if _email_worker_task is not None and not _email_worker_task.done():
+        await _email_queue.put(None)
+        try:
+            await asyncio.wait_for(_email_worker_task, timeout=30)
+        except Exception as exc:
+            logger.warning("Email worker did not stop cleanly: {}", exc)
+    _email_worker_task = None
+    if _smtp is not None:
+        try:
+            await _smtp.quit()
+        except Exception:
+            pass
+        _close_smtp()
+
+
+async def _notification_worker() -> None:
+    """Dispatch queued alarm notifications until the None sentinel from stop_notification_worker."""
+    while True:
+        item = await _notification_queue.get()
+        try:
+            if item is None:
+                break
+            kind, payload = item
+            if kind == "email":
+                await _send_email(*payload)
+            else:
+                await _send_slack(payload)
+        except Exception as exc:
+            logger.warning("Failed to send {} alarm notification: {}", kind, exc)
+        finally:
+            _notification_queue.task_done()
+
+
+def _enqueue_notification(kind: str, payload) -> None:
+    global _notification_queue, _notification_worker_task
+    if _notification_worker_task is None or _notification_worker_task.done():
+        _notification_queue = asyncio.Queue(maxsize=NOTIFICATION_QUEUE_SIZE)
+        _notification_worker_task = asyncio.get_running_loop().create_task(_notification_worker())
+    try:
+        _notification_queue.put_nowait((kind, payload))
+    except asyncio.QueueFull:
+        logger.warning("Notification queue full, dropping {} alarm notification", kind)
+
+
+async def stop_notification_worker() -> None:
+    """Dispatch what is still queued (into the email queue / Slack), then stop the worker."""
+    global _notification_worker_task
+    if _notification_worker_task is not None and not _notification_worker_task.done():
+        await _notification_queue.put(None)
+        try:
+            await asyncio.wait_for(_notification_worker_task, timeout=30)
+        except Exception as exc:
+            logger.warning("Notification worker did not stop cleanly: {}", exc)
+    _notification_worker_task = None
+
+
 async def get_active_email_recipients(session: Optional[AsyncSession] = None) -> List[str]:
     """Get list of active email recipient addresses"""
     if session is None:
@@ -70,7 +272,13 @@ async def get_active_email_recipients(session: Optional[AsyncSession] = None) ->
     return list(recipients) if recipients else []
 
 
-async def _send_email(subject: str, body: str, to_override: Optional[str] = None, use_recipients: bool = True) -> None:
+async def _send_email(
+    subject: str,
+    body: str,
+    to_override: Optional[str] = None,
+    use_recipients: bool = True,
+    wait: bool = False,
+) -> None:
     """Send email with improved error handling
     
     Args:
@@ -78,6 +286,7 @@ async def _send_email(subject: str, body: str, to_override: Optional[str] = None
         body: Email body
         to_override: Single email address to send to (overrides recipients list)
         use_recipients: If True, send to all active recipients from database. If False, use default notification_email
+        wait: If True, deliver now instead of queueing and raise the first delivery error
     """
     if not email_configured():
         logger.warning("Email not configured, skipping email send")
@@ -104,31 +313,45 @@ async def _send_email(subject: str, body: str, to_override: Optional[str] = None
     # Get sender email (use email_sender from .env if configured, otherwise fallback to email_smtp_user from .env)
     sender_email = settings.email_sender if settings.email_sender else settings.email_smtp_user
     
-    # Send to all recipients
+    # One message per recipient, queued for the email worker (shared SMTP session) unless
+    # the caller waits for the result; a failure for one recipient does not affect the others
+    error: Optional[Exception] = None
     for recipient_email in recipients:
+        message = EmailMessage()
+        message["From"] = sender_email
+        message["To"] = recipient_email
+        message["Subject"] = subject
+        message.set_content(body)
+        if not wait:
+            _enqueue_email(message)
+            continue
         try:
-            message = EmailMessage()
-            message["From"] = sender_email
-            message["To"] = recipient_email
-            message["Subject"] = subject
-            message.set_content(body)
-
-            with smtplib.SMTP(settings.email_smtp_host, settings.email_smtp_port, timeout=10) as server:
-                server.starttls()
-                server.login(settings.email_smtp_user, settings.email_smtp_pass)
-                server.send_message(message)
-                logger.info(f"Email notification sent successfully to {recipient_email}")
+            await _send_now(message)
         except Exception as exc:
             logger.warning(f"Failed to send email to {recipient_email}: {exc}")
-            # Continue to next recipient even if one fails
+            error = error or exc
+    if error is not None:
+        raise error
 
 
 async def _send_slack(body: dict) -> None:
     if not settings.slack_webhook_url:
         logger.info("Slack webhook not configured, skipping notification")
         return
-    async with httpx.AsyncClient(timeout=10) as client:
-        await client.post(settings.slack_webhook_url, json=body)
+    if not _slack_breaker.allow():
+        logger.info("Slack webhook paused after repeated failures, skipping notification")
+        return
+    try:
+        response = await _slack_client.post(settings.slack_webhook_url, json=body)
+        response.raise_for_status()
+    except Exception:
+        _slack_breaker.record(False)
+        raise
+    _slack_breaker.record(True)
+
+
+async def close_slack_client() -> None:
+    await _slack_client.aclose()
 
 
 async def send_password_reset_email(email: str, reset_link: str) -> None:
@@ -144,7 +367,7 @@ async def send_password_reset_email(email: str, reset_link: str) -> None:
     
     If you did not request this, please ignore this email.
     """
-    await _send_email(subject, body, to_override=email)
+    await _send_email(subject, body, to_override=email, wait=True)
 
 
 async def send_test_email(to_override: Optional[str] = None) -> tuple[bool, Optional[str]]:
@@ -169,12 +392,13 @@ If you received this email, your email notification system is working correctly.
     try:
         # If to_override is provided, send only to that address
         # Otherwise, send to all active recipients
-        await _send_email(subject, body, to_override=to_override, use_recipients=True)
+        # Delivered directly so SMTP failures (e.g. 535 login errors) are reported to the caller
+        await _send_email(subject, body, to_override=to_override, use_recipients=True, wait=True)
         return True, None
     except ValueError as exc:
         # ValueError contains user-friendly error message
         return False, str(exc)
-    except Exception as exc:  # pragma: no cover - defensive
+    except Exception as exc:
         error_msg = str(exc)
         # Extract meaningful error from exception
         if "535" in error_msg or "BadCredentials" in error_msg:
@@ -218,22 +442,15 @@ async def send_welcome_email(email: str, full_name: str) -> None:
         logger.warning(f"Failed to send welcome email to {email}: {exc}")
 
 
-async def send_prediction_alert_email(machine_id: str, sensor_id: str, prediction_status: str, score: float, confidence: float) -> None:
-    """Send email notification for critical/warning predictions to all active recipients"""
-    if not email_configured():
-        logger.warning("Email not configured, skipping prediction alert")
-        return
-    
-    severity = "CRITICAL" if prediction_status in ["critical", "anomaly"] or score > 0.8 else "WARNING"
-    subject = f"[PM Alert] {severity} Prediction Detected - Machine {machine_id}"
-    body = f"""
+# Bound format of the fixed alert text; only the per-prediction fields are filled in per call
+_PREDICTION_ALERT_BODY = """
     Predictive Maintenance Alert
     
-    A {prediction_status.upper()} prediction has been detected:
+    A {status_upper} prediction has been detected:
     
     - Machine ID: {machine_id}
     - Sensor ID: {sensor_id}
-    - Prediction Status: {prediction_status}
+    - Prediction Status: {status}
     - Anomaly Score: {score:.2f}
     - Confidence: {confidence:.2f}
     
@@ -242,7 +459,25 @@ async def send_prediction_alert_email(machine_id: str, sensor_id: str, predictio
     Dashboard: http://localhost:3000
     
     This is an automated notification from the Predictive Maintenance Platform.
-    """
+    """.format
+
+
+async def send_prediction_alert_email(machine_id: str, sensor_id: str, prediction_status: str, score: float, confidence: float) -> None:
+    """Send email notification for critical/warning predictions to all active recipients"""
+    if not email_configured():
+        logger.warning("Email not configured, skipping prediction alert")
+        return
+    
+    severity = "CRITICAL" if prediction_status in ["critical", "anomaly"] or score > 0.8 else "WARNING"
+    subject = f"[PM Alert] {severity} Prediction Detected - Machine {machine_id}"
+    body = _PREDICTION_ALERT_BODY(
+        status_upper=prediction_status.upper(),
+        machine_id=machine_id,
+        sensor_id=sensor_id,
+        status=prediction_status,
+        score=score,
+        confidence=confidence,
+    )
     try:
         # Send to all active recipients from database (uses .env configuration)
         await _send_email(subject, body, to_override=None, use_recipients=True)
@@ -262,27 +497,21 @@ def enqueue_alarm_notification(alarm: Alarm, sensor: Optional[Sensor]) -> None:
         },
         indent=2,
     )
-    try:
-        loop = asyncio.get_running_loop()
-    except RuntimeError:
-        loop = asyncio.get_event_loop()
-
-    loop.create_task(_send_email(subject, body))
-    loop.create_task(
-        _send_slack(
-            {
-                "text": subject,
-                "blocks": [
-                    {"type": "section", "text": {"type": "mrkdwn", "text": f"*Alarm:* {alarm.message}"}},
-                    {
-                        "type": "context",
-                        "elements": [
-                            {"type": "mrkdwn", "text": f"*Severity:* {alarm.severity}"},
-                            {"type": "mrkdwn", "text": f"*Machine:* {alarm.machine_id}"},
-                        ],
-                    },
-                ],
-            }
-        )
+    _enqueue_notification("email", (subject, body))
+    _enqueue_notification(
+        "slack",
+        {
+            "text": subject,
+            "blocks": [
+                {"type": "section", "text": {"type": "mrkdwn", "text": f"*Alarm:* {alarm.message}"}},
+                {
+                    "type": "context",
+                    "elements": [
+                        {"type": "mrkdwn", "text": f"*Severity:* {alarm.severity}"},
+                        {"type": "mrkdwn", "text": f"*Machine:* {alarm.machine_id}"},
+                    ],
+                },
+            ],
+        },
     )
 
@@ -1,7 +1,10 @@
+import asyncio
 from datetime import datetime
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Set
+from uuid import uuid4
 
 import httpx
+import orjson
 from loguru import logger
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -11,14 +14,30 @@ from app.schemas.prediction import PredictionCreate, PredictionRequest
 
 settings = get_settings()
 
+# One pooled client for the AI service: connections are kept alive and reused across
+# predictions instead of a new TCP connection per call. Closed by close_ai_client() on shutdown.
+_ai_client = httpx.AsyncClient(
+    base_url=settings.ai_service_url,
+    timeout=httpx.Timeout(20.0, connect=5.0),
+    limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+)
+
+
+_JSON_HEADERS = {"content-type": "application/json"}
+
+
+async def close_ai_client() -> None:
+    await _ai_client.aclose()
+
+
+# PredictionCreate field (= table column) -> Prediction attribute, where the two differ
+_RENAMES = {"metadata": "metadata_json", "remaining_useful_life": "rul"}
+
 
 def _prepare_payload(data: dict) -> dict:
-    metadata = data.pop("metadata", None)
-    if metadata is not None:
-        data["metadata_json"] = metadata
-    # Map remaining_useful_life to rul (model column name)
-    if "remaining_useful_life" in data:
-        data["rul"] = data.pop("remaining_useful_life")
+    for old, new in _RENAMES.items():
+        if old in data:
+            data[new] = data.pop(old)
     return data
 
 
@@ -40,45 +59,106 @@ async def call_ai_service(payload: PredictionRequest) -> Dict[str, Any]:
     if payload.baseline_stats:
         ai_request["baseline_stats"] = payload.baseline_stats
     
-    async with httpx.AsyncClient(timeout=20) as client:
-        response = await client.post(f"{settings.ai_service_url}/predict", json=ai_request)
-        response.raise_for_status()
-        return response.json()
+    return await post_ai_request(ai_request)
 
 
-async def persist_prediction(session: AsyncSession, payload: PredictionCreate) -> Prediction:
+async def post_ai_request(ai_request: Dict[str, Any]) -> Dict[str, Any]:
+    """POST a ready /predict body (ids and timestamp already strings) to the AI service"""
+    # orjson instead of httpx's json= (stdlib json.dumps + encode) for the body
+    response = await _ai_client.post(
+        "/predict",
+        content=orjson.dumps(ai_request, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY),
+        headers=_JSON_HEADERS,
+    )
+    response.raise_for_status()
+    return orjson.loads(response.content)
+
+
+def _prediction_row(payload: PredictionCreate) -> dict:
+    """Column values for a prediction; PredictionCreate field names are the column names"""
     data = payload.model_dump()
     # Ensure score is set if not provided (use confidence or default)
     if data.get("score") is None:
         data["score"] = data.get("confidence", 0.0) or 0.0
-    prediction = Prediction(**_prepare_payload(data))
-    session.add(prediction)
-    await session.commit()
-    await session.refresh(prediction)
-    
-    # Broadcast real-time update
+    return data
+
+
+# Broadcasts run as background tasks so websocket fan-out never delays the commit path;
+# references are kept until done (the loop only holds weak ones)
+_broadcast_tasks: Set[asyncio.Task] = set()
+
+
+def _prediction_event(prediction: Any) -> Dict[str, Any]:
+    """prediction.created payload for a stored prediction (ORM object or column-name mapping)"""
+    get = prediction.get if isinstance(prediction, dict) else lambda name: getattr(prediction, name)
+    score, confidence, timestamp = get("score"), get("confidence"), get("timestamp")
+    return {
+        "id": str(get("id")),
+        "machine_id": str(get("machine_id")),
+        "sensor_id": str(get("sensor_id")),
+        "status": get("status") or "normal",
+        "prediction": get("prediction") or "normal",
+        "score": float(score) if score else 0.0,
+        "confidence": float(confidence) if confidence else 0.0,
+        "timestamp": timestamp.isoformat() if timestamp else None,
+        "anomaly_type": get("anomaly_type"),
+    }
+
+
+async def _broadcast_predictions(events: List[Dict[str, Any]]) -> None:
+    from app.api.routers.realtime import broadcast_update
+    for event in events:
+        try:
+            await broadcast_update("prediction.created", event)
+        except Exception as e:
+            logger.debug(f"Failed to broadcast prediction update: {e}")
+
+
+def _broadcast_done(task: asyncio.Task) -> None:
+    _broadcast_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.debug(f"Failed to broadcast prediction update: {task.exception()}")
+
+
+def _schedule_broadcast(predictions: List[Any]) -> None:
+    """Broadcast real-time updates for stored predictions in the background, in order"""
     try:
-        from app.api.routers.realtime import broadcast_update
-        await broadcast_update(
-            "prediction.created",
-            {
-                "id": str(prediction.id),
-                "machine_id": str(prediction.machine_id),
-                "sensor_id": str(prediction.sensor_id),
-                "status": prediction.status or "normal",
-                "prediction": prediction.prediction or "normal",
-                "score": float(prediction.score) if prediction.score else 0.0,
-                "confidence": float(prediction.confidence) if prediction.confidence else 0.0,
-                "timestamp": prediction.timestamp.isoformat() if prediction.timestamp else None,
-                "anomaly_type": prediction.anomaly_type,
-            }
-        )
+        # Payloads are built now, while the ORM objects are still loaded
+        events = [_prediction_event(prediction) for prediction in predictions]
+        task = asyncio.get_running_loop().create_task(_broadcast_predictions(events))
     except Exception as e:
         logger.debug(f"Failed to broadcast prediction update: {e}")
+        return
+    _broadcast_tasks.add(task)
+    task.add_done_callback(_broadcast_done)
+
+
+async def persist_prediction(session: AsyncSession, payload: PredictionCreate) -> Prediction:
+    prediction = Prediction(**_prepare_payload(_prediction_row(payload)))
+    session.add(prediction)
+    await session.commit()
+    await session.refresh(prediction)
     
+    _schedule_broadcast([prediction])
     return prediction
 
 
+async def persist_predictions(session: AsyncSession, payloads: List[PredictionCreate]) -> int:
+    """Store several predictions with one multi-row INSERT and one commit; each is still broadcast"""
+    if not payloads:
+        return 0
+    rows = []
+    for payload in payloads:
+        row = _prediction_row(payload)  # already keyed by table column, no renames needed
+        row["id"] = uuid4()  # assigned here so the broadcast can carry it
+        rows.append(row)
+    await session.execute(Prediction.__table__.insert(), rows)
+    await session.commit()
+    
+    _schedule_broadcast(rows)
+    return len(rows)
+
+
 async def run_prediction_workflow(session: AsyncSession, payload: PredictionRequest) -> Prediction:
     ai_result = await call_ai_service(payload)
     logger.info("AI service responded {}", ai_result)
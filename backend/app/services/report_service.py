@@ -1,11 +1,12 @@
 import csv
 from datetime import datetime
 from pathlib import Path
-from typing import List, Sequence
+from typing import AsyncIterator, List, Optional, Sequence
 
 from fpdf import FPDF
 from loguru import logger
 from sqlalchemy import and_, select
+from sqlalchemy.engine import Row
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import get_settings
@@ -17,19 +18,25 @@ settings = get_settings()
 settings.reports_dir.mkdir(parents=True, exist_ok=True)
 
 
-async def _fetch_rows(session: AsyncSession, params: ReportRequest) -> Sequence[SensorData]:
-    # Only select columns that exist in the database (exclude readings and raw_payload if they don't exist)
+# Reports cover at most the newest REPORT_MAX_ROWS matching readings, written oldest first
+REPORT_MAX_ROWS = 5000
+# PDF reports only list the first PDF_MAX_ROWS of them
+PDF_MAX_ROWS = 200
+CSV_FIELDNAMES = ("timestamp", "machine_id", "sensor_id", "value", "status")
+# Rows pulled from the DB cursor (and handed to csv.writerows) at a time
+REPORT_FETCH_BATCH = 1000
+
+
+async def _fetch_rows(
+    session: AsyncSession, params: ReportRequest, limit: Optional[int] = None
+) -> AsyncIterator[Sequence[Row]]:
+    """Stream the report rows in chronological order straight from the DB cursor, in batches"""
     stmt = select(
-        SensorData.id,
-        SensorData.sensor_id,
-        SensorData.machine_id,
         SensorData.timestamp,
+        SensorData.machine_id,
+        SensorData.sensor_id,
         SensorData.value,
         SensorData.status,
-        SensorData.metadata_json,
-        SensorData.idempotency_key,
-        SensorData.created_at,
-        SensorData.updated_at
     )
     filters = []
     if params.machine_id:
@@ -42,82 +49,80 @@ async def _fetch_rows(session: AsyncSession, params: ReportRequest) -> Sequence[
         filters.append(SensorData.timestamp <= params.date_to)
     if filters:
         stmt = stmt.where(and_(*filters))
-    # Optimize: Order by timestamp desc and limit to 5000 rows max for faster CSV generation
-    stmt = stmt.order_by(SensorData.timestamp.desc()).limit(5000)
-    result = await session.execute(stmt)
-    # Convert to SensorData-like objects
-    rows = []
-    for row in result.all():
-        # Create a simple object with the attributes we need
-        class SensorDataRow:
-            def __init__(self, row_data):
-                self.id = row_data.id
-                self.sensor_id = row_data.sensor_id
-                self.machine_id = row_data.machine_id
-                self.timestamp = row_data.timestamp
-                self.value = row_data.value
-                self.status = row_data.status
-                self.metadata = row_data.metadata_json
-        rows.append(SensorDataRow(row))
-    # Reverse to chronological order for CSV
-    return list(reversed(rows))
-
-
-def _write_csv(rows: Sequence[SensorData], path: Path) -> None:
-    fieldnames = ["timestamp", "machine_id", "sensor_id", "value", "status"]
+    # Newest REPORT_MAX_ROWS first (ix_sensor_data_machine_ts / ix_sensor_data_timestamp),
+    # re-ordered ascending in SQL so rows can be written as they arrive instead of being
+    # collected and reversed
+    latest = stmt.order_by(SensorData.timestamp.desc()).limit(REPORT_MAX_ROWS).subquery()
+    stmt = select(latest).order_by(latest.c.timestamp.asc())
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    # Server-side cursor paged REPORT_FETCH_BATCH rows at a time rather than buffering them all
+    result = await session.stream(stmt.execution_options(yield_per=REPORT_FETCH_BATCH))
+    async for partition in result.partitions():
+        yield partition
+
+
+async def _write_csv(batches: AsyncIterator[Sequence[Row]], path: Path) -> int:
+    """Write streamed row batches to a CSV file, returns the number of data rows written"""
+    count = 0
     try:
-        # Use buffered writing for better performance
-        with path.open("w", newline="", encoding="utf-8", buffering=8192) as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            # Batch write for better performance
-            batch_size = 100
-            for i in range(0, len(rows), batch_size):
-                batch = rows[i:i + batch_size]
-                for row in batch:
-                    try:
-                        writer.writerow(
-                            {
-                                "timestamp": row.timestamp.isoformat() if row.timestamp else "",
-                                "machine_id": str(row.machine_id) if row.machine_id else "",
-                                "sensor_id": str(row.sensor_id) if row.sensor_id else "",
-                                "value": float(row.value) if row.value is not None else 0.0,
-                                "status": str(row.status) if row.status else "unknown",
-                            }
-                        )
-                    except Exception as e:
-                        logger.warning("Error writing CSV row: {}", e)
-                        continue
-        logger.info("CSV file written successfully: {} ({} rows)", path, len(rows))
+        # 1 MiB buffer: a 5000 row report goes out in a handful of writes
+        with path.open("w", newline="", encoding="utf-8", buffering=1 << 20) as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(CSV_FIELDNAMES)
+            async for rows in batches:
+                # writerows iterates in C; a malformed row now fails the report instead of being skipped
+                writer.writerows(
+                    (
+                        row.timestamp.isoformat() if row.timestamp else "",
+                        str(row.machine_id) if row.machine_id else "",
+                        str(row.sensor_id) if row.sensor_id else "",
+                        float(row.value) if row.value is not None else 0.0,
+                        str(row.status) if row.status else "unknown",
+                    )
+                    for row in rows
+                )
+                count += len(rows)
+        logger.info("CSV file written successfully: {} ({} rows)", path, count)
     except Exception as e:
         logger.error("Error writing CSV file: {}", e, exc_info=True)
         raise
+    return count
+
+
+async def _write_csv_report(session: AsyncSession, params: ReportRequest, path: Path) -> None:
+    """Stream the report rows into a CSV file, published under its name only once complete"""
+    partial = path.with_name(path.name + ".part")
+    try:
+        count = await _write_csv(_fetch_rows(session, params), partial)
+    except Exception:
+        partial.unlink(missing_ok=True)
+        raise
+    if not count:
+        partial.unlink(missing_ok=True)
+        raise ValueError("No data found for the selected criteria")
+    partial.replace(path)
 
 
-def _write_pdf(rows: Sequence[SensorData], path: Path) -> None:
+def _write_pdf(rows: Sequence[Row], path: Path) -> None:
     pdf = FPDF()
     pdf.add_page()
     pdf.set_font("Arial", "B", 14)
     pdf.cell(0, 10, "Predictive Maintenance Report", ln=True)
     pdf.set_font("Arial", size=10)
-    for row in rows[:200]:
-        pdf.multi_cell(
-            0,
-            8,
-            f"{row.timestamp.isoformat()} | Machine {row.machine_id} | Sensor {row.sensor_id} -> {float(row.value)} ({row.status})",
-        )
+    # One multi_cell over the joined lines: FPDF lays out the whole body in a single call
+    # (per-row calls also left the cursor at the right margin, failing on the second row)
+    body = "\n".join(
+        f"{row.timestamp.isoformat()} | Machine {row.machine_id} | Sensor {row.sensor_id} -> {float(row.value)} ({row.status})"
+        for row in rows
+    )
+    pdf.multi_cell(0, 8, body)
     pdf.output(str(path))
 
 
 async def generate_report_fast(session: AsyncSession, params: ReportRequest) -> ReportResponse:
     """Fast CSV generation optimized for speed"""
     try:
-        rows = await _fetch_rows(session, params)
-        logger.info("Fetched {} rows for fast CSV report", len(rows))
-        
-        if not rows:
-            raise ValueError("No data found for the selected criteria")
-        
         timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
         file_name = f"report_{timestamp}.csv"
         report_path = settings.reports_dir / file_name
@@ -126,7 +131,7 @@ async def generate_report_fast(session: AsyncSession, params: ReportRequest) ->
         settings.reports_dir.mkdir(parents=True, exist_ok=True)
 
         # Fast CSV writing
-        _write_csv(rows, report_path)
+        await _write_csv_report(session, params, report_path)
 
         logger.info("Fast CSV report generated at {}", report_path)
         
@@ -145,14 +150,6 @@ async def generate_report_fast(session: AsyncSession, params: ReportRequest) ->
 
 async def generate_report(session: AsyncSession, params: ReportRequest) -> ReportResponse:
     try:
-        rows = await _fetch_rows(session, params)
-        logger.info("Fetched {} rows for report", len(rows))
-        
-        if not rows:
-            logger.warning("No data found for report generation")
-            # Return empty report or raise error
-            raise ValueError("No data found for the selected criteria")
-        
         timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
         file_name = f"report_{timestamp}.{params.format}"
         report_path = settings.reports_dir / file_name
@@ -161,18 +158,23 @@ async def generate_report(session: AsyncSession, params: ReportRequest) -> Repor
         settings.reports_dir.mkdir(parents=True, exist_ok=True)
 
         if params.format == "pdf":
+            rows = [row async for batch in _fetch_rows(session, params, limit=PDF_MAX_ROWS) for row in batch]
+            logger.info("Fetched {} rows for report", len(rows))
+            if not rows:
+                logger.warning("No data found for report generation")
+                raise ValueError("No data found for the selected criteria")
             _write_pdf(rows, report_path)
         elif params.format == "csv":
-            _write_csv(rows, report_path)
+            await _write_csv_report(session, params, report_path)
         elif params.format == "xlsx":
             # For now, generate CSV for xlsx requests (can add openpyxl later)
             logger.warning("XLSX format requested, generating CSV instead")
             file_name = f"report_{timestamp}.csv"
             report_path = settings.reports_dir / file_name
-            _write_csv(rows, report_path)
+            await _write_csv_report(session, params, report_path)
         else:
             # Default to CSV
-            _write_csv(rows, report_path)
+            await _write_csv_report(session, params, report_path)
 
         logger.info("Report generated at {}", report_path)
         
@@ -0,0 +1,390 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.models.machine_state import MachineStateTransition
+from app.services.machine_state_manager import MachineStateService
+
+
+@pytest.mark.asyncio
+async def test_state_statistics_accumulates_durations(session):
+    start = datetime(2026, 1, 1, 8, 0, 0)
+    end = start + timedelta(hours=4)
+    for offset_min, from_state, to_state in [
+        (0, None, "HEATING"),
+        (30, "HEATING", "PRODUCTION"),
+        (150, "PRODUCTION", "IDLE"),
+        (180, "IDLE", "PRODUCTION"),
+    ]:
+        session.add(MachineStateTransition(
+            machine_id="m-1",
+            from_state=from_state,
+            to_state=to_state,
+            transition_time=start + timedelta(minutes=offset_min),
+        ))
+    await session.commit()
+
+    stats = await MachineStateService(session).get_state_statistics("m-1", start, end)
+
+    assert stats.heating_hours == pytest.approx(0.5)
+    assert stats.idle_hours == pytest.approx(0.5)
+    assert stats.production_hours == pytest.approx(3.0)
+    assert stats.production_percentage == pytest.approx(75.0)
+    assert stats.production_cycles == 2
+    assert stats.total_production_time == pytest.approx(3 * 3600)
+    assert stats.total_transitions == 4
+
+
+@pytest.mark.asyncio
+async def test_state_statistics_reads_duration_rollup(session):
+    start = datetime(2026, 1, 1, 8, 0, 0)
+    end = start + timedelta(hours=4)
+    service = MachineStateService(session)
+    transitions = [
+        (0, None, "HEATING"),
+        (30, "HEATING", "PRODUCTION"),
+        (150, "PRODUCTION", "IDLE"),
+        (180, "IDLE", "PRODUCTION"),
+    ]
+    for i, (offset_min, from_state, to_state) in enumerate(transitions):
+        at = start + timedelta(minutes=offset_min)
+        session.add(MachineStateTransition(
+            machine_id="m-2", from_state=from_state, to_state=to_state, transition_time=at,
+        ))
+        if from_state:
+            since = start + timedelta(minutes=transitions[i - 1][0])
+            await service._add_state_duration("m-2", from_state, since, at)
+    await session.commit()
+
+    stats = await service.get_state_statistics("m-2", start, end)
+
+    assert stats.heating_hours == pytest.approx(0.5)
+    assert stats.idle_hours == pytest.approx(0.5)
+    assert stats.production_hours == pytest.approx(3.0)
+    assert stats.production_cycles == 2
+    assert stats.total_transitions == 4
+
+
+async def _seed_rollup(session, service, machine_id, start, transitions, rollup_from=None):
+    for i, (offset_min, from_state, to_state) in enumerate(transitions):
+        at = start + timedelta(minutes=offset_min)
+        session.add(MachineStateTransition(
+            machine_id=machine_id, from_state=from_state, to_state=to_state, transition_time=at,
+        ))
+        if from_state and (rollup_from is None or at > rollup_from):
+            since = start + timedelta(minutes=transitions[i - 1][0])
+            if rollup_from is not None:
+                since = max(since, rollup_from)
+            await service._add_state_duration(machine_id, from_state, since, at)
+    await session.commit()
+
+
+@pytest.mark.asyncio
+async def test_state_statistics_clips_rollup_edge_hours(session):
+    start = datetime(2026, 1, 1, 8, 0, 0)
+    service = MachineStateService(session)
+    await _seed_rollup(session, service, "m-3", start, [
+        (0, None, "HEATING"),
+        (30, "HEATING", "PRODUCTION"),
+        (150, "PRODUCTION", "IDLE"),
+        (180, "IDLE", "PRODUCTION"),
+    ])
+
+    window_start = start + timedelta(minutes=45)
+    window_end = start + timedelta(hours=3, minutes=15)
+    stats = await service.get_state_statistics("m-3", window_start, window_end)
+
+    assert stats.heating_hours == pytest.approx(0.0)
+    assert stats.idle_hours == pytest.approx(0.5)
+    assert stats.production_hours == pytest.approx(2.0)
+    assert stats.production_percentage == pytest.approx(80.0)
+    assert stats.production_percentage + stats.idle_percentage == pytest.approx(100.0)
+
+
+@pytest.mark.asyncio
+async def test_state_statistics_falls_back_before_rollup_starts(session):
+    start = datetime(2026, 1, 1, 8, 0, 0)
+    service = MachineStateService(session)
+    # Rollup only populated from 10:00, as after deploying it onto existing history
+    await _seed_rollup(session, service, "m-4", start, [
+        (0, None, "HEATING"),
+        (30, "HEATING", "PRODUCTION"),
+        (150, "PRODUCTION", "IDLE"),
+        (180, "IDLE", "PRODUCTION"),
+    ], rollup_from=start + timedelta(hours=2))
+
+    stats = await service.get_state_statistics("m-4", start, start + timedelta(hours=4))
+
+    assert stats.heating_hours == pytest.approx(0.5)
+    assert stats.idle_hours == pytest.approx(0.5)
+    assert stats.production_hours == pytest.approx(3.0)
+
+
+@pytest.mark.asyncio
+async def test_thresholds_are_cached_until_invalidated(session, monkeypatch):
+    from app.services import machine_state_manager
+
+    service = MachineStateService(session)
+    calls = []
+
+    async def fake_get_machine_thresholds(machine_id):
+        calls.append(machine_id)
+        return None
+
+    monkeypatch.setattr(service, "get_machine_thresholds", fake_get_machine_thresholds)
+
+    await service.initialize_machine_detector("m-cache")
+    await service.initialize_machine_detector("m-cache")
+    assert calls == ["m-cache"]
+
+    machine_state_manager.invalidate_thresholds_cache("m-cache")
+    await service.initialize_machine_detector("m-cache")
+    assert calls == ["m-cache", "m-cache"]
+
+
+def test_detector_registry_evicts_least_recently_used(monkeypatch):
+    from collections import OrderedDict
+
+    from app.services import machine_state_service
+
+    monkeypatch.setattr(machine_state_service, "_machine_detectors", OrderedDict())
+    monkeypatch.setattr(machine_state_service, "MAX_MACHINE_DETECTORS", 2)
+
+    machine_state_service.get_machine_detector("old")
+    machine_state_service.get_machine_detector("recent")
+    machine_state_service.get_machine_detector("old")
+    machine_state_service.get_machine_detector("new")
+
+    assert set(machine_state_service._machine_detectors) == {"old", "new"}
+
+
+@pytest.mark.asyncio
+async def test_process_sensor_reading_persists_transition_once(session, monkeypatch):
+    from sqlalchemy import func, select
+
+    from app.models.machine_state import MachineState, MachineStateDurationRollup
+    from app.services import notification_service
+    from app.services.machine_state_service import SensorReading, remove_machine_detector
+
+    monkeypatch.setattr(notification_service, "email_configured", lambda: False)
+    commits = []
+    original_commit = session.commit
+
+    async def counting_commit():
+        commits.append(1)
+        await original_commit()
+
+    monkeypatch.setattr(session, "commit", counting_commit)
+    remove_machine_detector("m-3")
+
+    # Warm and not turning: OFF -> IDLE on the first reading
+    reading = SensorReading(
+        timestamp=datetime.utcnow(), screw_rpm=0.0, pressure_bar=0.5,
+        temp_zone_1=180.0, temp_zone_2=181.0, temp_zone_3=182.0, temp_zone_4=183.0,
+    )
+    state = await MachineStateService(session).process_sensor_reading("m-3", reading)
+
+    assert state.state.value == "IDLE"
+    assert len(commits) == 1
+    transitions = await session.scalar(
+        select(func.count(MachineStateTransition.id)).where(MachineStateTransition.machine_id == "m-3")
+    )
+    states = await session.scalar(select(func.count(MachineState.id)).where(MachineState.machine_id == "m-3"))
+    rollup_states = (await session.scalars(
+        select(MachineStateDurationRollup.state).where(MachineStateDurationRollup.machine_id == "m-3")
+    )).all()
+    assert transitions == 1
+    assert states == 1
+    assert set(rollup_states) <= {"OFF"}
+    remove_machine_detector("m-3")
+
+
+def test_stability_metric_tracks_sliding_window():
+    import statistics
+
+    from app.services.machine_state_service import MachineStateDetector, SensorReading
+
+    detector = MachineStateDetector("m-stable")
+    rpms = [50.0 + (i % 7) * 0.5 for i in range(700)]
+    for rpm in rpms:
+        detector.add_reading(SensorReading(timestamp=datetime.utcnow(), screw_rpm=rpm, pressure_bar=None))
+
+    assert detector._calculate_stability_metric("screw_rpm") == pytest.approx(statistics.stdev(rpms[-600:]))
+    assert detector._calculate_stability_metric("pressure_bar") is None
+
+
+def test_temperature_slope_window_matches_rescan():
+    from app.services import machine_state_service
+
+    detector = machine_state_service.MachineStateDetector("m-slope")
+    now = datetime(2026, 1, 1)
+    history = []
+    for i in range(500):
+        now += timedelta(seconds=2 if i % 50 else 20)  # 2 s cadence with occasional gaps
+        temp = 150.0 + i * 0.1
+        history = (history + [(now, temp)])[-machine_state_service.TEMP_HISTORY_SIZE:]
+        slope = detector._calculate_temperature_slope(temp, now)
+
+        window = [t for ts, t in history if timedelta(minutes=5) <= now - ts <= timedelta(minutes=6)]
+        if len(history) < 120 or not window:
+            assert slope is None
+        else:
+            assert slope == pytest.approx((temp - sum(window) / len(window)) / 5.0)
+
+
+def test_state_decision_tree_handles_missing_values():
+    from app.services.machine_state_service import (
+        _STATE_BY_ID, DerivedMetrics, MachineState, MachineStateDetector, SensorReading,
+    )
+
+    detector = MachineStateDetector("m-tree")
+    now = datetime.utcnow()
+    cases = [
+        (SensorReading(now, screw_rpm=50.0, pressure_bar=20.0), DerivedMetrics(), MachineState.PRODUCTION, 0.9),
+        (SensorReading(now, screw_rpm=50.0, motor_load=0.5, throughput_kg_h=2.0), DerivedMetrics(), MachineState.PRODUCTION, 0.7),
+        (SensorReading(now, screw_rpm=0.0), DerivedMetrics(temp_avg=30.0), MachineState.OFF, 0.9),
+        (SensorReading(now, screw_rpm=0.0), DerivedMetrics(), MachineState.OFF, 0.7),
+        (SensorReading(now, screw_rpm=0.0), DerivedMetrics(temp_avg=180.0, d_temp_avg=-1.0), MachineState.COOLING, 0.8),
+        (SensorReading(now, screw_rpm=7.0), DerivedMetrics(temp_avg=180.0, d_temp_avg=1.0), MachineState.HEATING, 0.8),
+        (SensorReading(now, screw_rpm=0.0, pressure_bar=1.0), DerivedMetrics(temp_avg=180.0), MachineState.IDLE, 0.6),
+        (SensorReading(now, screw_rpm=0.0), DerivedMetrics(temp_avg=180.0, d_temp_avg=0.0), MachineState.IDLE, 0.8),
+        (SensorReading(now, screw_rpm=7.0), DerivedMetrics(temp_avg=180.0), MachineState.OFF, 0.4),
+    ]
+    for reading, metrics, expected_state, expected_confidence in cases:
+        state_id, confidence = detector._determine_state(reading, metrics)
+        assert (_STATE_BY_ID[state_id], confidence) == (expected_state, expected_confidence)
+
+
+def test_production_entry_requires_consecutive_readings():
+    from app.services.machine_state_service import MachineState, MachineStateDetector, SensorReading
+
+    detector = MachineStateDetector("m-enter")
+
+    def feed(pressure, count=1):
+        for _ in range(count):
+            state = detector.add_reading(SensorReading(
+                timestamp=datetime.utcnow(), screw_rpm=50.0, pressure_bar=pressure,
+                temp_zone_1=180.0, temp_zone_2=181.0,
+            ))
+        return state.state
+
+    assert feed(20.0, 9) == MachineState.OFF
+    # Pressure below P_PROD (fallback criteria only) breaks the run
+    assert feed(3.0) == MachineState.OFF
+    assert feed(20.0, 9) == MachineState.OFF
+    assert feed(20.0) == MachineState.PRODUCTION
+
+
+def test_bulk_readings_match_scalar_rules():
+    import itertools
+    import statistics
+
+    import numpy as np
+
+    from app.services import machine_state_service as mss
+
+    th = mss.StateThresholds()
+    grid = np.array(list(itertools.product(
+        [0.0, 5.0, 7.0, 50.0], [np.nan, 0.0, 2.9, 5.0], [np.nan, 30.0, 180.0],
+        [np.nan, -1.0, 0.0, 1.0], [np.nan, 0.5], [np.nan, 2.0],
+    )))
+    ids, confidences = mss._classify_states(*grid.T, th)
+    for row, state_id, confidence in zip(grid, ids, confidences):
+        assert (state_id, confidence) == mss._classify_state_py(
+            *row, th.RPM_ON, th.RPM_PROD, th.P_ON, th.P_PROD, th.T_MIN_ACTIVE, th.HEATING_RATE,
+            th.COOLING_RATE, th.TEMP_FLAT_RATE, th.MOTOR_LOAD_MIN, th.THROUGHPUT_MIN,
+        )
+
+    # 700 rows at 2 s: steady production with a little RPM noise
+    n = 700
+    arr = np.full((n, len(mss.READING_FIELDS)), np.nan)
+    arr[:, 0] = 50.0 + (np.arange(n) % 7) * 0.5
+    arr[:, 1] = 20.0
+    arr[:, 2:6] = 180.0
+    ts = np.datetime64("2026-01-01T08:00:00") + np.arange(n) * np.timedelta64(2, "s")
+
+    detector = mss.MachineStateDetector("m-bulk")
+    state = detector.add_readings_bulk(arr, ts)
+
+    assert state.state == mss.MachineState.PRODUCTION
+    assert state.metrics.rpm_stable == pytest.approx(statistics.stdev(arr[-600:, 0]))
+    assert state.metrics.d_temp_avg == pytest.approx(0.0)
+    assert detector._filled == mss.READING_BUFFER_SIZE
+    assert detector._calculate_stability_metric("screw_rpm") == pytest.approx(state.metrics.rpm_stable)
+    assert detector._consec_prod == n
+
+
+@pytest.mark.asyncio
+async def test_state_writer_batches_queued_transitions(session, monkeypatch):
+    import asyncio
+
+    from sqlalchemy import func, select
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+    from app.db import session as db_session
+    from app.models.machine_state import MachineState
+    from app.services import machine_state_service as mss
+
+    monkeypatch.setattr(
+        db_session, "AsyncSessionLocal",
+        async_sessionmaker(session.bind, expire_on_commit=False, class_=AsyncSession),
+    )
+    monkeypatch.setattr(mss, "_state_write_queue", asyncio.Queue())
+    mss.start_state_writer(asyncio.get_running_loop())
+
+    detector = mss.MachineStateDetector("m-queue")
+    for state in (mss.MachineState.HEATING, mss.MachineState.IDLE, mss.MachineState.PRODUCTION):
+        detector.current_state.state = state
+        await mss.enqueue_machine_state(session, "m-queue", detector.current_state)
+    await mss.stop_state_writer()
+
+    states = (await session.scalars(
+        select(MachineState.state).where(MachineState.machine_id == "m-queue")
+    )).all()
+    assert sorted(states) == ["HEATING", "IDLE", "PRODUCTION"]
+    assert await session.scalar(select(func.count(MachineState.id))) == 3
+
+
+def test_add_reading_transition_snapshots_previous_state():
+    from app.services.machine_state_service import MachineState, MachineStateDetector, SensorReading
+
+    detector = MachineStateDetector("m-transition")
+
+    def feed(rpm):
+        return detector.add_reading_transition(SensorReading(
+            timestamp=datetime.utcnow(), screw_rpm=rpm, pressure_bar=20.0,
+            temp_zone_1=180.0, temp_zone_2=181.0,
+        ))
+
+    # Production entry needs 10 consecutive readings; no transition before that
+    transitions = [feed(50.0) for _ in range(10)]
+    assert transitions[:-1] == [None] * 9
+    previous, current = transitions[-1]
+    assert (previous.state, current.state) == (MachineState.OFF, MachineState.PRODUCTION)
+    assert previous is not current
+    assert feed(50.0) is None
+
+
+def test_event_log_flushes_when_full(monkeypatch):
+    from app.services import machine_state_service as mss
+
+    flushed = []
+
+    class RecordingDetector(mss.MachineStateDetector):
+        def flush_events(self):
+            count = super().flush_events()
+            flushed.append(count)
+            return count
+
+    monkeypatch.setattr(mss, "EVENT_LOG_SIZE", 4)
+    detector = RecordingDetector("m-events")
+
+    # Steady OFF readings never change state, so only a full buffer triggers a flush
+    for _ in range(10):
+        detector.add_reading(mss.SensorReading(
+            timestamp=datetime.utcnow(), screw_rpm=0.0, pressure_bar=0.0,
+            temp_zone_1=25.0, temp_zone_2=25.0,
+        ))
+
+    assert flushed == [4, 4]
+    assert len(detector._event_log) == 2
@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app.services.mssql_extruder_poller import (
+    SMALL_WINDOW_ROWS,
+    ExtruderSqlRow,
+    MSSQLExtruderPoller,
+    _window_features_numpy,
+    _window_features_small,
+)
+
+
+def make_poller(window_minutes=2):
+    return MSSQLExtruderPoller(
+        enabled=False, host="", port=1433, username="", password="", database="HISTORISCH",
+        table="Tab_Actual", poll_interval_seconds=1, window_minutes=window_minutes,
+        max_rows_per_poll=100, machine_name="m", sensor_name="s",
+    )
+
+
+def test_window_features_match_full_recompute():
+    rng = np.random.default_rng(7)
+    poller = make_poller()
+    start = datetime(2026, 1, 1, 8, 0, 0)
+    rows = [
+        ExtruderSqlRow(start + timedelta(seconds=5 * i), *rng.uniform(0.0, 200.0, size=6))
+        for i in range(100)
+    ]
+    for i in range(0, len(rows), 7):
+        poller._window.extend(rows[i:i + 7])
+        poller._trim_window()
+
+    # 2 minute window at 5 s cadence, cutoff inclusive
+    kept = rows[-25:]
+    assert len(poller._window) == len(kept)
+    assert poller._window.last_trend_date() == kept[-1].trend_date
+
+    readings, meta = poller._compute_features()
+    cols = np.array([[r.screw_speed_rpm, r.pressure_bar, r.temp_zone1_c, r.temp_zone2_c,
+                      r.temp_zone3_c, r.temp_zone4_c] for r in kept]).T
+    rpm, pressure = cols[0], cols[1]
+    temp_avg = cols[2:].mean(axis=0)
+    features = meta["features"]
+
+    assert meta["window_size"] == len(kept)
+    assert features["rpm_ma"] == pytest.approx(rpm.mean())
+    assert features["pressure_std"] == pytest.approx(pressure.std())
+    assert features["temp_avg_delta"] == pytest.approx(temp_avg[-1] - temp_avg[-2])
+    assert features["temp_zone4_delta_from_ma"] == pytest.approx(cols[5, -1] - cols[5].mean())
+    assert features["corr_pressure_rpm"] == pytest.approx(np.corrcoef(pressure, rpm)[0, 1])
+    assert features["corr_tempavg_rpm"] == pytest.approx(np.corrcoef(temp_avg, rpm)[0, 1])
+    assert readings["temperature"] == pytest.approx(temp_avg[-1])
+    assert readings["rpm_delta"] == pytest.approx(rpm[-1] - rpm[-2])
+
+
+@pytest.mark.parametrize("n", [2, 3, 8, SMALL_WINDOW_ROWS])
+@pytest.mark.parametrize("constant_pressure", [False, True])
+def test_small_window_features_match_numpy(n, constant_pressure):
+    rng = np.random.default_rng(n)
+    values = rng.uniform(0.0, 200.0, size=(6, n))
+    if constant_pressure:
+        values[1] = 80.0
+    assert _window_features_small(values) == pytest.approx(_window_features_numpy(values).tolist())
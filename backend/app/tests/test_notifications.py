@@ -1,3 +1,5 @@
+from types import SimpleNamespace
+
 import pytest
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
@@ -36,3 +38,82 @@ def test_test_email_endpoint_success(test_client):
     assert response.json()["ok"] is True
     assert "message" in response.json()
 
+
+
+@pytest.mark.asyncio
+async def test_queued_emails_share_one_smtp_session(monkeypatch):
+    sessions = []
+
+    class FakeSMTP:
+        def __init__(self, **kwargs):
+            self.is_connected = False
+            self.sent = []
+            sessions.append(self)
+
+        async def connect(self):
+            self.is_connected = True
+
+        async def send_message(self, message):
+            self.sent.append(message["To"])
+
+        async def quit(self):
+            self.is_connected = False
+
+        def close(self):
+            self.is_connected = False
+
+    monkeypatch.setattr(notification_service.aiosmtplib, "SMTP", FakeSMTP)
+    monkeypatch.setattr(notification_service, "email_configured", lambda: True)
+
+    await notification_service._send_email("a", "body", to_override="one@example.com")
+    await notification_service._send_email("b", "body", to_override="two@example.com")
+    await notification_service.stop_email_worker()
+
+    assert len(sessions) == 1
+    assert sessions[0].sent == ["one@example.com", "two@example.com"]
+
+
+@pytest.mark.asyncio
+async def test_alarm_notifications_go_through_one_worker(monkeypatch):
+    sent = []
+
+    async def fake_email(subject, body):
+        sent.append(("email", subject))
+        raise ValueError("Email SMTP credentials not configured")
+
+    async def fake_slack(body):
+        sent.append(("slack", body["text"]))
+
+    monkeypatch.setattr(notification_service, "_send_email", fake_email)
+    monkeypatch.setattr(notification_service, "_send_slack", fake_slack)
+
+    alarm = SimpleNamespace(severity="critical", machine_id="m1", status="open", message="Pressure high")
+    notification_service.enqueue_alarm_notification(alarm, None)
+    notification_service.enqueue_alarm_notification(alarm, None)
+    await notification_service.stop_notification_worker()
+
+    # A failing email does not stop the worker from sending the rest
+    assert sent == [
+        ("email", "[PM] CRITICAL alarm on m1"),
+        ("slack", "[PM] CRITICAL alarm on m1"),
+    ] * 2
+
+
+def test_test_email_endpoint_reports_smtp_login_failure(monkeypatch):
+    class FailingSMTP:
+        def __init__(self, **kwargs):
+            self.is_connected = False
+
+        async def connect(self):
+            raise notification_service.aiosmtplib.SMTPAuthenticationError(535, "5.7.8 BadCredentials")
+
+    monkeypatch.setattr(notification_service.aiosmtplib, "SMTP", FailingSMTP)
+    monkeypatch.setattr(notification_service, "email_configured", lambda: True)
+
+    app = FastAPI()
+    app.include_router(router)
+    response = TestClient(app).post("/notifications/test-email", json={"to": "demo@example.com"})
+
+    assert response.status_code == 502
+    assert response.json()["ok"] is False
+    assert "authentication failed" in response.json()["error"]